@@ -0,0 +1,128 @@
+"""Filas devueltas y tiempo de las consultas por clase con JOIN frente a EXISTS.
+
+Las consultas de cuestionarios y resultados de una clase unían TEMEARIOS_CUESTIONARIOS,
+así que cada fila salía una vez por cada temario de la clase enlazado al cuestionario.
+Este script crea una clase con --temarios temarios, --cuestionarios cuestionarios
+enlazados cada uno a --enlaces temarios y --usuarios usuarios con un resultado por
+cuestionario, y compara las filas devueltas y el tiempo medio de la consulta antigua
+(JOIN) y la actual (_cuestionario_en_clase, EXISTS).
+
+    python benchmarks/filas_por_clase.py --enlaces 5 --usuarios 200
+
+Por defecto usa SQLite en memoria; con --url se puede medir contra una base de datos
+vacía de pruebas (las tablas se crean y se rellenan en ella).
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault("DB_AUTO_MIGRATE", "false")
+
+from sqlalchemy import create_engine, insert, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import main  # noqa: E402
+from main import Clase, Cuestionario, ResultadoCuestionario, Rol, Temario, TemarioCuestionario, Usuario  # noqa: E402
+
+
+def _poblar(db, args):
+    ahora = datetime.utcnow()
+    db.execute(insert(Rol), [{"id_roles": 1, "rol": "alumno"}])
+    db.execute(insert(Clase), [{"id_clases": 1, "nombre_clases": "Clase de prueba", "descripcion_clases": ""}])
+    db.execute(insert(Temario), [{"id_temario": t, "id_clases": 1, "nombre_temario": f"Temario {t}", "descrip_temario": ""} for t in range(1, args.temarios + 1)])
+    db.execute(insert(Cuestionario), [{"id_questionario": c, "nombre_cuestionario": f"Cuestionario {c}", "descrip_cuestionario": ""} for c in range(1, args.cuestionarios + 1)])
+    db.execute(
+        insert(TemarioCuestionario),
+        [
+            {"id_clases": 1, "id_questionario": c, "id_temario": (c + e) % args.temarios + 1}
+            for c in range(1, args.cuestionarios + 1)
+            for e in range(min(args.enlaces, args.temarios))
+        ],
+    )
+    db.execute(
+        insert(Usuario),
+        [
+            {"id_usuarios": u, "id_roles": 1, "usuario": f"usuario{u}", "email": f"usuario{u}@monlab.test", "contrasena": "x", "estado": "activa"}
+            for u in range(1, args.usuarios + 1)
+        ],
+    )
+    db.execute(
+        insert(ResultadoCuestionario),
+        [
+            {"id_questionario": c, "id_usuarios": u, "nota": 5, "fecha_completado": ahora, "total_correctas": 5, "total_falladas": 5}
+            for u in range(1, args.usuarios + 1)
+            for c in range(1, args.cuestionarios + 1)
+        ],
+    )
+    db.commit()
+
+
+def _consultas(db):
+    # Se cuentan las filas que devuelve la base de datos: db.query(Entidad) deduplica en
+    # Python las entidades repetidas, pero la base de datos las envía igualmente
+    return {
+        "cuestionarios_por_clase": (
+            lambda: db.execute(
+                select(Cuestionario.id_questionario, Cuestionario.nombre_cuestionario)
+                .join(TemarioCuestionario, Cuestionario.id_questionario == TemarioCuestionario.id_questionario)
+                .where(TemarioCuestionario.id_clases == 1)
+            ).all(),
+            lambda: db.execute(
+                select(Cuestionario.id_questionario, Cuestionario.nombre_cuestionario)
+                .where(main._cuestionario_en_clase(Cuestionario.id_questionario, 1))
+            ).all(),
+        ),
+        "resultados_por_clase": (
+            lambda: db.execute(
+                select(ResultadoCuestionario.id_resultado_cuestionario, ResultadoCuestionario.nota)
+                .join(TemarioCuestionario, TemarioCuestionario.id_questionario == ResultadoCuestionario.id_questionario)
+                .where(TemarioCuestionario.id_clases == 1)
+            ).all(),
+            lambda: db.execute(
+                select(ResultadoCuestionario.id_resultado_cuestionario, ResultadoCuestionario.nota)
+                .where(main._cuestionario_en_clase(ResultadoCuestionario.id_questionario, 1))
+            ).all(),
+        ),
+    }
+
+
+def _medir(consulta, repeticiones):
+    filas = len(consulta())
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        consulta()
+    return filas, (time.perf_counter() - inicio) / repeticiones * 1000
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--temarios", type=int, default=20)
+    parser.add_argument("--cuestionarios", type=int, default=50)
+    parser.add_argument("--enlaces", type=int, default=5, help="Temarios de la clase enlazados a cada cuestionario")
+    parser.add_argument("--usuarios", type=int, default=200)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--url", help="URL SQLAlchemy de una base de datos vacía de pruebas (por defecto SQLite en memoria)")
+    args = parser.parse_args()
+
+    motor = create_engine(args.url or "sqlite://")
+    main.Base.metadata.create_all(motor)
+    db = sessionmaker(bind=motor)()
+    try:
+        _poblar(db, args)
+        print(f"{'consulta':<24} {'filas JOIN':>10} {'filas EXISTS':>12} {'JOIN ms':>9} {'EXISTS ms':>10}")
+        for nombre, (con_join, con_exists) in _consultas(db).items():
+            filas_join, ms_join = _medir(con_join, args.repeticiones)
+            filas_exists, ms_exists = _medir(con_exists, args.repeticiones)
+            print(f"{nombre:<24} {filas_join:>10} {filas_exists:>12} {ms_join:>9.1f} {ms_exists:>10.1f}")
+    finally:
+        db.close()
+        motor.dispose()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,128 @@
+"""Compara el rendimiento de la API en modo síncrono (threadpool) y asíncrono (DB_ASYNC).
+
+Arranca main:app dos veces con uvicorn, una con DB_ASYNC=false y otra con DB_ASYNC=true,
+contra la base de datos configurada en .env, y lanza el mismo número de peticiones
+concurrentes a cada una. Muestra peticiones por segundo y latencias p50/p95/p99.
+
+    python benchmarks/rendimiento_async.py --ruta /clases/ --ruta /experimentos/1/analitica \\
+        --concurrencia 64 --duracion 15
+
+Con --url-sync y --url-async se mide contra servidores ya arrancados en lugar de lanzarlos.
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentil(valores, p):
+    if not valores:
+        return float("nan")
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+async def _esperar_servidor(url, limite=30):
+    fin = time.monotonic() + limite
+    async with httpx.AsyncClient() as cliente:
+        while time.monotonic() < fin:
+            try:
+                await cliente.get(f"{url}/docs")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"El servidor {url} no arrancó en {limite} s")
+
+
+async def _medir(url, rutas, concurrencia, duracion):
+    latencias = []
+    errores = 0
+    fin = time.monotonic() + duracion
+
+    async def trabajador(cliente, indice):
+        nonlocal errores
+        i = indice
+        while time.monotonic() < fin:
+            ruta = rutas[i % len(rutas)]
+            i += 1
+            inicio = time.perf_counter()
+            try:
+                respuesta = await cliente.get(url + ruta)
+                if respuesta.status_code >= 500:
+                    errores += 1
+            except httpx.HTTPError:
+                errores += 1
+                continue
+            latencias.append(time.perf_counter() - inicio)
+
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+    async with httpx.AsyncClient(limits=limites, timeout=30) as cliente:
+        # Calentamiento: conexiones del pool de MySQL y cachés
+        await asyncio.gather(*(cliente.get(url + ruta) for ruta in rutas))
+        inicio = time.monotonic()
+        await asyncio.gather(*(trabajador(cliente, i) for i in range(concurrencia)))
+        transcurrido = time.monotonic() - inicio
+
+    return {
+        "peticiones": len(latencias),
+        "errores": errores,
+        "por_segundo": len(latencias) / transcurrido,
+        "p50_ms": _percentil(latencias, 50) * 1000,
+        "p95_ms": _percentil(latencias, 95) * 1000,
+        "p99_ms": _percentil(latencias, 99) * 1000,
+    }
+
+
+def _arrancar(puerto, asincrono, workers):
+    entorno = dict(os.environ, DB_ASYNC="true" if asincrono else "false", DB_AUTO_MIGRATE="false")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(puerto), "--workers", str(workers), "--log-level", "warning"],
+        cwd=RAIZ,
+        env=entorno,
+    )
+
+
+async def _comparar(args):
+    modos = [("sync", args.url_sync, False, args.puerto), ("async", args.url_async, True, args.puerto + 1)]
+    resultados = {}
+    for nombre, url, asincrono, puerto in modos:
+        proceso = None
+        if url is None:
+            url = f"http://127.0.0.1:{puerto}"
+            proceso = _arrancar(puerto, asincrono, args.workers)
+        try:
+            await _esperar_servidor(url)
+            resultados[nombre] = await _medir(url, args.ruta, args.concurrencia, args.duracion)
+        finally:
+            if proceso:
+                proceso.terminate()
+                proceso.wait()
+
+    print(f"{'modo':<6} {'peticiones':>10} {'errores':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<6} {r['peticiones']:>10} {r['errores']:>8} {r['por_segundo']:>9.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ruta", action="append", help="Ruta GET a medir; se puede repetir (por defecto /clases/)")
+    parser.add_argument("--concurrencia", type=int, default=32)
+    parser.add_argument("--duracion", type=float, default=10, help="Segundos de medida por modo")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de uvicorn por servidor")
+    parser.add_argument("--puerto", type=int, default=8100, help="Puerto del servidor síncrono; el asíncrono usa el siguiente")
+    parser.add_argument("--url-sync", help="URL de un servidor síncrono ya arrancado")
+    parser.add_argument("--url-async", help="URL de un servidor asíncrono ya arrancado")
+    args = parser.parse_args()
+    args.ruta = args.ruta or ["/clases/"]
+    asyncio.run(_comparar(args))
+
+
+if __name__ == "__main__":
+    main()
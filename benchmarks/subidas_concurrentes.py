@@ -0,0 +1,109 @@
+"""Latencia de GETs rápidos con y sin subidas concurrentes a /upload/.
+
+Arranca main:app con uvicorn contra la base de datos y el SFTP configurados en .env y
+mide la latencia de GET /clases/{id} durante --duracion segundos, primero sola y después
+con --subidas clientes subiendo archivos de --tamano-mb MB en bucle. Si las transferencias
+SFTP bloquearan el event loop, p95/p99 de los GET subirían con las subidas.
+
+    python benchmarks/subidas_concurrentes.py --clase 1 --subidas 4 --tamano-mb 20
+
+Con --url se mide contra un servidor ya arrancado en lugar de lanzarlo.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from rendimiento_async import _arrancar, _esperar_servidor, _percentil
+
+
+async def _medir_gets(cliente, url, ruta, concurrencia, fin):
+    latencias = []
+    errores = 0
+
+    async def trabajador():
+        nonlocal errores
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            try:
+                respuesta = await cliente.get(url + ruta)
+                if respuesta.status_code >= 500:
+                    errores += 1
+            except httpx.HTTPError:
+                errores += 1
+                continue
+            latencias.append(time.perf_counter() - inicio)
+
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    return latencias, errores
+
+
+async def _subir_en_bucle(cliente, url, contenido, fin):
+    subidas = 0
+    while time.monotonic() < fin:
+        respuesta = await cliente.post(f"{url}/upload/", files={"file": (f"carga-{os.urandom(4).hex()}.bin", contenido)})
+        respuesta.raise_for_status()
+        subidas += 1
+    return subidas
+
+
+async def _fase(url, ruta, args, con_subidas):
+    limites = httpx.Limits(max_connections=args.concurrencia + args.subidas)
+    async with httpx.AsyncClient(limits=limites, timeout=300) as cliente:
+        await cliente.get(url + ruta)
+        fin = time.monotonic() + args.duracion
+        tareas = [_medir_gets(cliente, url, ruta, args.concurrencia, fin)]
+        if con_subidas:
+            # Contenido aleatorio: cada subida es un archivo nuevo y no se deduplica por hash
+            tareas += [_subir_en_bucle(cliente, url, os.urandom(args.tamano_mb * 1024 * 1024), fin) for _ in range(args.subidas)]
+        (latencias, errores), *subidas = await asyncio.gather(*tareas)
+    return {
+        "peticiones": len(latencias),
+        "errores": errores,
+        "subidas": sum(subidas),
+        "p50_ms": _percentil(latencias, 50) * 1000,
+        "p95_ms": _percentil(latencias, 95) * 1000,
+        "p99_ms": _percentil(latencias, 99) * 1000,
+    }
+
+
+async def _comparar(args):
+    url, proceso = args.url, None
+    if url is None:
+        url = f"http://127.0.0.1:{args.puerto}"
+        proceso = _arrancar(args.puerto, False, args.workers)
+    try:
+        await _esperar_servidor(url)
+        ruta = f"/clases/{args.clase}"
+        resultados = {
+            "sin subidas": await _fase(url, ruta, args, False),
+            "con subidas": await _fase(url, ruta, args, True),
+        }
+    finally:
+        if proceso:
+            proceso.terminate()
+            proceso.wait()
+
+    print(f"{'fase':<12} {'GETs':>7} {'errores':>8} {'subidas':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<12} {r['peticiones']:>7} {r['errores']:>8} {r['subidas']:>8} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clase", type=int, default=1, help="id_clases que se consulta con GET /clases/{id}")
+    parser.add_argument("--concurrencia", type=int, default=8, help="Clientes haciendo GETs a la vez")
+    parser.add_argument("--subidas", type=int, default=4, help="Clientes subiendo archivos a la vez")
+    parser.add_argument("--tamano-mb", type=int, default=20)
+    parser.add_argument("--duracion", type=float, default=15, help="Segundos de cada fase")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--puerto", type=int, default=8100)
+    parser.add_argument("--url", help="URL de un servidor ya arrancado")
+    asyncio.run(_comparar(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,74 @@
 import os
-from fastapi.responses import JSONResponse
+import argparse
+import array
+import asyncio
+import csv
+import functools
+import hashlib
+import inspect
+import io
+import itertools
+import json
+import logging
+import math
+import mimetypes
+import posixpath
+import random
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import paramiko  # Changed back from ftplib to paramiko
-from io import BytesIO
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Depends
-from sqlalchemy import Float, create_engine, Column, Integer, String, Enum, DateTime, ForeignKey, text  
+from decimal import Decimal
+from fastapi import FastAPI, HTTPException, Depends, Query
+from sqlalchemy import BigInteger, Float, LargeBinary, create_engine, Column, Integer, String, Enum, DateTime, ForeignKey, Index, UniqueConstraint, text  
+from sqlalchemy import and_, case, delete, exists, func, insert, or_, select, update
+from sqlalchemy.dialects.mysql import MEDIUMBLOB, insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-from pydantic import BaseModel
-from typing import List, Optional
+from sqlalchemy.orm import joinedload, sessionmaker, Session, relationship
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Union
 from dotenv import load_dotenv
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Sin Pillow no se generan miniaturas
+    Image = None
+try:
+    import numpy as np
+except ImportError:  # Sin NumPy no está disponible la respuesta por columnas de los experimentos
+    np = None
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # Sin pyarrow la respuesta por columnas solo se sirve en JSON
+    pa = None
+try:
+    import redis
+except ImportError:  # Solo hace falta con CACHE_BACKEND=redis
+    redis = None
+try:
+    import fcntl
+except ImportError:  # Windows: los ficheros de la cola de resultados se bloquean con msvcrt
+    fcntl = None
+    import msvcrt
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.routing import APIRoute
 
 
 load_dotenv()
@@ -30,16 +87,266 @@ SFTP_USER = os.getenv("SFTP_USER")
 SFTP_PASSWORD = os.getenv("SFTP_PASSWORD")
 REMOTE_PATH = os.getenv("REMOTE_PATH")
 
+# Pool de sesiones SFTP: número máximo de sesiones abiertas, segundos de inactividad
+# antes de cerrarlas y segundos máximos esperando una sesión libre
+SFTP_POOL_SIZE = int(os.getenv("SFTP_POOL_SIZE", "4"))
+SFTP_POOL_IDLE_TIMEOUT = float(os.getenv("SFTP_POOL_IDLE_TIMEOUT", "300"))
+SFTP_POOL_ACQUIRE_TIMEOUT = float(os.getenv("SFTP_POOL_ACQUIRE_TIMEOUT", "30"))
+# Solo se comprueba la sesión con una petición al servidor si lleva este tiempo sin usarse
+SFTP_POOL_CHECK_AFTER = float(os.getenv("SFTP_POOL_CHECK_AFTER", "10"))
+SFTP_KEEPALIVE = int(os.getenv("SFTP_KEEPALIVE", "30"))
+# Hilos dedicados a la E/S bloqueante de paramiko (por defecto, uno por sesión del pool)
+SFTP_MAX_WORKERS = int(os.getenv("SFTP_MAX_WORKERS", str(SFTP_POOL_SIZE)))
+
+# Subidas: tamaño de cada bloque enviado al servidor SFTP y tamaño máximo por archivo (0 = sin límite)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(2 * 1024 * 1024 * 1024)))
+
+# Subidas reanudables: directorio local donde se guardan los bloques hasta finalizar,
+# tamaño de bloque por defecto/máximo y segundos sin actividad antes de borrar una sesión
+UPLOAD_STAGING_DIR = os.getenv("UPLOAD_STAGING_DIR", os.path.join(tempfile.gettempdir(), "monlab_uploads"))
+UPLOAD_SESSION_CHUNK_SIZE = int(os.getenv("UPLOAD_SESSION_CHUNK_SIZE", str(8 * 1024 * 1024)))
+UPLOAD_SESSION_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_SESSION_MAX_CHUNK_SIZE", str(64 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+# Caché local de archivos servidos por /media/: directorio, tamaño máximo en bytes,
+# segundos antes de volver a comprobar en el servidor un archivo que no es por contenido
+# y max-age de Cache-Control para esos archivos
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "monlab_media_cache"))
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+MEDIA_CACHE_REVALIDATE = float(os.getenv("MEDIA_CACHE_REVALIDATE", "60"))
+MEDIA_CACHE_MAX_AGE = int(os.getenv("MEDIA_CACHE_MAX_AGE", "300"))
+
+# Versiones reducidas de las imágenes subidas: anchos en píxeles, formato, calidad
+# y número de procesos dedicados a generarlas
+DERIVADOS_ANCHOS = [int(ancho) for ancho in os.getenv("DERIVADOS_ANCHOS", "160,480,1024").split(",") if ancho.strip()]
+DERIVADOS_FORMATO = os.getenv("DERIVADOS_FORMATO", "webp").lower()
+DERIVADOS_CALIDAD = int(os.getenv("DERIVADOS_CALIDAD", "80"))
+DERIVADOS_WORKERS = int(os.getenv("DERIVADOS_WORKERS", "2"))
+# Directorio local de las copias que se pasan a los procesos de miniaturas; separado
+# de UPLOAD_STAGING_DIR para que la purga de sesiones de subida no lo borre
+DERIVADOS_STAGING_DIR = os.getenv("DERIVADOS_STAGING_DIR", os.path.join(tempfile.gettempdir(), "monlab_derivados"))
+
+# Paginación de los listados: filas por página cuando solo se envía cursor y máximo por página
+PAGINACION_LIMITE = int(os.getenv("PAGINACION_LIMITE", "100"))
+PAGINACION_LIMITE_MAX = int(os.getenv("PAGINACION_LIMITE_MAX", "1000"))
+
+# Exportaciones de notas: filas leídas del cursor del servidor y enviadas en cada bloque
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Número máximo de resultados aceptados en un envío por lotes
+RESULTADOS_LOTE_MAX = int(os.getenv("RESULTADOS_LOTE_MAX", "1000"))
+
+# Importación de cuestionarios: documentos aceptados por petición y filas por sentencia INSERT
+IMPORTACION_MAX_DOCUMENTOS = int(os.getenv("IMPORTACION_MAX_DOCUMENTOS", "500"))
+IMPORTACION_FILAS_POR_INSERT = int(os.getenv("IMPORTACION_FILAS_POR_INSERT", "1000"))
+# Importación NDJSON: bytes máximos por línea (un cuestionario) y por petición
+IMPORTACION_MAX_BYTES_LINEA = int(os.getenv("IMPORTACION_MAX_BYTES_LINEA", str(1024 * 1024)))
+IMPORTACION_MAX_BYTES = int(os.getenv("IMPORTACION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Matriculación masiva: número máximo de usuarios y de bytes del cuerpo por importación
+MATRICULAS_MAX = int(os.getenv("MATRICULAS_MAX", "50000"))
+MATRICULAS_MAX_BYTES = int(os.getenv("MATRICULAS_MAX_BYTES", str(MATRICULAS_MAX * 256)))
+
+# Series de medidas: tipo por defecto de las muestras, máximo de muestras por serie y
+# máximo de bytes del CSV de un ensayo
+SERIES_DTYPE = os.getenv("SERIES_DTYPE", "float64")
+SERIES_MAX_MUESTRAS = int(os.getenv("SERIES_MAX_MUESTRAS", "1000000"))
+SERIES_MAX_BYTES = int(os.getenv("SERIES_MAX_BYTES", str(SERIES_MAX_MUESTRAS * 256)))
+
+# Caché de lectura del catálogo (clases, temarios, cuestionarios, experimentos, preguntas,
+# roles y analítica): número máximo de entradas y segundos que dura cada una
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+# "local" guarda la caché en cada proceso; "redis" la comparte entre todos los workers
+# del host, con las invalidaciones visibles para todos y una sola copia de cada entrada
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local").lower()
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_PREFIJO = os.getenv("CACHE_PREFIJO", "monlab")
+
+# Cache-Control de las rutas con ETag. Por defecto los clientes revalidan siempre con
+# If-None-Match; CACHE_CONTROL_RUTAS (JSON) cambia el valor de cada ruta,
+# por ejemplo {"clases": "public, max-age=60"}
+CACHE_CONTROL_POR_DEFECTO = "private, no-cache"
+CACHE_CONTROL_RUTAS = dict.fromkeys(
+    ["clases", "temarios_clase", "contenido_clase", "cuestionarios_clase", "preguntas_cuestionario"], CACHE_CONTROL_POR_DEFECTO
+)
+
+
+def _leer_cache_control_rutas(valor):
+    try:
+        rutas = json.loads(valor)
+    except ValueError as e:
+        raise ValueError(f"CACHE_CONTROL_RUTAS no es JSON válido: {e}") from None
+    if not isinstance(rutas, dict) or not all(isinstance(cabecera, str) for cabecera in rutas.values()):
+        raise ValueError("CACHE_CONTROL_RUTAS debe ser un objeto JSON de ruta a cabecera Cache-Control")
+    desconocidas = sorted(set(rutas) - set(CACHE_CONTROL_RUTAS))
+    if desconocidas:
+        raise ValueError(f"CACHE_CONTROL_RUTAS no válido: rutas desconocidas {', '.join(desconocidas)}")
+    return rutas
+
+
+CACHE_CONTROL_RUTAS.update(_leer_cache_control_rutas(os.getenv("CACHE_CONTROL_RUTAS", "{}")))
+
+# Escritura diferida de resultados: POST /resultados_cuestionarios/ encola el resultado,
+# responde 202 con un recibo y un hilo lo inserta por lotes. La cola se guarda en
+# RESULTADOS_SPOOL_DIR, en un fichero por proceso, para no perder resultados si el proceso
+# se reinicia; los resultados que no se pueden insertar acaban en fallidos.jsonl.
+# RESULTADOS_SPOOL_FSYNC: "siempre" (fsync antes de responder), "intervalo" (fsync en
+# cada ciclo del hilo de escritura) o "nunca" (lo decide el sistema operativo)
+RESULTADOS_WRITE_BEHIND = os.getenv("RESULTADOS_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+RESULTADOS_COLA_MAX = int(os.getenv("RESULTADOS_COLA_MAX", "10000"))
+RESULTADOS_ESCRITURA_LOTE = int(os.getenv("RESULTADOS_ESCRITURA_LOTE", "500"))
+RESULTADOS_ESCRITURA_INTERVALO = float(os.getenv("RESULTADOS_ESCRITURA_INTERVALO", "0.5"))
+RESULTADOS_SPOOL_DIR = os.getenv("RESULTADOS_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "monlab_resultados"))
+RESULTADOS_SPOOL_FSYNC = os.getenv("RESULTADOS_SPOOL_FSYNC", "siempre").lower()
+
+# Pool de conexiones a MySQL: tamaño, conexiones extra permitidas, segundos esperando
+# una conexión libre, segundos antes de reciclar una conexión y comprobación previa al uso
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Registro de SQL: fracción de sentencias que se registran (0 = ninguna, 1 = todas);
+# las que tardan más de DB_SQL_LOG_SLOW_MS milisegundos se registran siempre
+DB_SQL_LOG_SAMPLE = float(os.getenv("DB_SQL_LOG_SAMPLE", "0"))
+DB_SQL_LOG_SLOW_MS = float(os.getenv("DB_SQL_LOG_SLOW_MS", "500"))
+# Las muestras se registran como INFO y las lentas como WARNING. Sin DB_SQL_LOG_FILE van a stderr
+DB_SQL_LOG_LEVEL = os.getenv("DB_SQL_LOG_LEVEL", "INFO").upper()
+DB_SQL_LOG_FILE = os.getenv("DB_SQL_LOG_FILE")
+
+# Aplicar las migraciones pendientes del esquema al arrancar la aplicación
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+
+# Modo asíncrono: las rutas que usan la base de datos se ejecutan como corrutinas
+# sobre un motor con driver asíncrono (aiomysql) en lugar de en el threadpool.
+# El resto de E/S bloqueante de las rutas (Redis, cálculo con NumPy) pasa por _fuera_del_bucle
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
 # Crear la URL de conexión a la base de datos
 DATABASE_URL = f"mysql+pymysql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE}"
+ASYNC_DATABASE_URL = f"mysql+aiomysql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE}"
+
+class EstadisticasPool:
+    """Contadores de espera del pool de conexiones, compartidos por sus recreaciones."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.esperas = 0
+        self.timeouts = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def registrar(self, espero, duracion, timeout=False):
+        with self._lock:
+            self.checkouts += 1
+            if espero:
+                self.esperas += 1
+                self.espera_total += duracion
+                self.espera_max = max(self.espera_max, duracion)
+            if timeout:
+                self.timeouts += 1
+
+    def resumen(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.esperas,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.espera_total * 1000 / self.esperas, 3) if self.esperas else 0.0,
+                "wait_max_ms": round(self.espera_max * 1000, 3),
+            }
+
+
+class _PoolInstrumentado:
+    estadisticas = None
+
+    def _do_get(self):
+        # Se cuenta como espera todo checkout que llega con el pool y el overflow agotados
+        espero = self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+        inicio = time.perf_counter()
+        try:
+            conexion = super()._do_get()
+        except sa_exc.TimeoutError:
+            self.estadisticas.registrar(espero, time.perf_counter() - inicio, timeout=True)
+            raise
+        self.estadisticas.registrar(espero, time.perf_counter() - inicio)
+        return conexion
+
+
+class PoolSyncInstrumentado(_PoolInstrumentado, QueuePool):
+    estadisticas = EstadisticasPool()
+
+
+class PoolAsyncInstrumentado(_PoolInstrumentado, AsyncAdaptedQueuePool):
+    estadisticas = EstadisticasPool()
+
+
+def _opciones_pool():
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+# SQL muestreado en formato JSON por el logger "monlab.sql" en lugar de echo=True.
+# Tiene su propio handler: uvicorn solo configura sus loggers y sin él se perderían los registros
+logger_sql = logging.getLogger("monlab.sql")
+logger_sql.setLevel(DB_SQL_LOG_LEVEL)
+if not logger_sql.handlers:
+    _handler_sql = logging.FileHandler(DB_SQL_LOG_FILE) if DB_SQL_LOG_FILE else logging.StreamHandler()
+    _handler_sql.setFormatter(logging.Formatter("%(message)s"))
+    logger_sql.addHandler(_handler_sql)
+    logger_sql.propagate = False
+
+
+def _registrar_sql(motor):
+    @event.listens_for(motor, "before_cursor_execute")
+    def _inicio_sql(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_inicio_sql", []).append(time.perf_counter())
+
+    @event.listens_for(motor, "after_cursor_execute")
+    def _fin_sql(conn, cursor, statement, parameters, context, executemany):
+        duracion_ms = (time.perf_counter() - conn.info["_inicio_sql"].pop()) * 1000
+        lenta = duracion_ms >= DB_SQL_LOG_SLOW_MS
+        if lenta or (DB_SQL_LOG_SAMPLE and random.random() < DB_SQL_LOG_SAMPLE):
+            # No se registran los parámetros: pueden contener contraseñas
+            logger_sql.log(logging.WARNING if lenta else logging.INFO, json.dumps({
+                "evento": "sql",
+                "duracion_ms": round(duracion_ms, 3),
+                "lenta": lenta,
+                "filas": cursor.rowcount,
+                "executemany": executemany,
+                "sentencia": " ".join(statement.split())[:1000],
+            }, ensure_ascii=False))
+
+    @event.listens_for(motor, "handle_error")
+    def _error_sql(context):
+        inicios = context.connection.info.get("_inicio_sql") if context.connection is not None else None
+        if inicios:
+            inicios.pop()
+
 
 # Configurar SQLAlchemy
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_engine(DATABASE_URL, poolclass=PoolSyncInstrumentado, **_opciones_pool())
+_registrar_sql(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-# Crear las tablas en la base de datos
-Base.metadata.create_all(bind=engine)
+if DB_ASYNC:
+    import greenlet
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.util import await_only
+
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=PoolAsyncInstrumentado, **_opciones_pool())
+    _registrar_sql(async_engine.sync_engine)
+    AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False)
 
 # Crear la instancia de FastAPI
 app = FastAPI()
@@ -51,6 +358,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Serie-Dtype", "X-Serie-Longitud", "ETag"],  # Paginación, series y ETag
 )
 
 
@@ -63,44 +371,1454 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _materializar(resultado, profundidad=1):
+    # En modo asíncrono la respuesta se serializa fuera de la sesión, donde ya no se
+    # puede consultar: se cargan antes las columnas y las relaciones a uno que usan los modelos
+    if isinstance(resultado, (list, tuple)):
+        for elemento in resultado:
+            _materializar(elemento, profundidad)
+    elif isinstance(resultado, Base):
+        estado = sa_inspect(resultado)
+        if estado.detached:
+            return resultado
+        for atributo in estado.mapper.column_attrs:
+            getattr(resultado, atributo.key)
+        if profundidad > 0:
+            for relacion in estado.mapper.relationships:
+                if not relacion.uselist:
+                    _materializar(getattr(resultado, relacion.key), profundidad - 1)
+    return resultado
+
+
+def _endpoint_async(endpoint):
+    """Convierte una ruta síncrona que recibe la sesión de get_db en una corrutina.
+
+    El cuerpo de la ruta se ejecuta con AsyncSession.run_sync: el código sigue siendo
+    el mismo, pero la E/S va por el driver asíncrono sin ocupar un hilo.
+    """
+    firma = inspect.signature(endpoint)
+    parametro = next((p for p in firma.parameters.values() if getattr(p.default, "dependency", None) is get_db), None)
+    if parametro is None or asyncio.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def envoltorio(**kwargs):
+        db = kwargs.pop(parametro.name)
+        return await db.run_sync(lambda sesion: _materializar(endpoint(**kwargs, **{parametro.name: sesion})))
+
+    envoltorio.__signature__ = firma.replace(
+        parameters=[p.replace(default=Depends(get_async_db)) if p is parametro else p for p in firma.parameters.values()]
+    )
+    return envoltorio
+
+
+def _fuera_del_bucle(funcion, *args, **kwargs):
+    """Llama a una función bloqueante sin ocupar el bucle de eventos.
+
+    En modo asíncrono el cuerpo de las rutas corre en el hilo del bucle dentro de
+    run_sync; ahí la llamada se pasa a un hilo y se espera con await_only, igual que
+    el driver espera su E/S. En cualquier otro contexto se llama directamente.
+    """
+    if DB_ASYNC and getattr(greenlet.getcurrent(), "__sqlalchemy_greenlet_provider__", False):
+        return await_only(asyncio.to_thread(funcion, *args, **kwargs))
+    return funcion(*args, **kwargs)
+
+
+class RutaSesionAsync(APIRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _endpoint_async(endpoint), **kwargs)
+
+
+if DB_ASYNC:
+    app.router.route_class = RutaSesionAsync
+
+
+def _paginar(query, response, claves, cursor=None, limit=None, total=False):
+    """Paginación por clave primaria (keyset) de un listado.
+
+    claves son las columnas de la clave primaria en orden y cursor sus valores separados
+    por comas. El cursor de la página siguiente se devuelve en la cabecera X-Next-Cursor
+    y, si se pide total, el número total de filas en X-Total-Count. Sin limit ni cursor
+    se devuelve el listado completo, como antes de existir la paginación.
+    """
+    if total:
+        response.headers["X-Total-Count"] = str(query.order_by(None).count())
+    if limit is None and not cursor:
+        return query.all()
+    limit = limit or PAGINACION_LIMITE
+    if cursor:
+        valores = cursor.split(",")
+        if len(valores) != len(claves):
+            raise HTTPException(status_code=400, detail="Cursor no válido")
+        try:
+            valores = [clave.type.python_type(valor) for clave, valor in zip(claves, valores)]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor no válido")
+        # (a, b) > (x, y) se escribe como a > x OR (a = x AND b > y) para que MySQL use el índice
+        condiciones = [
+            and_(*[clave == valor for clave, valor in zip(claves[:i], valores[:i])], claves[i] > valores[i])
+            for i in range(len(claves))
+        ]
+        query = query.filter(or_(*condiciones))
+    filas = query.order_by(*claves).limit(limit + 1).all()
+    if len(filas) > limit:
+        filas = filas[:limit]
+        response.headers["X-Next-Cursor"] = ",".join(str(getattr(filas[-1], clave.key)) for clave in claves)
+    return filas
+
+
+_SIN_VALOR = object()
+
+
+class CacheLRU:
+    """Caché en memoria con caducidad (TTL) y expulsión LRU.
+
+    Las claves se agrupan en espacios ("clase", "temarios_clase", ...) que se pueden
+    invalidar por clave o enteros. Cada invalidación avanza la generación de su espacio:
+    un valor cargado antes de una invalidación de su espacio no se guarda, aunque la carga
+    termine después. Las invalidaciones de otros espacios no le afectan.
+    """
+
+    def __init__(self, maximo, ttl):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._generaciones = defaultdict(int)
+        self._lock = threading.Lock()
+        self._aciertos = defaultdict(int)
+        self._fallos = defaultdict(int)
+        self._stats = {"expulsadas": 0, "caducadas": 0, "invalidadas": 0}
+
+    def obtener(self, espacio, clave):
+        with self._lock:
+            entrada = self._entradas.get((espacio, clave))
+            if entrada is not None and entrada[0] < time.monotonic():
+                del self._entradas[(espacio, clave)]
+                self._stats["caducadas"] += 1
+                entrada = None
+            if entrada is None:
+                self._fallos[espacio] += 1
+                return _SIN_VALOR
+            self._entradas.move_to_end((espacio, clave))
+            self._aciertos[espacio] += 1
+            return entrada[1]
+
+    def generacion(self, espacio):
+        with self._lock:
+            return self._generaciones.get(espacio, 0)
+
+    def guardar(self, espacio, clave, valor, generacion=None):
+        with self._lock:
+            if generacion is not None and generacion != self._generaciones.get(espacio, 0):
+                return
+            self._entradas[(espacio, clave)] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end((espacio, clave))
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+                self._stats["expulsadas"] += 1
+
+    def invalidar(self, espacio, *claves):
+        with self._lock:
+            self._generaciones[espacio] += 1
+            for clave in claves:
+                if self._entradas.pop((espacio, clave), None) is not None:
+                    self._stats["invalidadas"] += 1
+
+    def invalidar_espacio(self, espacio):
+        with self._lock:
+            self._generaciones[espacio] += 1
+            for clave in [clave for clave in self._entradas if clave[0] == espacio]:
+                del self._entradas[clave]
+                self._stats["invalidadas"] += 1
+
+    def estadisticas(self):
+        with self._lock:
+            espacios = sorted(set(self._aciertos) | set(self._fallos))
+            return {
+                "backend": "local",
+                "entradas": len(self._entradas),
+                "maximo": self.maximo,
+                "ttl": self.ttl,
+                "espacios": {
+                    espacio: {
+                        "aciertos": self._aciertos[espacio],
+                        "fallos": self._fallos[espacio],
+                        "tasa_aciertos": round(self._aciertos[espacio] / ((self._aciertos[espacio] + self._fallos[espacio]) or 1), 3),
+                    }
+                    for espacio in espacios
+                },
+                **self._stats,
+            }
+
+
+def _etiquetar_cache(valor):
+    # Tipos que JSON no tiene, como objetos de una sola clave que se deshacen al leer
+    if isinstance(valor, datetime):
+        return {"__datetime__": valor.isoformat()}
+    if isinstance(valor, Decimal):
+        return {"__decimal__": str(valor)}
+    raise TypeError(f"Tipo no soportado en la caché: {type(valor).__name__}")
+
+
+def _desetiquetar_cache(objeto):
+    if len(objeto) == 1:
+        if "__datetime__" in objeto:
+            return datetime.fromisoformat(objeto["__datetime__"])
+        if "__decimal__" in objeto:
+            return Decimal(objeto["__decimal__"])
+    return objeto
+
+
+def _codificar_cache(valor):
+    return json.dumps(valor, default=_etiquetar_cache, separators=(",", ":"))
+
+
+def _decodificar_cache(datos):
+    # Las tuplas vuelven como listas; quien lee la caché solo las desempaqueta
+    return json.loads(datos, object_hook=_desetiquetar_cache)
+
+
+class CacheRedis:
+    """Caché compartida en Redis con la misma interfaz que CacheLRU.
+
+    Cada espacio tiene un contador de versión que forma parte de las claves: invalidar un
+    espacio entero es un INCR y las claves antiguas desaparecen por su TTL. La generación
+    de cada espacio es también un contador en Redis, así las invalidaciones de cualquier
+    worker impiden guardar valores del espacio cargados antes. Los valores se guardan en
+    JSON (_codificar_cache), nunca con pickle: quien pueda escribir en Redis no puede
+    ejecutar código en la API. La expulsión LRU la hace Redis (maxmemory-policy).
+    Si Redis falla, las lecturas cuentan como fallos y la aplicación sigue contra MySQL.
+    """
+
+    # Obtener y guardar leen la versión del espacio en la misma llamada con un script Lua
+    _LUA_OBTENER = """
+    local version = redis.call('GET', KEYS[1]) or '0'
+    return redis.call('GET', ARGV[1] .. version .. ':' .. ARGV[2])
+    """
+    _LUA_GUARDAR = """
+    if ARGV[1] ~= '' and (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+        return 0
+    end
+    local version = redis.call('GET', KEYS[2]) or '0'
+    redis.call('SET', ARGV[2] .. version .. ':' .. ARGV[3], ARGV[4], 'PX', ARGV[5])
+    return 1
+    """
+    _LUA_INVALIDAR = """
+    redis.call('INCR', KEYS[1])
+    local version = redis.call('GET', KEYS[2]) or '0'
+    for i = 2, #ARGV do
+        redis.call('DEL', ARGV[1] .. version .. ':' .. ARGV[i])
+    end
+    return 1
+    """
+
+    def __init__(self, url, prefijo, ttl):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis necesita el paquete redis")
+        self.ttl = ttl
+        self.prefijo = prefijo
+        self._redis = redis.Redis.from_url(url)
+        self._obtener = self._redis.register_script(self._LUA_OBTENER)
+        self._guardar = self._redis.register_script(self._LUA_GUARDAR)
+        self._invalidar = self._redis.register_script(self._LUA_INVALIDAR)
+        self._lock = threading.Lock()
+        self._aciertos = defaultdict(int)
+        self._fallos = defaultdict(int)
+        self._errores = 0
+
+    def _clave_version(self, espacio):
+        return f"{self.prefijo}:version:{espacio}"
+
+    def _clave_generacion(self, espacio):
+        return f"{self.prefijo}:generacion:{espacio}"
+
+    def _contar(self, contador, espacio=None):
+        with self._lock:
+            if contador is None:
+                self._errores += 1
+            else:
+                contador[espacio] += 1
+
+    def obtener(self, espacio, clave):
+        try:
+            datos = _fuera_del_bucle(self._obtener, keys=[self._clave_version(espacio)], args=[f"{self.prefijo}:{espacio}:", repr(clave)])
+        except redis.RedisError:
+            logger_cache.exception("Error leyendo de la caché Redis")
+            self._contar(None)
+            datos = None
+        if datos is None:
+            self._contar(self._fallos, espacio)
+            return _SIN_VALOR
+        self._contar(self._aciertos, espacio)
+        return _decodificar_cache(datos)
+
+    def generacion(self, espacio):
+        try:
+            return (_fuera_del_bucle(self._redis.get, self._clave_generacion(espacio)) or b"0").decode()
+        except redis.RedisError:
+            logger_cache.exception("Error leyendo la generación de la caché Redis")
+            self._contar(None)
+            # Una generación que no coincide nunca: sin Redis no se guarda nada
+            return "-"
+
+    def guardar(self, espacio, clave, valor, generacion=None):
+        if self.ttl <= 0:
+            # CACHE_TTL=0 desactiva la caché; Redis no acepta una caducidad de 0 ms
+            return
+        try:
+            _fuera_del_bucle(
+                self._guardar,
+                keys=[self._clave_generacion(espacio), self._clave_version(espacio)],
+                args=[generacion or "", f"{self.prefijo}:{espacio}:", repr(clave), _codificar_cache(valor), int(self.ttl * 1000)],
+            )
+        except redis.RedisError:
+            logger_cache.exception("Error guardando en la caché Redis")
+            self._contar(None)
+
+    def invalidar(self, espacio, *claves):
+        try:
+            _fuera_del_bucle(
+                self._invalidar,
+                keys=[self._clave_generacion(espacio), self._clave_version(espacio)],
+                args=[f"{self.prefijo}:{espacio}:", *(repr(clave) for clave in claves)],
+            )
+        except redis.RedisError:
+            # La entrada queda como mucho hasta que caduque su TTL
+            logger_cache.exception("Error invalidando la caché Redis")
+            self._contar(None)
+
+    def _incrementar(self, *claves):
+        with self._redis.pipeline() as pipeline:
+            for clave in claves:
+                pipeline.incr(clave)
+            pipeline.execute()
+
+    def invalidar_espacio(self, espacio):
+        try:
+            _fuera_del_bucle(self._incrementar, self._clave_generacion(espacio), self._clave_version(espacio))
+        except redis.RedisError:
+            logger_cache.exception("Error invalidando la caché Redis")
+            self._contar(None)
+
+    def estadisticas(self):
+        with self._lock:
+            estado = {
+                "backend": "redis",
+                "ttl": self.ttl,
+                "errores": self._errores,
+                "espacios": {
+                    espacio: {
+                        "aciertos": self._aciertos[espacio],
+                        "fallos": self._fallos[espacio],
+                        "tasa_aciertos": round(self._aciertos[espacio] / ((self._aciertos[espacio] + self._fallos[espacio]) or 1), 3),
+                    }
+                    for espacio in sorted(set(self._aciertos) | set(self._fallos))
+                },
+            }
+        try:
+            memoria = _fuera_del_bucle(self._redis.info, "memory")
+            estado["memoria_bytes"] = memoria.get("used_memory")
+            estado["maxmemory_policy"] = memoria.get("maxmemory_policy")
+        except redis.RedisError:
+            estado["memoria_bytes"] = None
+        return estado
+
+
+def _crear_cache():
+    if CACHE_BACKEND == "local":
+        return CacheLRU(CACHE_MAX_ENTRADAS, CACHE_TTL)
+    if CACHE_BACKEND == "redis":
+        return CacheRedis(CACHE_REDIS_URL, CACHE_PREFIJO, CACHE_TTL)
+    raise ValueError(f"CACHE_BACKEND no válido: {CACHE_BACKEND}")
+
+
+logger_cache = logging.getLogger("monlab.cache")
+cache_catalogo = _crear_cache()
+
+
+def _leer_cacheado(espacio, clave, cargar):
+    """Lectura a través de la caché: si la clave no está se llama a cargar() y se guarda.
+
+    Los resultados vacíos no se guardan, así una entidad creada después de consultarla
+    no necesita invalidar nada.
+    """
+    valor = cache_catalogo.obtener(espacio, clave)
+    if valor is not _SIN_VALOR:
+        return valor
+    generacion = cache_catalogo.generacion(espacio)
+    valor = cargar()
+    if valor:
+        cache_catalogo.guardar(espacio, clave, valor, generacion)
+    return valor
+
+
+def _etag_contenido(contenido):
+    """ETag fuerte: hash del contenido, igual en todos los workers para los mismos datos."""
+    serializado = json.dumps(contenido, default=_etiquetar_cache, sort_keys=True, separators=(",", ":"))
+    return '"' + hashlib.sha256(serializado.encode()).hexdigest()[:32] + '"'
+
+
+def _leer_cacheado_con_etag(espacio, clave, cargar):
+    """Como _leer_cacheado, pero guarda en la caché el ETag junto al valor. Devuelve (valor, etag).
+
+    El hash se calcula una sola vez, al cargar el valor: una revalidación con la entrada
+    en la caché no consulta MySQL ni vuelve a serializar el contenido.
+    """
+    entrada = cache_catalogo.obtener(espacio, clave)
+    # Cualquier otra cosa es una entrada anterior sin ETag: se trata como un fallo
+    if isinstance(entrada, dict) and entrada.keys() == {"valor", "etag"}:
+        return entrada["valor"], entrada["etag"]
+    generacion = cache_catalogo.generacion(espacio)
+    valor = cargar()
+    if not valor:
+        return valor, None
+    etag = _etag_contenido(valor)
+    cache_catalogo.guardar(espacio, clave, {"valor": valor, "etag": etag}, generacion)
+    return valor, etag
+
+
+def _condicional(request, response, ruta, etag):
+    """Devuelve la respuesta 304 si etag coincide con If-None-Match; si no, pone las
+    cabeceras ETag y Cache-Control en response y devuelve None."""
+    cabeceras = {"Cache-Control": CACHE_CONTROL_RUTAS.get(ruta, CACHE_CONTROL_POR_DEFECTO), "ETag": etag}
+    if _etag_coincide(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cabeceras)
+    response.headers.update(cabeceras)
+    return None
+
+
+def _como_dict(objeto):
+    # En la caché se guardan las columnas, no la instancia ligada a la sesión
+    return {atributo.key: getattr(objeto, atributo.key) for atributo in sa_inspect(objeto).mapper.column_attrs}
+
+
+def _ruta_remota(nombre):
+    # Construir la ruta completa del archivo en el servidor SFTP
+    return f"{REMOTE_PATH.rstrip('/')}/{nombre}" if REMOTE_PATH else nombre
+
+
+class SesionSFTP:
+    """Transporte SSH autenticado y su cliente SFTP, reutilizables entre peticiones."""
+
+    def __init__(self):
+        self.transport = paramiko.Transport((SFTP_HOST, SFTP_PORT))
+        try:
+            self.transport.connect(username=SFTP_USER, password=SFTP_PASSWORD)
+            if SFTP_KEEPALIVE:
+                self.transport.set_keepalive(SFTP_KEEPALIVE)
+            self.sftp = paramiko.SFTPClient.from_transport(self.transport)
+            # Crear el directorio remoto si está especificado y no existe
+            if REMOTE_PATH:
+                try:
+                    self.sftp.stat(REMOTE_PATH)
+                except IOError:
+                    self.sftp.mkdir(REMOTE_PATH)
+        except Exception:
+            self.transport.close()
+            raise
+        self.ultimo_uso = time.monotonic()
+
+    def activa(self):
+        if not self.transport.is_active():
+            return False
+        if time.monotonic() - self.ultimo_uso < SFTP_POOL_CHECK_AFTER:
+            return True
+        try:
+            self.sftp.stat(".")
+            return True
+        except (IOError, EOFError, paramiko.SSHException):
+            return False
+
+    def cerrar(self):
+        try:
+            self.sftp.close()
+        except Exception:
+            pass
+        self.transport.close()
+
+
+class PoolSFTP:
+    """Pool acotado de sesiones SFTP autenticadas.
+
+    Las sesiones se reutilizan en orden LIFO, se comprueban antes de entregarlas,
+    se descartan si la conexión ha fallado y se cierran tras un tiempo sin uso.
+    """
+
+    def __init__(self, tamano, inactividad, espera):
+        self.tamano = tamano
+        self.inactividad = inactividad
+        self.espera = espera
+        self._libres = []
+        self._lock = threading.Lock()
+        self._huecos = threading.BoundedSemaphore(tamano)
+        self._en_uso = 0
+        self._parar = threading.Event()
+        self._limpiador = None
+        self._stats = {
+            "creadas": 0,
+            "reutilizadas": 0,
+            "descartadas": 0,
+            "expiradas": 0,
+            "errores_conexion": 0,
+            "esperas_agotadas": 0,
+        }
+
+    @contextmanager
+    def sesion(self):
+        if not self._huecos.acquire(timeout=self.espera):
+            with self._lock:
+                self._stats["esperas_agotadas"] += 1
+            raise TimeoutError("No hay sesiones SFTP libres")
+        sesion = None
+        try:
+            sesion = self._obtener()
+            with self._lock:
+                self._en_uso += 1
+            try:
+                yield sesion.sftp
+            finally:
+                with self._lock:
+                    self._en_uso -= 1
+                self._devolver(sesion)
+        finally:
+            self._huecos.release()
+
+    def _obtener(self):
+        while True:
+            with self._lock:
+                sesion = self._libres.pop() if self._libres else None
+            if sesion is None:
+                break
+            if sesion.activa():
+                with self._lock:
+                    self._stats["reutilizadas"] += 1
+                return sesion
+            sesion.cerrar()
+            with self._lock:
+                self._stats["descartadas"] += 1
+        try:
+            sesion = SesionSFTP()
+        except Exception:
+            with self._lock:
+                self._stats["errores_conexion"] += 1
+            raise
+        with self._lock:
+            self._stats["creadas"] += 1
+        return sesion
+
+    def _devolver(self, sesion):
+        # Una sesión cuyo transporte ha caído no vuelve al pool
+        if not sesion.transport.is_active() or self._parar.is_set():
+            sesion.cerrar()
+            with self._lock:
+                self._stats["descartadas"] += 1
+            return
+        sesion.ultimo_uso = time.monotonic()
+        with self._lock:
+            self._libres.append(sesion)
+
+    def purgar(self):
+        limite = time.monotonic() - self.inactividad
+        with self._lock:
+            # Las sesiones más antiguas están al principio de la lista
+            expiradas = [s for s in self._libres if s.ultimo_uso < limite]
+            self._libres = [s for s in self._libres if s.ultimo_uso >= limite]
+            self._stats["expiradas"] += len(expiradas)
+        for sesion in expiradas:
+            sesion.cerrar()
+
+    def iniciar(self):
+        self._parar.clear()
+        if self._limpiador is None or not self._limpiador.is_alive():
+            intervalo = max(1.0, min(self.inactividad / 2, 60.0))
+            self._limpiador = threading.Thread(target=self._limpiar, args=(intervalo,), name="sftp-pool-limpiador", daemon=True)
+            self._limpiador.start()
+
+    def _limpiar(self, intervalo):
+        while not self._parar.wait(intervalo):
+            self.purgar()
+
+    def cerrar(self):
+        self._parar.set()
+        with self._lock:
+            libres, self._libres = self._libres, []
+        for sesion in libres:
+            sesion.cerrar()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "tamano": self.tamano,
+                "libres": len(self._libres),
+                "en_uso": self._en_uso,
+                "abiertas": len(self._libres) + self._en_uso,
+                **self._stats,
+            }
+
+
+class ArchivoDemasiadoGrande(Exception):
+    pass
+
+
+class ChecksumInvalido(Exception):
+    pass
+
+
+def _leer_en_chunks(fileobj, tamano=UPLOAD_CHUNK_SIZE):
+    while True:
+        chunk = fileobj.read(tamano)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _subir_stream_sftp(sftp, chunks, remote_filepath, max_size=UPLOAD_MAX_SIZE, sha256_esperado=None):
+    """Escribe los bloques en un archivo temporal remoto y lo renombra al terminar.
+
+    Cada bloque se escribe antes de leer el siguiente, así que la memoria usada no
+    depende del tamaño del archivo. Si se indica sha256_esperado, el archivo solo se
+    publica cuando coincide. Devuelve el número de bytes escritos y su SHA-256.
+    """
+    temporal = f"{remote_filepath}.part-{uuid.uuid4().hex}"
+    total = 0
+    digest = hashlib.sha256()
+    try:
+        with sftp.open(temporal, "wb") as remoto:
+            remoto.set_pipelined(True)
+            for chunk in chunks:
+                total += len(chunk)
+                if max_size and total > max_size:
+                    raise ArchivoDemasiadoGrande(f"El archivo supera el tamaño máximo de {max_size} bytes")
+                digest.update(chunk)
+                remoto.write(chunk)
+        if sha256_esperado and digest.hexdigest() != sha256_esperado.lower():
+            raise ChecksumInvalido(f"El SHA-256 del archivo es {digest.hexdigest()} y se esperaba {sha256_esperado}")
+        sftp.posix_rename(temporal, remote_filepath)
+    except BaseException:
+        # No dejar archivos a medias en el servidor
+        try:
+            sftp.remove(temporal)
+        except Exception:
+            pass
+        raise
+    return total, digest.hexdigest()
+
+
+def _bloques_archivo(fileobj):
+    fileobj.seek(0)
+    yield from _leer_en_chunks(fileobj)
+
+
+def _crear_directorios_remotos(sftp, directorio):
+    try:
+        sftp.stat(directorio)
+        return
+    except IOError:
+        pass
+    actual = "/" if directorio.startswith("/") else ""
+    for parte in directorio.strip("/").split("/"):
+        actual = posixpath.join(actual, parte) if actual else parte
+        try:
+            sftp.stat(actual)
+        except IOError:
+            sftp.mkdir(actual)
+
+
+# Almacenamiento direccionado por contenido: cada archivo se guarda una sola vez
+# en media/<aa>/<bb>/<sha256><extensión> y la tabla MEDIA cuenta sus referencias
+def _ruta_media(sha256, filename):
+    extension = os.path.splitext(filename or "")[1].lower()
+    if not re.fullmatch(r"\.[a-z0-9]{1,10}", extension):
+        extension = ""
+    return f"media/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def _reutilizar_media(db, sha256):
+    actualizados = (
+        db.query(Media)
+        .filter(Media.sha256 == sha256)
+        .update({Media.refcount: Media.refcount + 1}, synchronize_session=False)
+    )
+    if not actualizados:
+        return None
+    db.commit()
+    return db.query(Media).filter(Media.sha256 == sha256).first()
+
+
+def _respuesta_media(media, filename, deduplicated):
+    return {
+        "message": "File uploaded successfully",
+        "filename": filename,
+        "remote_path": media.ruta,
+        "size": media.tamano,
+        "sha256": media.sha256,
+        "deduplicated": deduplicated,
+    }
+
+
+def _guardar_media(abrir_bloques, filename, content_type=None, sha256_esperado=None):
+    """Guarda un archivo en el almacenamiento por contenido.
+
+    abrir_bloques devuelve un iterador nuevo sobre el contenido local cada vez que se
+    llama: una primera pasada calcula el SHA-256 y, si el contenido ya existe, se
+    devuelve la ruta existente sin enviar nada por SFTP.
+    """
+    digest = hashlib.sha256()
+    tamano = 0
+    for chunk in abrir_bloques():
+        tamano += len(chunk)
+        if UPLOAD_MAX_SIZE and tamano > UPLOAD_MAX_SIZE:
+            raise ArchivoDemasiadoGrande(f"El archivo supera el tamaño máximo de {UPLOAD_MAX_SIZE} bytes")
+        digest.update(chunk)
+    sha256 = digest.hexdigest()
+    if sha256_esperado and sha256 != sha256_esperado.lower():
+        raise ChecksumInvalido(f"El SHA-256 del archivo es {sha256} y se esperaba {sha256_esperado}")
+
+    db = SessionLocal()
+    try:
+        media = _reutilizar_media(db, sha256)
+        if media:
+            return _respuesta_media(media, filename, True)
+
+        remote_filepath = _ruta_remota(_ruta_media(sha256, filename))
+        with sftp_pool.sesion() as sftp:
+            _crear_directorios_remotos(sftp, posixpath.dirname(remote_filepath))
+            _subir_stream_sftp(sftp, abrir_bloques(), remote_filepath, sha256_esperado=sha256)
+
+        media = Media(sha256=sha256, ruta=remote_filepath, tamano=tamano, content_type=content_type, refcount=1)
+        db.add(media)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Otra subida del mismo contenido ha terminado antes que esta
+            db.rollback()
+            return _respuesta_media(_reutilizar_media(db, sha256), filename, True)
+        db.refresh(media)
+        return _respuesta_media(media, filename, False)
+    finally:
+        db.close()
+
+
+# Miniaturas: al subir una imagen se encola su reducción en un pool de procesos y
+# las versiones resultantes se guardan junto al original como <original>_<ancho>.<formato>
+def _ruta_derivado(ruta_original, ancho):
+    return f"{os.path.splitext(ruta_original)[0]}_{ancho}.{DERIVADOS_FORMATO}"
+
+
+def _es_imagen(content_type, filename):
+    tipo = content_type or mimetypes.guess_type(filename or "")[0] or ""
+    return tipo.startswith("image/") and tipo != "image/svg+xml"
+
+
+def _generar_derivados(ruta_local, anchos, formato, calidad):
+    # Se ejecuta en un proceso del pool: no usa la base de datos ni SFTP
+    generados = []
+    with Image.open(ruta_local) as original:
+        imagen = ImageOps.exif_transpose(original)
+        if imagen.mode not in ("RGB", "RGBA"):
+            imagen = imagen.convert("RGBA" if "A" in imagen.getbands() or "transparency" in imagen.info else "RGB")
+        for ancho in sorted(anchos):
+            # No se generan versiones más grandes que el original
+            if ancho >= imagen.width:
+                break
+            alto = max(1, round(imagen.height * ancho / imagen.width))
+            destino = f"{ruta_local}_{ancho}.{formato}"
+            imagen.resize((ancho, alto), Image.LANCZOS).save(destino, format=formato.upper(), quality=calidad)
+            generados.append((ancho, alto, destino))
+    return generados
+
+
+logger_derivados = logging.getLogger("monlab.derivados")
+
+derivados_executor = None
+derivados_pendientes = set()
+derivados_lock = threading.Lock()
+
+
+def _executor_derivados():
+    global derivados_executor
+    with derivados_lock:
+        if derivados_executor is None:
+            derivados_executor = ProcessPoolExecutor(max_workers=DERIVADOS_WORKERS)
+        return derivados_executor
+
+
+def _publicar_derivados(sha256, ruta_original, futuro, ruta_local):
+    generados = []
+    try:
+        generados = futuro.result()
+        derivados = []
+        with sftp_pool.sesion() as sftp:
+            for ancho, alto, local in generados:
+                remoto = _ruta_derivado(ruta_original, ancho)
+                with open(local, "rb") as f:
+                    _subir_stream_sftp(sftp, _leer_en_chunks(f), remoto)
+                derivados.append((ancho, alto, remoto))
+        db = SessionLocal()
+        try:
+            media = db.query(Media).filter(Media.sha256 == sha256).first()
+            if media:
+                db.add_all([MediaDerivado(id_media=media.id_media, ancho=ancho, alto=alto, ruta=ruta) for ancho, alto, ruta in derivados])
+                db.commit()
+        except IntegrityError:
+            # Otra subida de la misma imagen ya los registró
+            db.rollback()
+        finally:
+            db.close()
+    except Exception:
+        logger_derivados.exception("Error al generar las miniaturas de %s", ruta_original)
+    finally:
+        _descartar_derivados(sha256, ruta_local, generados)
+
+
+def _descartar_derivados(sha256, ruta_local, generados):
+    with derivados_lock:
+        derivados_pendientes.discard(sha256)
+    for ruta in [ruta_local] + [local for _, _, local in generados]:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+def _programar_publicacion(sha256, ruta_original, ruta_local, futuro):
+    # Se llama desde el hilo del ProcessPoolExecutor: si sftp_executor ya está cerrado
+    # (apagado del servidor) nadie vería la excepción, así que se registra aquí
+    try:
+        sftp_executor.submit(_publicar_derivados, sha256, ruta_original, futuro, ruta_local)
+    except RuntimeError:
+        logger_derivados.exception("No se pudieron publicar las miniaturas de %s", ruta_original)
+        generados = futuro.result() if not futuro.cancelled() and futuro.exception() is None else []
+        _descartar_derivados(sha256, ruta_local, generados)
+
+
+def _encolar_derivados(abrir_bloques, sha256, ruta_original):
+    """Copia la imagen a un archivo local y encola la generación de sus miniaturas."""
+    if Image is None or not DERIVADOS_ANCHOS:
+        return "unavailable"
+    with derivados_lock:
+        if sha256 in derivados_pendientes:
+            return "pending"
+    db = SessionLocal()
+    try:
+        existentes = (
+            db.query(MediaDerivado.id_derivado)
+            .join(Media, Media.id_media == MediaDerivado.id_media)
+            .filter(Media.sha256 == sha256)
+            .first()
+        )
+    finally:
+        db.close()
+    if existentes:
+        return "ready"
+
+    os.makedirs(DERIVADOS_STAGING_DIR, exist_ok=True)
+    ruta_local = os.path.join(DERIVADOS_STAGING_DIR, uuid.uuid4().hex)
+    with open(ruta_local, "wb") as f:
+        for chunk in abrir_bloques():
+            f.write(chunk)
+    with derivados_lock:
+        derivados_pendientes.add(sha256)
+    futuro = _executor_derivados().submit(_generar_derivados, ruta_local, DERIVADOS_ANCHOS, DERIVADOS_FORMATO, DERIVADOS_CALIDAD)
+    futuro.add_done_callback(functools.partial(_programar_publicacion, sha256, ruta_original, ruta_local))
+    return "pending"
+
+
+def _procesar_subida(abrir_bloques, filename, content_type=None, sha256_esperado=None):
+    respuesta = _guardar_media(abrir_bloques, filename, content_type, sha256_esperado)
+    if _es_imagen(content_type, filename):
+        respuesta["derivatives"] = _encolar_derivados(abrir_bloques, respuesta["sha256"], respuesta["remote_path"])
+    return respuesta
+
+
+def _liberar_media(sha256):
+    db = SessionLocal()
+    try:
+        media = db.query(Media).filter(Media.sha256 == sha256).with_for_update().first()
+        if not media:
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+        media.refcount -= 1
+        eliminado = media.refcount <= 0
+        if eliminado:
+            # El archivo remoto se borra con la fila bloqueada para que una subida
+            # simultánea del mismo contenido no lo reutilice a medio borrar
+            derivados = db.query(MediaDerivado).filter(MediaDerivado.id_media == media.id_media).all()
+            with sftp_pool.sesion() as sftp:
+                for ruta in [media.ruta] + [derivado.ruta for derivado in derivados]:
+                    try:
+                        sftp.remove(ruta)
+                    except IOError:
+                        pass
+            for derivado in derivados:
+                db.delete(derivado)
+            db.delete(media)
+        db.commit()
+        return {"sha256": sha256, "refcount": max(media.refcount, 0), "deleted": eliminado}
+    finally:
+        db.close()
+
+
+def _http_error_sftp(e):
+    # Traducir los errores de una transferencia SFTP a respuestas HTTP
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, ArchivoDemasiadoGrande):
+        return HTTPException(status_code=413, detail=str(e))
+    if isinstance(e, ChecksumInvalido):
+        return HTTPException(status_code=422, detail=str(e))
+    if isinstance(e, TimeoutError):
+        return HTTPException(status_code=503, detail=f"SFTP Error: {str(e)}")
+    if isinstance(e, paramiko.AuthenticationException):
+        return HTTPException(status_code=401, detail="SFTP Authentication failed")
+    if isinstance(e, paramiko.SSHException):
+        return HTTPException(status_code=500, detail=f"SFTP SSH Error: {str(e)}")
+    return HTTPException(status_code=500, detail=f"SFTP Error: {str(e)}")
+
+
+sftp_pool = PoolSFTP(SFTP_POOL_SIZE, SFTP_POOL_IDLE_TIMEOUT, SFTP_POOL_ACQUIRE_TIMEOUT)
+# Las llamadas de paramiko bloquean: se ejecutan en este executor para no parar el event loop
+sftp_executor = ThreadPoolExecutor(max_workers=SFTP_MAX_WORKERS, thread_name_prefix="sftp")
+
+
+async def _en_executor_sftp(funcion, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(sftp_executor, functools.partial(funcion, *args))
+
+
+@app.on_event("startup")
+def migrar_esquema():
+    if DB_AUTO_MIGRATE:
+        aplicar_migraciones()
+
+
+@app.on_event("startup")
+def iniciar_pool_sftp():
+    sftp_pool.iniciar()
+
+
+@app.on_event("shutdown")
+def cerrar_pool_sftp():
+    # Dejar terminar las transferencias en curso antes de cerrar las sesiones
+    if derivados_executor is not None:
+        derivados_executor.shutdown(wait=True)
+    sftp_executor.shutdown(wait=True)
+    sftp_pool.cerrar()
+
+
 @app.post("/upload/")
 async def upload_file(file: UploadFile = File(...)):
     try:
-        # Leer contenido del archivo
-        file_content = await file.read()
-        
-        # Conectar con el servidor SFTP
-        transport = paramiko.Transport((SFTP_HOST, SFTP_PORT))
-        transport.connect(username=SFTP_USER, password=SFTP_PASSWORD)
-        sftp = paramiko.SFTPClient.from_transport(transport)
-        
-        # Cambiar al directorio remoto si está especificado
-        if REMOTE_PATH:
-            try:
-                sftp.chdir(REMOTE_PATH)
-            except IOError:
-                # Si el directorio no existe, intentar crearlo
-                sftp.mkdir(REMOTE_PATH)
-                sftp.chdir(REMOTE_PATH)
-        
-        # Subir archivo
-        with BytesIO(file_content) as file_obj:
-            sftp.putfo(file_obj, file.filename)
-        
-        # Construir la ruta completa del archivo
-        remote_filepath = f"{REMOTE_PATH.rstrip('/')}/{file.filename}" if REMOTE_PATH else file.filename
-        
-        # Cerrar conexiones
-        sftp.close()
-        transport.close()
+        # Rechazar de entrada los archivos que ya se sabe que son demasiado grandes
+        if UPLOAD_MAX_SIZE and (getattr(file, "size", None) or 0) > UPLOAD_MAX_SIZE:
+            raise ArchivoDemasiadoGrande(f"El archivo supera el tamaño máximo de {UPLOAD_MAX_SIZE} bytes")
         
-        return {"message": "File uploaded successfully", "filename": file.filename, "remote_path": remote_filepath}
-    except paramiko.AuthenticationException:
-        raise HTTPException(status_code=401, detail="SFTP Authentication failed")
-    except paramiko.SSHException as ssh_error:
-        raise HTTPException(status_code=500, detail=f"SFTP SSH Error: {str(ssh_error)}")
+        # Guardar el archivo por contenido leyendo por bloques el spool de UploadFile, fuera del event loop
+        return await _en_executor_sftp(
+            _procesar_subida, functools.partial(_bloques_archivo, file.file), file.filename, file.content_type
+        )
+    except Exception as e:
+        raise _http_error_sftp(e)
+
+
+# Subidas reanudables por bloques: se abre una sesión, se envían los bloques numerados
+# (varios a la vez si se quiere), se consulta cuáles faltan y se finaliza
+def _directorio_sesion(session_id):
+    directorio = os.path.join(UPLOAD_STAGING_DIR, session_id)
+    if not re.fullmatch(r"[0-9a-f]{32}", session_id) or not os.path.isdir(directorio):
+        raise HTTPException(status_code=404, detail="Sesión de subida no encontrada")
+    return directorio
+
+
+def _leer_sesion(directorio):
+    with open(os.path.join(directorio, "sesion.json")) as f:
+        return json.load(f)
+
+
+def _bloques_recibidos(directorio):
+    return sorted(int(nombre[:-len(".part")]) for nombre in os.listdir(directorio) if nombre.endswith(".part"))
+
+
+def _tamano_bloque(sesion, index):
+    if index < sesion["total_chunks"] - 1:
+        return sesion["chunk_size"]
+    return sesion["size"] - sesion["chunk_size"] * (sesion["total_chunks"] - 1)
+
+
+def _estado_sesion(session_id, directorio, sesion):
+    recibidos = _bloques_recibidos(directorio)
+    pendientes = sorted(set(range(sesion["total_chunks"])) - set(recibidos))
+    return {"session_id": session_id, **sesion, "received": recibidos, "missing": pendientes}
+
+
+def _purgar_sesiones_subida():
+    if not os.path.isdir(UPLOAD_STAGING_DIR):
+        return
+    limite = time.time() - UPLOAD_SESSION_TTL
+    for nombre in os.listdir(UPLOAD_STAGING_DIR):
+        directorio = os.path.join(UPLOAD_STAGING_DIR, nombre)
+        # Solo se purgan sesiones de subida; cualquier otro contenido del directorio se respeta
+        if not os.path.isfile(os.path.join(directorio, "sesion.json")):
+            continue
+        try:
+            if os.path.getmtime(directorio) < limite:
+                shutil.rmtree(directorio, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def _leer_bloques(directorio, total_chunks):
+    for index in range(total_chunks):
+        with open(os.path.join(directorio, f"{index}.part"), "rb") as f:
+            yield from _leer_en_chunks(f)
+
+
+@app.post("/upload/sessions", tags=["Upload"])
+def create_upload_session(filename: str, size: int, chunk_size: int = UPLOAD_SESSION_CHUNK_SIZE, sha256: Optional[str] = None):
+    if not filename or os.path.basename(filename) != filename:
+        raise HTTPException(status_code=400, detail="Nombre de archivo no válido")
+    if size < 0 or (UPLOAD_MAX_SIZE and size > UPLOAD_MAX_SIZE):
+        raise HTTPException(status_code=413, detail=f"El archivo supera el tamaño máximo de {UPLOAD_MAX_SIZE} bytes")
+    if not 0 < chunk_size <= UPLOAD_SESSION_MAX_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail=f"El tamaño de bloque debe estar entre 1 y {UPLOAD_SESSION_MAX_CHUNK_SIZE} bytes")
+    if sha256 is not None and not re.fullmatch(r"[0-9a-fA-F]{64}", sha256):
+        raise HTTPException(status_code=400, detail="SHA-256 no válido")
+
+    _purgar_sesiones_subida()
+    session_id = uuid.uuid4().hex
+    directorio = os.path.join(UPLOAD_STAGING_DIR, session_id)
+    os.makedirs(directorio)
+    sesion = {
+        "filename": filename,
+        "size": size,
+        "chunk_size": chunk_size,
+        "total_chunks": max(1, math.ceil(size / chunk_size)),
+        "sha256": sha256.lower() if sha256 else None,
+    }
+    with open(os.path.join(directorio, "sesion.json"), "w") as f:
+        json.dump(sesion, f)
+    return _estado_sesion(session_id, directorio, sesion)
+
+
+@app.get("/upload/sessions/{session_id}", tags=["Upload"])
+def get_upload_session(session_id: str):
+    directorio = _directorio_sesion(session_id)
+    return _estado_sesion(session_id, directorio, _leer_sesion(directorio))
+
+
+@app.put("/upload/sessions/{session_id}/chunks/{index}", tags=["Upload"])
+async def upload_session_chunk(session_id: str, index: int, request: Request):
+    directorio = _directorio_sesion(session_id)
+    sesion = _leer_sesion(directorio)
+    if not 0 <= index < sesion["total_chunks"]:
+        raise HTTPException(status_code=400, detail=f"El bloque debe estar entre 0 y {sesion['total_chunks'] - 1}")
+    esperado = _tamano_bloque(sesion, index)
+
+    # Se escribe en un archivo temporal y se renombra, así un bloque reenviado
+    # o cortado a medias nunca deja un bloque incompleto
+    temporal = os.path.join(directorio, f"{index}.part.{uuid.uuid4().hex}")
+    recibido = 0
+    # Las escrituras en disco van al threadpool para no parar el event loop
+    loop = asyncio.get_running_loop()
+    f = await loop.run_in_executor(None, open, temporal, "wb")
+    try:
+        try:
+            async for piece in request.stream():
+                recibido += len(piece)
+                if recibido > esperado:
+                    raise HTTPException(status_code=413, detail=f"El bloque {index} debe tener {esperado} bytes")
+                await loop.run_in_executor(None, f.write, piece)
+        finally:
+            await loop.run_in_executor(None, f.close)
+        if recibido != esperado:
+            raise HTTPException(status_code=400, detail=f"El bloque {index} debe tener {esperado} bytes y se recibieron {recibido}")
+        await loop.run_in_executor(None, os.replace, temporal, os.path.join(directorio, f"{index}.part"))
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return {"session_id": session_id, "index": index, "size": recibido}
+
+
+@app.post("/upload/sessions/{session_id}/complete", tags=["Upload"])
+async def complete_upload_session(session_id: str, sha256: Optional[str] = None):
+    directorio = _directorio_sesion(session_id)
+    sesion = _leer_sesion(directorio)
+    estado = _estado_sesion(session_id, directorio, sesion)
+    if estado["missing"]:
+        raise HTTPException(status_code=409, detail={"message": "Faltan bloques por subir", "missing": estado["missing"]})
+
+    try:
+        respuesta = await _en_executor_sftp(
+            _procesar_subida,
+            functools.partial(_leer_bloques, directorio, sesion["total_chunks"]),
+            sesion["filename"],
+            None,
+            sha256 or sesion["sha256"],
+        )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"SFTP Error: {str(e)}")
+        raise _http_error_sftp(e)
+
+    await asyncio.get_running_loop().run_in_executor(None, functools.partial(shutil.rmtree, directorio, ignore_errors=True))
+    return respuesta
+
+
+@app.delete("/upload/sessions/{session_id}", tags=["Upload"])
+def delete_upload_session(session_id: str):
+    directorio = _directorio_sesion(session_id)
+    shutil.rmtree(directorio, ignore_errors=True)
+    return {"message": "Sesión de subida eliminada con éxito"}
+
+
+@app.delete("/upload/media/{sha256}", tags=["Upload"])
+async def release_media(sha256: str):
+    # Libera una referencia; el archivo se borra cuando nadie más lo usa
+    try:
+        return await _en_executor_sftp(_liberar_media, sha256.lower())
+    except Exception as e:
+        raise _http_error_sftp(e)
+
+
+@app.get("/upload/media/{sha256}/derivatives", tags=["Upload"])
+def get_media_derivatives(sha256: str, db: Session = Depends(get_db)):
+    media = db.query(Media).filter(Media.sha256 == sha256.lower()).first()
+    if not media:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    derivados = db.query(MediaDerivado).filter(MediaDerivado.id_media == media.id_media).order_by(MediaDerivado.ancho).all()
+    return {
+        "sha256": media.sha256,
+        "remote_path": media.ruta,
+        "status": "pending" if media.sha256 in derivados_pendientes else ("ready" if derivados else "none"),
+        "derivatives": [
+            {"width": d.ancho, "height": d.alto, "remote_path": d.ruta, "url": f"/media/{_ruta_relativa_media(d.ruta)}"}
+            for d in derivados
+        ],
+    }
+
+
+def _estado_pool(motor, estadisticas):
+    pool = motor.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        **estadisticas.resumen(),
+    }
+
+
+@app.get("/debug/pool", tags=["Debug"])
+def db_pool_stats():
+    estado = {"sync": _estado_pool(engine, PoolSyncInstrumentado.estadisticas)}
+    if DB_ASYNC:
+        estado["async"] = _estado_pool(async_engine, PoolAsyncInstrumentado.estadisticas)
+    return estado
+
+
+@app.get("/debug/cache", tags=["Debug"])
+def cache_stats():
+    return cache_catalogo.estadisticas()
+
+
+@app.get("/debug/sftp_pool", tags=["Debug"])
+def sftp_pool_stats():
+    return sftp_pool.estadisticas()
+
+
+# Servir archivos del almacenamiento SFTP a través de una caché LRU en disco local
+RE_MEDIA_CAS = re.compile(r"media/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(_\d+)?(\.[a-z0-9]{1,10})?")
+
+
+class CacheDiscoMedia:
+    """Caché LRU en disco de archivos remotos, acotada por MEDIA_CACHE_MAX_BYTES.
+
+    Cada entrada es el archivo descargado más un .json con sus metadatos. Los archivos
+    por contenido no cambian nunca; el resto se vuelven a comprobar con un stat remoto
+    cuando han pasado MEDIA_CACHE_REVALIDATE segundos. obtener() devuelve el archivo ya
+    abierto para que una expulsión posterior no deje sin datos a la respuesta en curso.
+    """
+
+    def __init__(self, directorio, max_bytes, revalidar):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.revalidar = revalidar
+        self._indice = None
+        self._total = 0
+        self._lock = threading.Lock()
+        self._descargas = {}
+        self._stats = {"aciertos": 0, "fallos": 0, "revalidaciones": 0, "expulsiones": 0}
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave)
+
+    def _cargar(self):
+        # Reconstruir el índice a partir de lo que quedó en disco, del más antiguo al más reciente
+        os.makedirs(self.directorio, exist_ok=True)
+        entradas = []
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            if ".tmp-" in nombre:
+                os.remove(ruta)
+            elif nombre.endswith(".json"):
+                try:
+                    with open(ruta) as f:
+                        entradas.append((os.path.getmtime(ruta), nombre[:-len(".json")], json.load(f)))
+                except (OSError, ValueError):
+                    continue
+        self._indice = OrderedDict()
+        for _, clave, entrada in sorted(entradas, key=lambda e: e[0]):
+            if os.path.exists(self._ruta(clave)):
+                self._indice[clave] = entrada
+                self._total += entrada["tamano"]
+
+    def _vigente(self, entrada):
+        return entrada["inmutable"] or time.time() - entrada["verificado"] < self.revalidar
+
+    def _abrir(self, clave, entrada):
+        # Debe llamarse con self._lock adquirido, así ninguna expulsión borra el archivo antes de abrirlo
+        return open(self._ruta(clave), "rb"), dict(entrada)
+
+    def _buscar(self, clave):
+        # Debe llamarse con self._lock adquirido
+        if self._indice is None:
+            self._cargar()
+        entrada = self._indice.get(clave)
+        if entrada and self._vigente(entrada):
+            self._indice.move_to_end(clave)
+            self._stats["aciertos"] += 1
+            return entrada
+        return None
+
+    def obtener(self, remote_filepath, inmutable):
+        """Devuelve el archivo local abierto y sus metadatos, descargándolo si hace falta.
+
+        Quien llama debe cerrar el archivo.
+        """
+        clave = hashlib.sha1(remote_filepath.encode()).hexdigest()
+        with self._lock:
+            entrada = self._buscar(clave)
+            if entrada:
+                return self._abrir(clave, entrada)
+            descarga = self._descargas.setdefault(clave, [threading.Lock(), 0])
+            descarga[1] += 1
+
+        try:
+            return self._descargar(clave, remote_filepath, inmutable, descarga[0])
+        finally:
+            # El lock de la descarga se descarta cuando ya no lo espera nadie
+            with self._lock:
+                descarga[1] -= 1
+                if not descarga[1]:
+                    del self._descargas[clave]
+
+    def _descargar(self, clave, remote_filepath, inmutable, descarga):
+        # Una sola descarga por archivo aunque lleguen varias peticiones a la vez
+        with descarga:
+            with self._lock:
+                entrada = self._buscar(clave)
+                if entrada:
+                    return self._abrir(clave, entrada)
+                anterior = self._indice.get(clave)
+
+            with sftp_pool.sesion() as sftp:
+                atributos = sftp.stat(remote_filepath)
+                etag = f"{atributos.st_size:x}-{int(atributos.st_mtime or 0):x}"
+                if anterior and anterior["etag"] == etag:
+                    with self._lock:
+                        if self._indice.get(clave) is anterior:
+                            anterior["verificado"] = time.time()
+                            self._indice.move_to_end(clave)
+                            self._stats["revalidaciones"] += 1
+                            return self._abrir(clave, anterior)
+
+                temporal = f"{self._ruta(clave)}.tmp-{uuid.uuid4().hex}"
+                try:
+                    with open(temporal, "wb") as f:
+                        sftp.getfo(remote_filepath, f)
+                    os.replace(temporal, self._ruta(clave))
+                except BaseException:
+                    if os.path.exists(temporal):
+                        os.remove(temporal)
+                    raise
+
+            entrada = {
+                "ruta": remote_filepath,
+                "tamano": atributos.st_size,
+                "etag": etag,
+                "inmutable": inmutable,
+                "verificado": time.time(),
+            }
+            with open(f"{self._ruta(clave)}.json", "w") as f:
+                json.dump(entrada, f)
+            with self._lock:
+                previa = self._indice.pop(clave, None)
+                if previa:
+                    self._total -= previa["tamano"]
+                self._indice[clave] = entrada
+                self._total += entrada["tamano"]
+                self._stats["fallos"] += 1
+                self._expulsar(clave)
+                return self._abrir(clave, entrada)
+
+    def _expulsar(self, conservar):
+        # Debe llamarse con self._lock adquirido. Las respuestas abren su archivo con el
+        # mismo lock, así que solo se borran archivos ya abiertos o que nadie está sirviendo;
+        # en POSIX un descriptor abierto sigue leyendo los datos después del os.remove.
+        while self._total > self.max_bytes and len(self._indice) > 1:
+            clave, entrada = next(iter(self._indice.items()))
+            if clave == conservar:
+                break
+            del self._indice[clave]
+            self._total -= entrada["tamano"]
+            self._stats["expulsiones"] += 1
+            for ruta in (self._ruta(clave), f"{self._ruta(clave)}.json"):
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "entradas": len(self._indice or ()),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                **self._stats,
+            }
+
+
+media_cache = CacheDiscoMedia(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_REVALIDATE)
+
+
+def _ruta_relativa_media(path):
+    # Se aceptan tanto rutas relativas a REMOTE_PATH como el remote_path completo que devuelve /upload/
+    ruta = "/" + path.lstrip("/")
+    raiz = REMOTE_PATH.rstrip("/") if REMOTE_PATH else ""
+    if raiz and ruta.startswith(raiz + "/"):
+        ruta = ruta[len(raiz):]
+    relativa = posixpath.normpath(ruta.lstrip("/"))
+    if relativa in ("", ".") or relativa == ".." or relativa.startswith("../"):
+        raise HTTPException(status_code=400, detail="Ruta no válida")
+    return relativa
+
+
+def _etag_coincide(cabecera, etag):
+    if not cabecera:
+        return False
+    if cabecera.strip() == "*":
+        return True
+    return etag in [valor.strip().removeprefix("W/") for valor in cabecera.split(",")]
+
+
+def _rango_solicitado(cabecera, tamano):
+    """Interpreta una cabecera Range de un solo rango. Devuelve (inicio, fin) o None."""
+    coincidencia = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", cabecera or "")
+    if not coincidencia or coincidencia.group(1) == coincidencia.group(2) == "":
+        return None
+    inicio, fin = coincidencia.groups()
+    if inicio == "":
+        longitud = int(fin)
+        if longitud == 0:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{tamano}"})
+        return max(tamano - longitud, 0), tamano - 1
+    inicio = int(inicio)
+    fin = min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or fin < inicio:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{tamano}"})
+    return inicio, fin
+
+
+def _leer_rango(archivo, inicio, fin):
+    with archivo as f:
+        f.seek(inicio)
+        pendiente = fin - inicio + 1
+        while pendiente > 0:
+            chunk = f.read(min(UPLOAD_CHUNK_SIZE, pendiente))
+            if not chunk:
+                return
+            pendiente -= len(chunk)
+            yield chunk
+
+
+def _elegir_derivado(relativa, ancho):
+    # Devuelve la miniatura más pequeña que cubre el ancho pedido, o la mayor disponible
+    cas = RE_MEDIA_CAS.fullmatch(relativa)
+    if not ancho or not cas or cas.group(2):
+        return relativa
+    db = SessionLocal()
+    try:
+        derivados = (
+            db.query(MediaDerivado.ancho, MediaDerivado.ruta)
+            .join(Media, Media.id_media == MediaDerivado.id_media)
+            .filter(Media.sha256 == cas.group(1))
+            .order_by(MediaDerivado.ancho)
+            .all()
+        )
+    finally:
+        db.close()
+    if not derivados:
+        return relativa
+    ruta = next((ruta for a, ruta in derivados if a >= ancho), derivados[-1][1])
+    return _ruta_relativa_media(ruta)
+
+
+def _obtener_media(relativa, ancho):
+    relativa = _elegir_derivado(relativa, ancho)
+    cas = RE_MEDIA_CAS.fullmatch(relativa)
+    archivo, entrada = media_cache.obtener(_ruta_remota(relativa), bool(cas))
+    return relativa, cas, archivo, entrada
+
+
+@app.get("/media/{path:path}", tags=["Media"])
+async def get_media(path: str, request: Request, w: Optional[int] = None):
+    # Con ?w=<ancho> se sirve la miniatura adecuada de una imagen si ya existe
+    relativa = _ruta_relativa_media(path)
+    try:
+        relativa, cas, archivo, entrada = await _en_executor_sftp(_obtener_media, relativa, w)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    except Exception as e:
+        raise _http_error_sftp(e)
+
+    # Los archivos por contenido nunca cambian: su ETag es el propio hash y se cachean indefinidamente
+    etag = f'"{cas.group(1)}{cas.group(2) or ""}"' if cas else f'"{entrada["etag"]}"'
+    cabeceras = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable" if cas else f"public, max-age={MEDIA_CACHE_MAX_AGE}",
+    }
+    if _etag_coincide(request.headers.get("if-none-match"), etag):
+        archivo.close()
+        return Response(status_code=304, headers=cabeceras)
+
+    tamano = entrada["tamano"]
+    content_type = mimetypes.guess_type(relativa)[0] or "application/octet-stream"
+    rango = None
+    if_range = request.headers.get("if-range")
+    if tamano and (not if_range or if_range.strip() == etag):
+        try:
+            rango = _rango_solicitado(request.headers.get("range"), tamano)
+        except HTTPException:
+            archivo.close()
+            raise
+    if rango is None:
+        cabeceras["Content-Length"] = str(tamano)
+        return StreamingResponse(_leer_rango(archivo, 0, tamano - 1), media_type=content_type, headers=cabeceras)
+
+    inicio, fin = rango
+    cabeceras["Content-Length"] = str(fin - inicio + 1)
+    cabeceras["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+    return StreamingResponse(_leer_rango(archivo, inicio, fin), status_code=206, media_type=content_type, headers=cabeceras)
+
+
+@app.get("/debug/media_cache", tags=["Debug"])
+def media_cache_stats():
+    return media_cache.estadisticas()
 
 
 # Definir modelos de base de datos
@@ -152,6 +1870,7 @@ class Video(Base):
 # Tablas adicionales
 class Temario(Base):
     __tablename__ = "TEMARIOS"
+    __table_args__ = (Index("ix_temarios_clase", "id_clases"),)
 
     id_temario = Column(Integer, primary_key=True, autoincrement=True)
     id_clases = Column(Integer, ForeignKey("CLASES.id_clases"), nullable=False)
@@ -164,6 +1883,8 @@ class Temario(Base):
 
 class TemarioCuestionario(Base):
     __tablename__ = "TEMEARIOS_CUESTIONARIOS"
+    # Cubre el EXISTS (id_clases, id_questionario) con el que se filtran los cuestionarios de una clase
+    __table_args__ = (Index("ix_temarios_cuestionarios_clase_cuestionario", "id_clases", "id_questionario"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     id_clases = Column(Integer, ForeignKey("CLASES.id_clases"), nullable=False)
@@ -185,6 +1906,8 @@ class Clase(Base):
 
 class ClaseUsuario(Base):
     __tablename__ = "CLASES_USUARIOS"
+    # La clave primaria empieza por id_usuarios: los participantes de una clase necesitan su propio índice
+    __table_args__ = (Index("ix_clases_usuarios_clase", "id_clases"),)
 
     id_usuarios = Column(Integer, ForeignKey("USUARIOS.id_usuarios"), primary_key=True)
     id_clases = Column(Integer, ForeignKey("CLASES.id_clases"), primary_key=True)
@@ -203,6 +1926,7 @@ class Cuestionario(Base):
 
 class ResultadoCuestionario(Base):
     __tablename__ = "RESULTADOS_CUESTIONARIOS"
+    __table_args__ = (Index("ix_resultados_usuario_cuestionario", "id_usuarios", "id_questionario"),)
 
     id_resultado_cuestionario = Column(Integer, primary_key=True, autoincrement=True)
     id_questionario = Column(Integer, ForeignKey("CUESTIONARIOS.id_questionario"), nullable=False)
@@ -228,6 +1952,7 @@ class Experimento(Base):
 
 class Pregunta(Base):
     __tablename__ = "PREGUNTAS"
+    __table_args__ = (Index("ix_preguntas_cuestionario", "id_questionario"),)
 
     id_pregunta = Column(Integer, primary_key=True, autoincrement=True)
     id_questionario = Column(Integer, ForeignKey("CUESTIONARIOS.id_questionario"), nullable=False)
@@ -259,6 +1984,7 @@ class TemarioExperimento(Base):
 
 class DatoExperimento(Base):
     __tablename__ = "DATOS_EXPERIMENTOS"
+    __table_args__ = (Index("ix_datos_experimentos_experimento", "id_experimento"),)
 
     id_datos = Column(String(50), primary_key=True)
     id_experimento = Column(Integer, ForeignKey("EXPERIMENTOS.id_experimento"), nullable=False)
@@ -280,6 +2006,218 @@ class DatoExperimento(Base):
     tiempo3 = Column(Float, nullable=True)
     tiempo4 = Column(Float, nullable=True)
 
+
+# Series de medidas de longitud variable de un ensayo (id_datos), una fila por magnitud.
+# datos es la serie empaquetada: cabecera CABECERA_SERIE seguida de las muestras en
+# little-endian. Las columnas anchas de DATOS_EXPERIMENTOS son una proyección de estas series.
+class SerieExperimento(Base):
+    __tablename__ = "SERIES_EXPERIMENTOS"
+    __table_args__ = (
+        UniqueConstraint("id_datos", "magnitud"),
+        Index("ix_series_experimento", "id_experimento"),
+    )
+
+    id_serie = Column(Integer, primary_key=True, autoincrement=True)
+    id_experimento = Column(Integer, ForeignKey("EXPERIMENTOS.id_experimento"), nullable=False)
+    id_datos = Column(String(50), ForeignKey("DATOS_EXPERIMENTOS.id_datos"), nullable=False)
+    magnitud = Column(String(50), nullable=False)
+    dtype = Column(String(10), nullable=False)
+    longitud = Column(Integer, nullable=False)
+    datos = Column(LargeBinary().with_variant(MEDIUMBLOB, "mysql"), nullable=False)
+
+
+class Media(Base):
+    __tablename__ = "MEDIA"
+
+    id_media = Column(Integer, primary_key=True, autoincrement=True)
+    sha256 = Column(String(64), nullable=False, unique=True)
+    ruta = Column(String(255), nullable=False)
+    tamano = Column(BigInteger, nullable=False)
+    content_type = Column(String(100))
+    refcount = Column(Integer, nullable=False, default=1)
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+
+
+class MediaDerivado(Base):
+    __tablename__ = "MEDIA_DERIVADOS"
+    __table_args__ = (UniqueConstraint("id_media", "ancho"),)
+
+    id_derivado = Column(Integer, primary_key=True, autoincrement=True)
+    id_media = Column(Integer, ForeignKey("MEDIA.id_media"), nullable=False)
+    ancho = Column(Integer, nullable=False)
+    alto = Column(Integer, nullable=False)
+    ruta = Column(String(255), nullable=False)
+
+
+# Resumen de notas por (clase, usuario, cuestionario), mantenido en la misma transacción
+# que los resultados. Es un dato derivado: no lleva claves foráneas para no bloquear
+# los borrados de clases, usuarios o cuestionarios.
+class ResumenNota(Base):
+    __tablename__ = "RESUMEN_NOTAS"
+
+    id_clases = Column(Integer, primary_key=True, autoincrement=False)
+    id_usuarios = Column(Integer, primary_key=True, autoincrement=False)
+    id_questionario = Column(Integer, primary_key=True, autoincrement=False)
+    intentos = Column(Integer, nullable=False)
+    nota_max = Column(Integer, nullable=False)
+    suma_notas = Column(BigInteger, nullable=False)
+    nota_ultima = Column(Integer, nullable=False)
+    fecha_ultima = Column(DateTime, nullable=False)
+    total_correctas = Column(BigInteger, nullable=False)
+    total_falladas = Column(BigInteger, nullable=False)
+
+
+# Recibos de la escritura diferida: permiten consultar el estado de un resultado encolado
+# y hacen idempotente la reanudación de la cola tras un reinicio
+class ReciboResultado(Base):
+    __tablename__ = "RECIBOS_RESULTADOS"
+
+    recibo = Column(String(36), primary_key=True)
+    id_resultado_cuestionario = Column(Integer, nullable=True)
+    error = Column(String(255), nullable=True)
+    fecha_escrito = Column(DateTime, nullable=False)
+
+
+class VersionEsquema(Base):
+    __tablename__ = "SCHEMA_VERSION"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    descripcion = Column(String(200), nullable=False)
+    fecha_aplicada = Column(DateTime, default=datetime.utcnow)
+
+
+# Migraciones del esquema. Cada migración tiene una versión, una descripción y una
+# función que recibe la conexión; las aplicadas quedan registradas en SCHEMA_VERSION.
+# Todas deben poder repetirse sin error sobre una base de datos que ya tenga el cambio.
+MIGRACIONES = []
+
+
+def migracion(version, descripcion):
+    def registrar(funcion):
+        MIGRACIONES.append((version, descripcion, funcion))
+        return funcion
+    return registrar
+
+
+def _crear_tablas(conn, *modelos):
+    Base.metadata.create_all(conn, tables=[modelo.__table__ for modelo in modelos])
+
+
+def _existe_indice(conn, tabla, nombre):
+    return nombre in {i["name"] for i in sa_inspect(conn).get_indexes(tabla)}
+
+
+# Los índices se crean con DDL explícito y no a partir de los modelos, para que una
+# migración antigua no cambie cuando se modifican los índices declarados en el modelo
+def _crear_indice(conn, tabla, nombre, *columnas):
+    if not _existe_indice(conn, tabla, nombre):
+        conn.execute(text(f"CREATE INDEX {nombre} ON {tabla} ({', '.join(columnas)})"))
+
+
+@migracion(1, "Tablas iniciales")
+def _migracion_tablas_iniciales(conn):
+    _crear_tablas(
+        conn, Rol, Usuario, PerfilUsuario, Clase, Video, Temario, Cuestionario, TemarioCuestionario, ClaseUsuario,
+        ResultadoCuestionario, Experimento, Pregunta, VideoExperimento, TemarioExperimento, DatoExperimento,
+        Media, MediaDerivado,
+    )
+
+
+@migracion(2, "Índices de las consultas más frecuentes")
+def _migracion_indices_consultas(conn):
+    # (id_clases, id_questionario) también sirve a las consultas solo por id_clases
+    _crear_indice(conn, "TEMEARIOS_CUESTIONARIOS", "ix_temarios_cuestionarios_clase_cuestionario", "id_clases", "id_questionario")
+    _crear_indice(conn, "RESULTADOS_CUESTIONARIOS", "ix_resultados_usuario_cuestionario", "id_usuarios", "id_questionario")
+    _crear_indice(conn, "CLASES_USUARIOS", "ix_clases_usuarios_clase", "id_clases")
+    _crear_indice(conn, "TEMARIOS", "ix_temarios_clase", "id_clases")
+    _crear_indice(conn, "PREGUNTAS", "ix_preguntas_cuestionario", "id_questionario")
+    _crear_indice(conn, "DATOS_EXPERIMENTOS", "ix_datos_experimentos_experimento", "id_experimento")
+
+
+@migracion(3, "Resumen de notas por clase, usuario y cuestionario")
+def _migracion_resumen_notas(conn):
+    _crear_tablas(conn, ResumenNota)
+    reconstruir_resumen(conn)
+
+
+@migracion(4, "Recibos de la escritura diferida de resultados")
+def _migracion_recibos_resultados(conn):
+    _crear_tablas(conn, ReciboResultado)
+
+
+@migracion(5, "Series de medidas empaquetadas de los experimentos")
+def _migracion_series_experimentos(conn):
+    _crear_tablas(conn, SerieExperimento)
+    # Las filas anchas existentes pasan a ser series de hasta 4 o 5 muestras, por bloques
+    # de la clave primaria para no cargar la tabla entera en memoria
+    ultimo = None
+    while True:
+        consulta = select(DatoExperimento).order_by(DatoExperimento.id_datos).limit(IMPORTACION_FILAS_POR_INSERT)
+        if ultimo is not None:
+            consulta = consulta.where(DatoExperimento.id_datos > ultimo)
+        filas = conn.execute(consulta).all()
+        if not filas:
+            break
+        series = [serie for fila in filas for serie in _series_desde_fila(fila)]
+        if series:
+            conn.execute(insert(SerieExperimento.__table__).values(series))
+        ultimo = filas[-1].id_datos
+
+
+def aplicar_migraciones(motor=engine):
+    """Aplica en orden las migraciones que faltan y devuelve las versiones aplicadas."""
+    aplicadas = []
+    with motor.connect() as conn:
+        # Cerrojo con nombre de MySQL: si arrancan varios workers a la vez solo uno migra
+        if not conn.execute(text("SELECT GET_LOCK('monlab_migraciones', 300)")).scalar():
+            raise RuntimeError("No se pudo obtener el cerrojo de migraciones")
+        try:
+            _crear_tablas(conn, VersionEsquema)
+            conn.commit()
+            hechas = set(conn.execute(select(VersionEsquema.version)).scalars())
+            for version, descripcion, funcion in sorted(MIGRACIONES, key=lambda m: m[0]):
+                if version in hechas:
+                    continue
+                funcion(conn)
+                conn.execute(VersionEsquema.__table__.insert().values(version=version, descripcion=descripcion, fecha_aplicada=datetime.utcnow()))
+                conn.commit()
+                aplicadas.append(version)
+        finally:
+            conn.execute(text("SELECT RELEASE_LOCK('monlab_migraciones')"))
+    return aplicadas
+
+
+# Consultas de las rutas más usadas cuyo plan se comprueba con EXPLAIN: ninguna
+# debería recorrer la tabla entera
+CONSULTAS_CRITICAS = {
+    "temarios_por_clase": ("SELECT * FROM TEMARIOS WHERE id_clases = :id", {"id": 1}),
+    "cuestionarios_por_clase": (
+        "SELECT 1 FROM TEMEARIOS_CUESTIONARIOS WHERE id_clases = :id AND id_questionario = :cuestionario",
+        {"id": 1, "cuestionario": 1},
+    ),
+    "resultados_usuario_cuestionario": (
+        "SELECT * FROM RESULTADOS_CUESTIONARIOS WHERE id_usuarios = :usuario AND id_questionario = :cuestionario",
+        {"usuario": 1, "cuestionario": 1},
+    ),
+    "participantes_por_clase": ("SELECT id_usuarios FROM CLASES_USUARIOS WHERE id_clases = :id", {"id": 1}),
+    "preguntas_por_cuestionario": ("SELECT * FROM PREGUNTAS WHERE id_questionario = :id", {"id": 1}),
+    "datos_por_experimento": ("SELECT * FROM DATOS_EXPERIMENTOS WHERE id_experimento = :id", {"id": 1}),
+}
+# En tablas pequeñas MySQL puede preferir recorrerlas aunque haya índice: solo se
+# considera fallo si no hay índice utilizable o si se estiman al menos estas filas
+EXPLAIN_FILAS_MINIMAS = int(os.getenv("EXPLAIN_FILAS_MINIMAS", "1000"))
+
+
+def verificar_planes(motor=engine):
+    """Devuelve las consultas críticas cuyo plan es un recorrido completo de tabla."""
+    fallos = []
+    with motor.connect() as conn:
+        for nombre, (sql, parametros) in CONSULTAS_CRITICAS.items():
+            for fila in conn.execute(text(f"EXPLAIN {sql}"), parametros).mappings():
+                if fila["type"] == "ALL" and (not fila["possible_keys"] or (fila["rows"] or 0) >= EXPLAIN_FILAS_MINIMAS):
+                    fallos.append({"consulta": nombre, "tabla": fila["table"], "filas": fila["rows"], "possible_keys": fila["possible_keys"]})
+    return fallos
+
 # Modelos Pydantic para las respuestas
 class RolBase(BaseModel):
     id_roles: int
@@ -390,6 +2328,65 @@ class PerfilUsuarioBase(BaseModel):
     class Config:
         from_attributes = True
 
+class ResultadoCuestionarioCreate(BaseModel):
+    id_questionario: int
+    id_usuarios: int
+    nota: int
+    total_correctas: int
+    total_falladas: int
+    # Los clientes sin conexión envían la fecha en la que se completó; si falta se usa la actual
+    fecha_completado: Optional[datetime] = None
+
+class PreguntaImport(BaseModel):
+    enunciado: str
+    respuesta: str
+    correcta: str
+    respuesta1: str
+    respuesta2: str
+    respuesta3: str
+
+class TemarioEnlaceImport(BaseModel):
+    id_clases: int
+    id_temario: int
+
+class CuestionarioImport(BaseModel):
+    nombre_cuestionario: str
+    descrip_cuestionario: str
+    foto_cuestionario: Optional[str] = None
+    video_cuestionario: Optional[str] = None
+    preguntas: List[PreguntaImport] = []
+    temarios: List[TemarioEnlaceImport] = []
+
+class ResumenNotaResponse(BaseModel):
+    id_clases: int
+    id_usuarios: int
+    id_questionario: int
+    nombre_usuario: str
+    nombre_cuestionario: str
+    intentos: int
+    nota_max: int
+    nota_media: float
+    nota_ultima: int
+    fecha_ultima: datetime
+    total_correctas: int
+    total_falladas: int
+
+    class Config:
+        from_attributes = True
+
+class ResumenUsuarioResponse(BaseModel):
+    id_usuarios: int
+    nombre_usuario: str
+    cuestionarios: int
+    intentos: int
+    nota_media: float
+    media_mejores_notas: float
+    total_correctas: int
+    total_falladas: int
+
+    class Config:
+        from_attributes = True
+
 class CuestionarioDetail(BaseModel):
     id_questionario: int
     nombre_cuestionario: str
@@ -407,13 +2404,21 @@ def create_rol(rol: str, db: Session = Depends(get_db)):
     new_rol = Rol(rol=rol)
     db.add(new_rol)
     db.commit()
+    cache_catalogo.invalidar_espacio("roles")
     db.refresh(new_rol)
     return new_rol
 
 
 @app.get("/roles/", response_model=List[RolBase], tags=["Roles"])
-def read_roles(db: Session = Depends(get_db)):
-    roles = db.query(Rol).all()
+def read_roles(response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    def cargar():
+        # Las cabeceras de paginación se guardan junto a la página
+        pagina = Response()
+        roles = _paginar(db.query(Rol), pagina, [Rol.id_roles], cursor, limit, total)
+        cabeceras = {nombre: pagina.headers[nombre] for nombre in ("X-Next-Cursor", "X-Total-Count") if nombre in pagina.headers}
+        return [_como_dict(rol) for rol in roles], cabeceras
+    roles, cabeceras = _leer_cacheado("roles", (limit, cursor, total), cargar)
+    response.headers.update(cabeceras)
     if not roles:
         raise HTTPException(
             status_code=404, 
@@ -423,19 +2428,29 @@ def read_roles(db: Session = Depends(get_db)):
 
 
 @app.get("/temarios/contenido/{id_clases}", response_model=List[str], tags=["Temarios"])
-def get_contenido_temarios_by_clase(id_clases: int, db: Session = Depends(get_db)):
+def get_contenido_temarios_by_clase(id_clases: int, request: Request, response: Response, db: Session = Depends(get_db)):
     # Se consulta únicamente el campo "contenido" de aquellos temarios con el id_clases especificado
-    temarios = db.query(Temario.contenido).filter(Temario.id_clases == id_clases).all()
+    temarios, etag = _leer_cacheado_con_etag("contenido_clase", id_clases, lambda: [
+        contenido for (contenido,) in db.query(Temario.contenido).filter(Temario.id_clases == id_clases)
+    ])
     if not temarios:
         raise HTTPException(status_code=404, detail="No se encontraron temarios para la clase especificada")
-    # Cada resultado se devuelve como una tupla, se extrae el primer elemento (contenido)
-    return [contenido for (contenido,) in temarios if contenido is not None]
+    no_modificado = _condicional(request, response, "contenido_clase", etag)
+    if no_modificado:
+        return no_modificado
+    return [contenido for contenido in temarios if contenido is not None]
 
 @app.get("/temarios/clase/{id_clases}", response_model=List[TemarioDetail], tags=["Temarios"])
-def get_temarios_by_clase(id_clases: int, db: Session = Depends(get_db)):
-    temarios = db.query(Temario).filter(Temario.id_clases == id_clases).order_by(Temario.nombre_temario).all()
+def get_temarios_by_clase(id_clases: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    temarios, etag = _leer_cacheado_con_etag("temarios_clase", id_clases, lambda: [
+        _como_dict(temario)
+        for temario in db.query(Temario).filter(Temario.id_clases == id_clases).order_by(Temario.nombre_temario)
+    ])
     if not temarios:
         raise HTTPException(status_code=404, detail="No se encontraron temarios para la clase especificada")
+    no_modificado = _condicional(request, response, "temarios_clase", etag)
+    if no_modificado:
+        return no_modificado
     return temarios
 
 @app.get("/temarios/clase/{id_clases}/filter", response_model=List[TemarioDetail], tags=["Temarios"])
@@ -495,6 +2510,7 @@ def update_videos_temarios_by_clase(
     temario.videos_temario = temario_data.videos_temario
     
     db.commit()
+    _invalidar_temario(temario.id_temario, id_clases)
     db.refresh(temario)
     return temario
 
@@ -505,6 +2521,7 @@ def delete_rol(role_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Rol no encontrado")
     db.delete(rol)
     db.commit()
+    cache_catalogo.invalidar_espacio("roles")
     return rol
 
 
@@ -537,12 +2554,16 @@ def update_rol(role_id: int, rol: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Rol no encontrado")
     existing_rol.rol = rol
     db.commit()
+    cache_catalogo.invalidar_espacio("roles")
     db.refresh(existing_rol)
     return existing_rol
 
 @app.get("/experimentos/{experimento_id}", response_model=ExperimentoDetail, tags=["Experimentos"])
 def get_experimento(experimento_id: int, db: Session = Depends(get_db)):
-    experimento = db.query(Experimento).filter(Experimento.id_experimento == experimento_id).first()
+    def cargar():
+        experimento = db.query(Experimento).filter(Experimento.id_experimento == experimento_id).first()
+        return experimento and _como_dict(experimento)
+    experimento = _leer_cacheado("experimento", experimento_id, cargar)
     if not experimento:
         raise HTTPException(status_code=404, detail="Experimento no encontrado")
     return experimento
@@ -550,6 +2571,12 @@ def get_experimento(experimento_id: int, db: Session = Depends(get_db)):
 
 
 #Rutas usuarios
+# Las respuestas de usuario incluyen su rol: se carga en la misma consulta (joinedload)
+# para no lanzar una consulta más por cada usuario al serializar
+def _usuario_con_rol(db, id_usuario):
+    return db.query(Usuario).options(joinedload(Usuario.rol)).filter(Usuario.id_usuarios == id_usuario).first()
+
+
 @app.post("/usuarios/", response_model=UsuarioBase, tags=["Usuarios"])
 def create_usuario(id_roles: int, usuario: str, email: str, contrasena: str, estado: str, profileImage: str = None, db: Session = Depends(get_db)):
     rol = db.query(Rol).filter(Rol.id_roles == id_roles).first()
@@ -566,13 +2593,12 @@ def create_usuario(id_roles: int, usuario: str, email: str, contrasena: str, est
     )
     db.add(new_usuario)
     db.commit()
-    db.refresh(new_usuario)
-    return new_usuario
+    return _usuario_con_rol(db, sa_inspect(new_usuario).identity[0])
 
 
 @app.get("/usuarios/", response_model=List[UsuarioBase], tags=["Usuarios"])
-def read_usuarios(db: Session = Depends(get_db)):
-    usuarios = db.query(Usuario).all()
+def read_usuarios(response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    usuarios = _paginar(db.query(Usuario).options(joinedload(Usuario.rol)), response, [Usuario.id_usuarios], cursor, limit, total)
     if not usuarios:
         raise HTTPException(
             status_code=404, 
@@ -583,7 +2609,7 @@ def read_usuarios(db: Session = Depends(get_db)):
 
 @app.delete("/usuarios/{id_usuario}", response_model=UsuarioBase, tags=["Usuarios"])
 def delete_usuario(id_usuario: int, db: Session = Depends(get_db)):
-    usuario = db.query(Usuario).filter(Usuario.id_usuarios == id_usuario).first()
+    usuario = _usuario_con_rol(db, id_usuario)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     db.delete(usuario)
@@ -596,26 +2622,31 @@ def update_usuario(id_usuario: int, id_roles: int, usuario: str, email: str, con
     existing_usuario = db.query(Usuario).filter(Usuario.id_usuarios == id_usuario).first()
     if not existing_usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    if existing_usuario.usuario != usuario:
+        # El resumen de notas en caché incluye el nombre de usuario
+        _marcar_resumen(db, db.scalars(select(ResumenNota.id_clases).where(ResumenNota.id_usuarios == id_usuario).distinct()))
     existing_usuario.id_roles = id_roles
     existing_usuario.usuario = usuario
     existing_usuario.email = email
     existing_usuario.contrasena = contrasena
     existing_usuario.estado = estado
     db.commit()
-    db.refresh(existing_usuario)
-    return existing_usuario
+    return _usuario_con_rol(db, id_usuario)
 
 
 @app.get("/clases/{clase_id}", response_model=ClaseDetail, tags=["Clases"])
 def get_clase(clase_id: int, db: Session = Depends(get_db)):
-    clase = db.query(Clase).filter(Clase.id_clases == clase_id).first()
+    def cargar():
+        clase = db.query(Clase).filter(Clase.id_clases == clase_id).first()
+        return clase and _como_dict(clase)
+    clase = _leer_cacheado("clase", clase_id, cargar)
     if not clase:
         raise HTTPException(status_code=404, detail="Clase no encontrada")
     return clase
 
 @app.get("/usuarios/email/{email}", response_model=UsuarioBase, tags=["Usuarios"])
 def get_usuario_by_email(email: str, db: Session = Depends(get_db)):
-    usuario = db.query(Usuario).filter(Usuario.email == email).first()
+    usuario = db.query(Usuario).options(joinedload(Usuario.rol)).filter(Usuario.email == email).first()
     
     if not usuario:
         raise HTTPException(
@@ -647,21 +2678,33 @@ def create_perfil(id_usuario: int, nombre_completo: str, genero: str, pais: str
     db.refresh(new_perfil)
     return new_perfil
 
+# Un cuestionario pertenece a una clase si está enlazado a alguno de sus temarios. Se
+# comprueba con EXISTS (semi-join): con un JOIN cada fila saldría repetida una vez por
+# cada temario de la clase al que está enlazado el cuestionario
+def _cuestionario_en_clase(id_questionario, id_clases):
+    return exists().where(
+        TemarioCuestionario.id_clases == id_clases,
+        TemarioCuestionario.id_questionario == id_questionario,
+    )
+
+
 # Endpoint GET para obtener los cuestionarios dependiendo del id_clases
 @app.get("/cuestionarios/clase/{id_clases}", response_model=List[CuestionarioResponse], tags=["Cuestionarios"])
-def get_cuestionarios_por_clase(id_clases: int, db: Session = Depends(get_db)):
-    cuestionarios = (
-        db.query(
+def get_cuestionarios_por_clase(id_clases: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    cuestionarios, etag = _leer_cacheado_con_etag("cuestionarios_clase", id_clases, lambda: [
+        dict(fila._mapping)
+        for fila in db.query(
             Cuestionario.id_questionario,
             Cuestionario.nombre_cuestionario,
             Cuestionario.fecha_publicacion
         )
-        .join(TemarioCuestionario, Cuestionario.id_questionario == TemarioCuestionario.id_questionario)
-        .filter(TemarioCuestionario.id_clases == id_clases)
-        .all()
-    )
+        .filter(_cuestionario_en_clase(Cuestionario.id_questionario, id_clases))
+    ])
     if not cuestionarios:
         raise HTTPException(status_code=404, detail="No se encontraron cuestionarios para la clase especificada")
+    no_modificado = _condicional(request, response, "cuestionarios_clase", etag)
+    if no_modificado:
+        return no_modificado
     return cuestionarios
 
 
@@ -678,6 +2721,7 @@ def create_clase(nombre_clases: str, descripcion_clases: str, contenido: str = N
     )
     db.add(new_clase)
     db.commit()
+    cache_catalogo.invalidar_espacio("clases")
     db.refresh(new_clase)
     return new_clase
 
@@ -691,18 +2735,30 @@ def update_clase_media(clase_id: int, foto_clases: str = None, video_clases: str
     if video_clases is not None:
         existing_clase.video_clases = video_clases
     db.commit()
+    cache_catalogo.invalidar("clase", clase_id)
+    cache_catalogo.invalidar_espacio("clases")
     db.refresh(existing_clase)
     return existing_clase
 
 
 @app.get("/clases/", tags=["Clases"])
-def read_clases(db: Session = Depends(get_db)):
-    clases = db.query(Clase).all()
+def read_clases(request: Request, response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    def cargar():
+        # Las cabeceras de paginación se guardan junto a la página
+        pagina = Response()
+        clases = _paginar(db.query(Clase), pagina, [Clase.id_clases], cursor, limit, total)
+        cabeceras = {nombre: pagina.headers[nombre] for nombre in ("X-Next-Cursor", "X-Total-Count") if nombre in pagina.headers}
+        return [_como_dict(clase) for clase in clases], cabeceras
+    (clases, cabeceras), etag = _leer_cacheado_con_etag("clases", (limit, cursor, total), cargar)
     if not clases:
         raise HTTPException(
             status_code=404, 
             detail="No se encontraron clases en la base de datos"
         )
+    no_modificado = _condicional(request, response, "clases", etag)
+    if no_modificado:
+        return no_modificado
+    response.headers.update(cabeceras)
     return clases
 
 
@@ -717,6 +2773,8 @@ def update_clase(clase_id: int, nombre_clases: str, descripcion_clases: str, con
     existing_clase.foto_clases = foto_clases
     existing_clase.video_clases = video_clases
     db.commit()
+    cache_catalogo.invalidar("clase", clase_id)
+    cache_catalogo.invalidar_espacio("clases")
     db.refresh(existing_clase)
     return existing_clase
 
@@ -727,6 +2785,8 @@ def delete_clase(clase_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Clase no encontrada")
     db.delete(clase)
     db.commit()
+    cache_catalogo.invalidar("clase", clase_id)
+    cache_catalogo.invalidar_espacio("clases")
     return clase
 
 # Rutas para Cuestionarios
@@ -744,17 +2804,149 @@ def create_cuestionario(nombre_cuestionario: str, descrip_cuestionario: str, fot
     return nuevo_cuestionario
 
 
+def _importar_cuestionarios(db, documentos):
+    """Inserta cuestionarios con sus preguntas y enlaces a temarios en una transacción.
+
+    Se valida todo antes de escribir: cada temario enlazado debe existir y pertenecer
+    a la clase indicada. Los errores se devuelven por documento con un 422.
+    """
+    if len(documentos) > IMPORTACION_MAX_DOCUMENTOS:
+        raise HTTPException(status_code=413, detail=f"La importación supera el máximo de {IMPORTACION_MAX_DOCUMENTOS} cuestionarios")
+
+    id_temarios = {enlace.id_temario for documento in documentos for enlace in documento.temarios}
+    clase_de_temario = dict(
+        db.execute(select(Temario.id_temario, Temario.id_clases).where(Temario.id_temario.in_(id_temarios))).all()
+    ) if id_temarios else {}
+    errores = []
+    for indice, documento in enumerate(documentos):
+        for enlace in documento.temarios:
+            if enlace.id_temario not in clase_de_temario:
+                errores.append({"indice": indice, "detalle": f"Temario {enlace.id_temario} no encontrado"})
+            elif clase_de_temario[enlace.id_temario] != enlace.id_clases:
+                errores.append({"indice": indice, "detalle": f"El temario {enlace.id_temario} no pertenece a la clase {enlace.id_clases}"})
+    if errores:
+        raise HTTPException(status_code=422, detail={"errores": errores})
+
+    fecha = datetime.utcnow()
+    ids = _insertar_en_bloque(db, Cuestionario.__table__, [
+        {
+            "nombre_cuestionario": documento.nombre_cuestionario,
+            "descrip_cuestionario": documento.descrip_cuestionario,
+            "foto_cuestionario": documento.foto_cuestionario,
+            "video_cuestionario": documento.video_cuestionario,
+            "fecha_publicacion": fecha,
+        }
+        for documento in documentos
+    ])
+    preguntas = [
+        {"id_questionario": id_questionario, **pregunta.model_dump()}
+        for documento, id_questionario in zip(documentos, ids)
+        for pregunta in documento.preguntas
+    ]
+    enlaces = [
+        {"id_questionario": id_questionario, **enlace.model_dump()}
+        for documento, id_questionario in zip(documentos, ids)
+        for enlace in documento.temarios
+    ]
+    for tabla, filas in ((Pregunta.__table__, preguntas), (TemarioCuestionario.__table__, enlaces)):
+        for inicio in range(0, len(filas), IMPORTACION_FILAS_POR_INSERT):
+            db.execute(insert(tabla).values(filas[inicio:inicio + IMPORTACION_FILAS_POR_INSERT]))
+    db.commit()
+    cache_catalogo.invalidar("cuestionarios_clase", *{enlace["id_clases"] for enlace in enlaces})
+    return {
+        "cuestionarios": [
+            {"id_questionario": id_questionario, "preguntas": len(documento.preguntas), "temarios": len(documento.temarios)}
+            for documento, id_questionario in zip(documentos, ids)
+        ],
+        "total_preguntas": len(preguntas),
+        "total_temarios": len(enlaces),
+    }
+
+
+def _importar_cuestionarios_sesion(documentos):
+    db = SessionLocal()
+    try:
+        return _importar_cuestionarios(db, documentos)
+    finally:
+        db.close()
+
+
+@app.post("/cuestionarios/importar", tags=["Cuestionarios"])
+def importar_cuestionarios(documentos: Union[CuestionarioImport, List[CuestionarioImport]], db: Session = Depends(get_db)):
+    if isinstance(documentos, CuestionarioImport):
+        documentos = [documentos]
+    return _importar_cuestionarios(db, documentos)
+
+
+@app.post("/cuestionarios/importar/ndjson", tags=["Cuestionarios"])
+async def importar_cuestionarios_ndjson(request: Request):
+    """Importa un flujo NDJSON con un cuestionario por línea."""
+    excedido = HTTPException(status_code=413, detail=f"La importación supera el máximo de {IMPORTACION_MAX_BYTES} bytes")
+    longitud = request.headers.get("content-length")
+    if longitud and longitud.isdigit() and int(longitud) > IMPORTACION_MAX_BYTES:
+        raise excedido
+    documentos = []
+    errores = []
+    # Solo se guarda la línea incompleta del final; cada bloque se recorre una vez
+    pendiente = bytearray()
+    recibido = 0
+    numero = 0
+
+    def comprobar_linea():
+        if len(pendiente) > IMPORTACION_MAX_BYTES_LINEA:
+            raise HTTPException(status_code=413, detail=f"La línea {numero + 1} supera el máximo de {IMPORTACION_MAX_BYTES_LINEA} bytes")
+
+    def procesar(linea):
+        nonlocal numero
+        numero += 1
+        if not linea.strip():
+            return
+        try:
+            documentos.append(CuestionarioImport.model_validate_json(linea))
+        except ValidationError as e:
+            errores.append({"linea": numero, "errores": [
+                {"campo": ".".join(str(parte) for parte in error["loc"]), "detalle": error["msg"]} for error in e.errors()
+            ]})
+        # Las líneas no válidas también cuentan, así la lista de errores no crece sin límite
+        if len(documentos) + len(errores) > IMPORTACION_MAX_DOCUMENTOS:
+            raise HTTPException(status_code=413, detail=f"La importación supera el máximo de {IMPORTACION_MAX_DOCUMENTOS} cuestionarios")
+
+    async for piece in request.stream():
+        recibido += len(piece)
+        if recibido > IMPORTACION_MAX_BYTES:
+            raise excedido
+        inicio = 0
+        while (fin := piece.find(b"\n", inicio)) != -1:
+            pendiente += piece[inicio:fin]
+            comprobar_linea()
+            procesar(pendiente)
+            pendiente.clear()
+            inicio = fin + 1
+        pendiente += piece[inicio:]
+        comprobar_linea()
+    procesar(pendiente)
+    if errores:
+        raise HTTPException(status_code=422, detail={"errores": errores})
+    if not documentos:
+        raise HTTPException(status_code=400, detail="No se recibió ningún cuestionario")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _importar_cuestionarios_sesion, documentos)
+
+
 @app.get("/cuestionarios/{cuestionario_id}", response_model=CuestionarioDetail, tags=["Cuestionarios"])
 def get_cuestionario(cuestionario_id: int, db: Session = Depends(get_db)):
-    cuestionario = db.query(Cuestionario).filter(Cuestionario.id_questionario == cuestionario_id).first()
+    def cargar():
+        cuestionario = db.query(Cuestionario).filter(Cuestionario.id_questionario == cuestionario_id).first()
+        return cuestionario and _como_dict(cuestionario)
+    cuestionario = _leer_cacheado("cuestionario", cuestionario_id, cargar)
     if not cuestionario:
         raise HTTPException(status_code=404, detail="Cuestionario no encontrado")
     return cuestionario
 
 
 @app.get("/cuestionarios/", tags=["Cuestionarios"])
-def read_cuestionarios(db: Session = Depends(get_db)):
-    cuestionarios = db.query(Cuestionario).all()
+def read_cuestionarios(response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    cuestionarios = _paginar(db.query(Cuestionario), response, [Cuestionario.id_questionario], cursor, limit, total)
     if not cuestionarios:
         raise HTTPException(
             status_code=404, 
@@ -763,16 +2955,28 @@ def read_cuestionarios(db: Session = Depends(get_db)):
     return cuestionarios
 
 
+def _clases_de_cuestionario(db, id_questionario):
+    return list(db.scalars(
+        select(TemarioCuestionario.id_clases).where(TemarioCuestionario.id_questionario == id_questionario).distinct()
+    ))
+
+
 @app.put("/cuestionarios/{cuestionario_id}", tags=["Cuestionarios"])
 def update_cuestionario(cuestionario_id: int, nombre_cuestionario: str, descrip_cuestionario: str, foto_cuestionario: str = None, video_cuestionario: str = None, db: Session = Depends(get_db)):
     existing_cuestionario = db.query(Cuestionario).filter(Cuestionario.id_questionario == cuestionario_id).first()
     if not existing_cuestionario:
         raise HTTPException(status_code=404, detail="Cuestionario no encontrado")
+    clases = _clases_de_cuestionario(db, cuestionario_id)
+    if existing_cuestionario.nombre_cuestionario != nombre_cuestionario:
+        # El resumen de notas en caché incluye el nombre del cuestionario
+        _marcar_resumen(db, clases)
     existing_cuestionario.nombre_cuestionario = nombre_cuestionario
     existing_cuestionario.descrip_cuestionario = descrip_cuestionario
     existing_cuestionario.foto_cuestionario = foto_cuestionario
     existing_cuestionario.video_cuestionario = video_cuestionario
     db.commit()
+    cache_catalogo.invalidar("cuestionario", cuestionario_id)
+    cache_catalogo.invalidar("cuestionarios_clase", *clases)
     db.refresh(existing_cuestionario)
     return existing_cuestionario
 
@@ -782,10 +2986,553 @@ def delete_cuestionario(cuestionario_id: int, db: Session = Depends(get_db)):
     cuestionario = db.query(Cuestionario).filter(Cuestionario.id_questionario == cuestionario_id).first()
     if not cuestionario:
         raise HTTPException(status_code=404, detail="Cuestionario no encontrado")
+    clases = _clases_de_cuestionario(db, cuestionario_id)
     db.delete(cuestionario)
     db.commit()
+    cache_catalogo.invalidar("cuestionario", cuestionario_id)
+    cache_catalogo.invalidar("preguntas_cuestionario", cuestionario_id)
+    cache_catalogo.invalidar("cuestionarios_clase", *clases)
     return cuestionario
 
+# Mantenimiento de RESUMEN_NOTAS. Las inserciones se suman de forma incremental con
+# un upsert; las modificaciones y borrados recalculan solo los grupos (usuario,
+# cuestionario) afectados. El SQL es válido en MySQL y en SQLite (pruebas): la última
+# nota sale de una subconsulta que usa el índice (id_usuarios, id_questionario).
+_SQL_RECALCULAR_RESUMEN = """
+INSERT INTO RESUMEN_NOTAS (id_clases, id_usuarios, id_questionario, intentos, nota_max, suma_notas,
+                           nota_ultima, fecha_ultima, total_correctas, total_falladas)
+SELECT tc.id_clases, r.id_usuarios, r.id_questionario, COUNT(*), MAX(r.nota), SUM(r.nota),
+       (SELECT u.nota FROM RESULTADOS_CUESTIONARIOS u
+        WHERE u.id_usuarios = r.id_usuarios AND u.id_questionario = r.id_questionario
+        ORDER BY u.fecha_completado DESC, u.id_resultado_cuestionario DESC LIMIT 1),
+       MAX(r.fecha_completado), SUM(r.total_correctas), SUM(r.total_falladas)
+FROM RESULTADOS_CUESTIONARIOS r
+JOIN (SELECT DISTINCT id_clases, id_questionario FROM TEMEARIOS_CUESTIONARIOS) tc ON tc.id_questionario = r.id_questionario
+WHERE {filtro}
+GROUP BY tc.id_clases, r.id_usuarios, r.id_questionario
+"""
+
+
+def _sumar_al_resumen(db, resultados):
+    """Suma al resumen una lista de resultados nuevos (dicts con las columnas del resultado)."""
+    grupos = {}
+    for resultado in resultados:
+        clave = (resultado["id_usuarios"], resultado["id_questionario"])
+        grupo = grupos.get(clave)
+        if grupo is None:
+            grupos[clave] = {
+                "id_usuarios": resultado["id_usuarios"],
+                "id_questionario": resultado["id_questionario"],
+                "intentos": 1,
+                "nota_max": resultado["nota"],
+                "suma_notas": resultado["nota"],
+                "nota_ultima": resultado["nota"],
+                "fecha_ultima": resultado["fecha_completado"],
+                "total_correctas": resultado["total_correctas"],
+                "total_falladas": resultado["total_falladas"],
+            }
+            continue
+        grupo["intentos"] += 1
+        grupo["nota_max"] = max(grupo["nota_max"], resultado["nota"])
+        grupo["suma_notas"] += resultado["nota"]
+        if resultado["fecha_completado"] >= grupo["fecha_ultima"]:
+            grupo["nota_ultima"] = resultado["nota"]
+            grupo["fecha_ultima"] = resultado["fecha_completado"]
+        grupo["total_correctas"] += resultado["total_correctas"]
+        grupo["total_falladas"] += resultado["total_falladas"]
+    if not grupos:
+        return
+
+    clases_por_cuestionario = defaultdict(list)
+    enlaces = (
+        db.query(TemarioCuestionario.id_questionario, TemarioCuestionario.id_clases)
+        .filter(TemarioCuestionario.id_questionario.in_({q for _, q in grupos}))
+        .distinct()
+        .all()
+    )
+    for id_questionario, id_clases in enlaces:
+        clases_por_cuestionario[id_questionario].append(id_clases)
+    filas = [
+        {"id_clases": id_clases, **grupo}
+        for (_, id_questionario), grupo in grupos.items()
+        for id_clases in clases_por_cuestionario[id_questionario]
+    ]
+    if not filas:
+        return
+    _marcar_resumen(db, {fila["id_clases"] for fila in filas})
+
+    # MySQL aplica las asignaciones en orden: nota_ultima debe ir antes que fecha_ultima
+    _upsert(db, ResumenNota.__table__, filas, lambda actual, nuevo: [
+        ("intentos", actual.intentos + nuevo.intentos),
+        ("nota_max", case((nuevo.nota_max > actual.nota_max, nuevo.nota_max), else_=actual.nota_max)),
+        ("suma_notas", actual.suma_notas + nuevo.suma_notas),
+        ("nota_ultima", case((nuevo.fecha_ultima >= actual.fecha_ultima, nuevo.nota_ultima), else_=actual.nota_ultima)),
+        ("fecha_ultima", case((nuevo.fecha_ultima > actual.fecha_ultima, nuevo.fecha_ultima), else_=actual.fecha_ultima)),
+        ("total_correctas", actual.total_correctas + nuevo.total_correctas),
+        ("total_falladas", actual.total_falladas + nuevo.total_falladas),
+    ])
+
+
+def _upsert(db, tabla, filas, asignaciones):
+    """Inserta las filas y, si la clave primaria ya existe, aplica las asignaciones.
+
+    asignaciones(actual, nuevo) devuelve pares (columna, expresión), donde actual son las
+    columnas de la fila existente y nuevo los valores que se intentaban insertar. En MySQL
+    es INSERT ... ON DUPLICATE KEY UPDATE; en SQLite (pruebas), ON CONFLICT DO UPDATE.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        insercion = sqlite_insert(tabla).values(filas)
+        pares = asignaciones(tabla.c, insercion.excluded)
+        db.execute(insercion.on_conflict_do_update(index_elements=list(tabla.primary_key.columns), set_=dict(pares)))
+    else:
+        insercion = mysql_insert(tabla).values(filas)
+        db.execute(insercion.on_duplicate_key_update(asignaciones(tabla.c, insercion.inserted)))
+
+
+def _marcar_resumen(db, ids_clases=None):
+    """Apunta las clases cuyo resumen en caché hay que invalidar cuando se confirme la
+    transacción; sin clases se invalida el resumen de todas."""
+    if ids_clases is None:
+        db.info["resumen_todas"] = True
+    else:
+        db.info.setdefault("resumen_clases", set()).update(ids_clases)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_resumen_tras_commit(sesion):
+    # Se invalida después del commit: antes, otra petición podría volver a cachear los datos viejos
+    todas = sesion.info.pop("resumen_todas", False)
+    clases = sesion.info.pop("resumen_clases", set())
+    if todas:
+        _invalidar_resumen()
+    elif clases:
+        _invalidar_resumen(*clases)
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_resumen_tras_rollback(sesion):
+    sesion.info.pop("resumen_todas", None)
+    sesion.info.pop("resumen_clases", None)
+
+
+def _invalidar_resumen(*ids_clases):
+    for espacio in ("resumen_clase", "resumen_usuarios"):
+        if ids_clases:
+            cache_catalogo.invalidar(espacio, *ids_clases)
+        else:
+            cache_catalogo.invalidar_espacio(espacio)
+
+
+def _recalcular_resumen(db, id_usuarios, id_questionario):
+    _marcar_resumen(db, db.scalars(
+        select(TemarioCuestionario.id_clases).where(TemarioCuestionario.id_questionario == id_questionario).distinct()
+    ))
+    db.execute(delete(ResumenNota).where(ResumenNota.id_usuarios == id_usuarios, ResumenNota.id_questionario == id_questionario))
+    db.execute(
+        text(_SQL_RECALCULAR_RESUMEN.format(filtro="r.id_usuarios = :usuario AND r.id_questionario = :cuestionario")),
+        {"usuario": id_usuarios, "cuestionario": id_questionario},
+    )
+
+
+def _recalcular_resumen_cuestionario(db, id_questionario):
+    # Cuando cambian los enlaces de un cuestionario con los temarios cambian sus clases
+    _marcar_resumen(db)
+    db.execute(delete(ResumenNota).where(ResumenNota.id_questionario == id_questionario))
+    db.execute(text(_SQL_RECALCULAR_RESUMEN.format(filtro="r.id_questionario = :cuestionario")), {"cuestionario": id_questionario})
+
+
+def reconstruir_resumen(db):
+    """Recalcula RESUMEN_NOTAS desde cero a partir de RESULTADOS_CUESTIONARIOS."""
+    db.execute(delete(ResumenNota))
+    db.execute(text(_SQL_RECALCULAR_RESUMEN.format(filtro="1 = 1")))
+
+
+def _insertar_en_bloque(db, tabla, filas):
+    """Inserta las filas con una sola sentencia INSERT multi-fila y devuelve sus IDs.
+
+    MySQL asigna a una inserción simple un bloque consecutivo de autoincrementos que
+    empieza en LAST_INSERT_ID(), separados por @@auto_increment_increment. SQLite
+    (pruebas) numera de uno en uno y devuelve el rowid de la última fila.
+    """
+    if not filas:
+        return []
+    resultado = db.execute(insert(tabla).values(filas))
+    if db.get_bind().dialect.name == "sqlite":
+        return list(range(resultado.lastrowid - len(filas) + 1, resultado.lastrowid + 1))
+    incremento = db.execute(text("SELECT @@auto_increment_increment")).scalar()
+    primero = resultado.lastrowid
+    return [primero + i * incremento for i in range(len(filas))]
+
+
+def _valores_resultado(resultado):
+    return {
+        "id_usuarios": resultado.id_usuarios,
+        "id_questionario": resultado.id_questionario,
+        "nota": resultado.nota,
+        "fecha_completado": resultado.fecha_completado,
+        "total_correctas": resultado.total_correctas,
+        "total_falladas": resultado.total_falladas,
+    }
+
+
+class ColaLlena(Exception):
+    pass
+
+
+# Ficheros de la cola de cada proceso: <nombre>.jsonl con los resultados y <nombre>.lock
+# bloqueado mientras el proceso vive
+RE_SPOOL_RESULTADOS = re.compile(r"(\d+(?:-[0-9a-f]{8})?)\.(?:jsonl|lock)")
+
+
+def _bloquear_spool(directorio, nombre):
+    """Bloquea <nombre>.lock sin esperar. Devuelve el fichero abierto o None si lo tiene otro proceso."""
+    cerrojo = open(os.path.join(directorio, f"{nombre}.lock"), "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(cerrojo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            cerrojo.seek(0)
+            msvcrt.locking(cerrojo.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        cerrojo.close()
+        return None
+    return cerrojo
+
+
+def _liberar_spool(cerrojo):
+    # Se borra antes de soltar el cerrojo: quien lo abra después crea uno nuevo
+    try:
+        os.remove(cerrojo.name)
+    except OSError:
+        pass
+    cerrojo.close()
+
+
+def _leer_spool(ruta):
+    """Resultados de un fichero de la cola que todavía no tienen ack, por recibo."""
+    pendientes = OrderedDict()
+    if not os.path.exists(ruta):
+        return pendientes
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                entrada = json.loads(linea)
+            except ValueError:
+                # Última línea a medio escribir si el proceso cayó durante un append
+                continue
+            if "ack" in entrada:
+                pendientes.pop(entrada["ack"], None)
+            else:
+                pendientes[entrada["recibo"]] = entrada
+    return pendientes
+
+
+class ColaResultados:
+    """Cola acotada de resultados pendientes de insertar, respaldada por ficheros JSONL.
+
+    Cada proceso escribe en su propio fichero del directorio, bloqueado mientras vive.
+    Cada resultado aceptado se añade al fichero antes de confirmarlo. Cuando su lote se
+    confirma en la base de datos se añade una línea {"ack": recibo}. Al arrancar se
+    vuelven a encolar los resultados sin ack, los propios y los de los ficheros de
+    procesos que ya no existen. Los que ya estaban en RECIBOS_RESULTADOS se descartan,
+    porque el proceso pudo caer entre el commit y el ack.
+
+    Un lote que falla por un error que no es de conexión se divide hasta aislar los
+    resultados que no se pueden insertar, que se guardan en fallidos.jsonl.
+    """
+
+    def __init__(self, directorio, maximo, lote, intervalo, fsync):
+        if fsync not in ("siempre", "intervalo", "nunca"):
+            raise ValueError(f"RESULTADOS_SPOOL_FSYNC no válido: {fsync}")
+        self.directorio = directorio
+        self.ruta = None
+        self.ruta_fallidos = os.path.join(directorio, "fallidos.jsonl")
+        self.maximo = maximo
+        self.lote = lote
+        self.intervalo = intervalo
+        self.fsync = fsync
+        self._pendientes = OrderedDict()
+        self._en_vuelo = {}
+        self._lock = threading.Lock()
+        self._hay_datos = threading.Condition(self._lock)
+        self._parar = False
+        self._spool = None
+        self._cerrojo = None
+        self._hilo = None
+        self._stats = {
+            "aceptados": 0,
+            "rechazados_cola_llena": 0,
+            "escritos": 0,
+            "descartados_duplicados": 0,
+            "invalidos": 0,
+            "fallidos": 0,
+            "lotes": 0,
+            "errores_escritura": 0,
+            "reanudados": 0,
+            "adoptados": 0,
+            "ultima_latencia_ms": None,
+            "max_latencia_ms": 0.0,
+            "ultima_escritura_ms": None,
+        }
+
+    def iniciar(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        # Un PID reutilizado tras un reinicio hereda el fichero de su antecesor, que ya no
+        # existe. Si el PID es de otro proceso vivo (directorio compartido) se añade un sufijo
+        nombre = str(os.getpid())
+        self._cerrojo = _bloquear_spool(self.directorio, nombre)
+        if self._cerrojo is None:
+            nombre = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            self._cerrojo = _bloquear_spool(self.directorio, nombre)
+        self.ruta = os.path.join(self.directorio, f"{nombre}.jsonl")
+        pendientes = _leer_spool(self.ruta)
+        reanudados = len(pendientes)
+
+        # Adoptar los ficheros de procesos muertos: su cerrojo ya no lo tiene nadie
+        adoptados = []
+        otros = {coincidencia.group(1) for coincidencia in map(RE_SPOOL_RESULTADOS.fullmatch, os.listdir(self.directorio)) if coincidencia}
+        for otro in sorted(otros - {nombre}):
+            cerrojo = _bloquear_spool(self.directorio, otro)
+            if cerrojo is None:
+                continue
+            ruta = os.path.join(self.directorio, f"{otro}.jsonl")
+            for recibo, entrada in _leer_spool(ruta).items():
+                pendientes.setdefault(recibo, entrada)
+            adoptados.append((ruta, cerrojo))
+
+        # Compactar el fichero propio dejando solo lo que sigue pendiente. Los adoptados se
+        # borran cuando su contenido ya está en disco en el fichero propio
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            for entrada in pendientes.values():
+                f.write(json.dumps(entrada) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta)
+        for ruta, cerrojo in adoptados:
+            if os.path.exists(ruta):
+                os.remove(ruta)
+            _liberar_spool(cerrojo)
+        self._spool = open(self.ruta, "a", encoding="utf-8")
+        for recibo, entrada in pendientes.items():
+            entrada["resultado"]["fecha_completado"] = datetime.fromisoformat(entrada["resultado"]["fecha_completado"])
+            self._pendientes[recibo] = {**entrada, "encolado": time.monotonic()}
+        self._stats["reanudados"] = reanudados
+        self._stats["adoptados"] = len(pendientes) - reanudados
+        self._hilo = threading.Thread(target=self._bucle, name="escritura-resultados", daemon=True)
+        self._hilo.start()
+
+    def cerrar(self):
+        with self._lock:
+            self._parar = True
+            self._hay_datos.notify()
+        if self._hilo is not None:
+            self._hilo.join()
+        if self._spool is not None:
+            self._spool.close()
+            # Con la cola vacía el fichero sobra; si queda algo lo adoptará otro proceso
+            if not self._pendientes and not self._en_vuelo:
+                os.remove(self.ruta)
+        if self._cerrojo is not None:
+            _liberar_spool(self._cerrojo)
+
+    def encolar(self, resultado):
+        recibo = str(uuid.uuid4())
+        linea = json.dumps({"recibo": recibo, "resultado": resultado}, default=datetime.isoformat) + "\n"
+        with self._lock:
+            if len(self._pendientes) + len(self._en_vuelo) >= self.maximo:
+                self._stats["rechazados_cola_llena"] += 1
+                raise ColaLlena()
+            self._spool.write(linea)
+            self._spool.flush()
+            self._pendientes[recibo] = {"recibo": recibo, "resultado": resultado, "encolado": time.monotonic()}
+            self._stats["aceptados"] += 1
+            if len(self._pendientes) >= self.lote:
+                self._hay_datos.notify()
+        if self.fsync == "siempre":
+            # Fuera del lock: un fsync cubre también lo escrito por otras peticiones a la vez
+            os.fsync(self._spool.fileno())
+        return recibo
+
+    def estado(self, recibo):
+        with self._lock:
+            if recibo in self._pendientes or recibo in self._en_vuelo:
+                return {"recibo": recibo, "estado": "pendiente"}
+        return None
+
+    def _bucle(self):
+        while True:
+            with self._lock:
+                # Se escribe al llenarse un lote o al cumplirse el intervalo
+                if len(self._pendientes) < self.lote and not self._parar:
+                    self._hay_datos.wait(self.intervalo)
+                if not self._pendientes:
+                    if self._parar:
+                        return
+                    continue
+                while self._pendientes and len(self._en_vuelo) < self.lote:
+                    recibo, entrada = self._pendientes.popitem(last=False)
+                    self._en_vuelo[recibo] = entrada
+                lote = list(self._en_vuelo.values())
+            if self.fsync == "intervalo":
+                os.fsync(self._spool.fileno())
+            try:
+                self._escribir_o_dividir(lote)
+            except Exception:
+                # Errores de conexión o bloqueos (el resto se aíslan al dividir el lote):
+                # el lote entero se reintenta más tarde
+                logger_resultados.exception("Error escribiendo un lote de %d resultados", len(lote))
+                with self._lock:
+                    self._stats["errores_escritura"] += 1
+                    # Devolver el lote al principio de la cola para reintentarlo
+                    self._pendientes = OrderedDict(list(self._en_vuelo.items()) + list(self._pendientes.items()))
+                    self._en_vuelo.clear()
+                    if self._parar:
+                        return
+                time.sleep(self.intervalo)
+                continue
+            ahora = time.monotonic()
+            with self._lock:
+                for entrada in lote:
+                    self._spool.write(json.dumps({"ack": entrada["recibo"]}) + "\n")
+                self._spool.flush()
+                self._en_vuelo.clear()
+                latencia = (ahora - lote[0]["encolado"]) * 1000
+                self._stats["lotes"] += 1
+                self._stats["ultima_latencia_ms"] = round(latencia, 1)
+                self._stats["max_latencia_ms"] = round(max(self._stats["max_latencia_ms"], latencia), 1)
+                if not self._pendientes:
+                    # Todo está confirmado: el fichero, que es solo de este proceso, se puede vaciar
+                    self._spool.truncate(0)
+
+    def _escribir_o_dividir(self, lote):
+        try:
+            self._escribir(lote)
+        except (sa_exc.OperationalError, sa_exc.InterfaceError):
+            raise
+        except Exception as e:
+            if len(lote) == 1:
+                self._guardar_fallido(lote[0], e)
+                return
+            # Dividir el lote hasta aislar los resultados que fallan; las mitades que ya se
+            # escribieron tienen recibo y no se duplican si después hay que reintentar
+            logger_resultados.warning("Lote de %d resultados rechazado (%s), se divide", len(lote), e)
+            mitad = len(lote) // 2
+            self._escribir_o_dividir(lote[:mitad])
+            self._escribir_o_dividir(lote[mitad:])
+
+    def _guardar_fallido(self, entrada, error):
+        logger_resultados.error("Resultado %s no insertado: %s", entrada["recibo"], error)
+        detalle = f"{type(error).__name__}: {error}"[:255]
+        linea = json.dumps({
+            "recibo": entrada["recibo"],
+            "resultado": entrada["resultado"],
+            "error": detalle,
+            "fecha": datetime.now().replace(microsecond=0),
+        }, default=datetime.isoformat) + "\n"
+        with self._lock:
+            with open(self.ruta_fallidos, "a", encoding="utf-8") as f:
+                f.write(linea)
+                f.flush()
+                os.fsync(f.fileno())
+            self._stats["fallidos"] += 1
+        # Con el recibo el cliente ve el resultado como rechazado; si tampoco se puede
+        # guardar, el resultado sigue en fallidos.jsonl
+        db = SessionLocal()
+        try:
+            db.execute(insert(ReciboResultado.__table__).values(
+                recibo=entrada["recibo"], id_resultado_cuestionario=None, error=detalle, fecha_escrito=datetime.now().replace(microsecond=0)
+            ))
+            db.commit()
+        except Exception:
+            logger_resultados.exception("No se pudo guardar el recibo del resultado fallido %s", entrada["recibo"])
+        finally:
+            db.close()
+
+    def _escribir(self, lote):
+        inicio = time.perf_counter()
+        db = SessionLocal()
+        try:
+            recibos = [entrada["recibo"] for entrada in lote]
+            escritos = set(db.scalars(select(ReciboResultado.recibo).where(ReciboResultado.recibo.in_(recibos))))
+            nuevos = [entrada for entrada in lote if entrada["recibo"] not in escritos]
+            validos, errores = self._validar(db, nuevos)
+            filas = [entrada["resultado"] for entrada in validos]
+            ids = _insertar_en_bloque(db, ResultadoCuestionario.__table__, filas)
+            _sumar_al_resumen(db, filas)
+            fecha = datetime.now().replace(microsecond=0)
+            recibos_nuevos = [
+                {"recibo": entrada["recibo"], "id_resultado_cuestionario": id_resultado, "error": None, "fecha_escrito": fecha}
+                for entrada, id_resultado in zip(validos, ids)
+            ] + [
+                {"recibo": recibo, "id_resultado_cuestionario": None, "error": error, "fecha_escrito": fecha}
+                for recibo, error in errores
+            ]
+            if recibos_nuevos:
+                db.execute(insert(ReciboResultado.__table__).values(recibos_nuevos))
+            db.commit()
+        finally:
+            db.close()
+        with self._lock:
+            self._stats["escritos"] += len(validos)
+            self._stats["invalidos"] += len(errores)
+            self._stats["descartados_duplicados"] += len(escritos)
+            self._stats["ultima_escritura_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+
+    def _validar(self, db, entradas):
+        # Un resultado con una clave foránea inexistente no debe bloquear al resto del lote
+        usuarios = {entrada["resultado"]["id_usuarios"] for entrada in entradas}
+        cuestionarios = {entrada["resultado"]["id_questionario"] for entrada in entradas}
+        usuarios_existentes = set(db.scalars(select(Usuario.id_usuarios).where(Usuario.id_usuarios.in_(usuarios)))) if usuarios else set()
+        cuestionarios_existentes = set(
+            db.scalars(select(Cuestionario.id_questionario).where(Cuestionario.id_questionario.in_(cuestionarios)))
+        ) if cuestionarios else set()
+        validos, errores = [], []
+        for entrada in entradas:
+            resultado = entrada["resultado"]
+            if resultado["id_usuarios"] not in usuarios_existentes:
+                errores.append((entrada["recibo"], f"Usuario {resultado['id_usuarios']} no encontrado"))
+            elif resultado["id_questionario"] not in cuestionarios_existentes:
+                errores.append((entrada["recibo"], f"Cuestionario {resultado['id_questionario']} no encontrado"))
+            else:
+                validos.append(entrada)
+        return validos, errores
+
+    def estadisticas(self):
+        with self._lock:
+            antiguo = next(iter(self._en_vuelo.values()), None) or next(iter(self._pendientes.values()), None)
+            return {
+                "profundidad": len(self._pendientes) + len(self._en_vuelo),
+                "en_vuelo": len(self._en_vuelo),
+                "maximo": self.maximo,
+                "lote": self.lote,
+                "intervalo": self.intervalo,
+                "fsync": self.fsync,
+                "spool": self.ruta,
+                "antiguedad_ms": round((time.monotonic() - antiguo["encolado"]) * 1000, 1) if antiguo else None,
+                **self._stats,
+            }
+
+
+logger_resultados = logging.getLogger("monlab.resultados")
+cola_resultados = ColaResultados(
+    RESULTADOS_SPOOL_DIR, RESULTADOS_COLA_MAX, RESULTADOS_ESCRITURA_LOTE, RESULTADOS_ESCRITURA_INTERVALO, RESULTADOS_SPOOL_FSYNC
+) if RESULTADOS_WRITE_BEHIND else None
+
+
+@app.on_event("startup")
+def iniciar_cola_resultados():
+    if cola_resultados is not None:
+        cola_resultados.iniciar()
+
+
+@app.on_event("shutdown")
+def cerrar_cola_resultados():
+    # Escribe lo que quede en la cola antes de terminar
+    if cola_resultados is not None:
+        cola_resultados.cerrar()
+
+
 # Rutas para Resultados de Cuestionarios
 @app.post("/resultados_cuestionarios/", tags=["Resultados cuestionarios"])
 def create_resultado_cuestionario(
@@ -799,6 +3546,20 @@ def create_resultado_cuestionario(
     # Obtener la fecha actual en el formato "YYYY-MM-DD HH:MM:SS"
     fecha_actual_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     fecha_actual = datetime.strptime(fecha_actual_str, "%Y-%m-%d %H:%M:%S")
+
+    if cola_resultados is not None:
+        try:
+            recibo = cola_resultados.encolar({
+                "id_questionario": id_questionario,
+                "id_usuarios": id_usuarios,
+                "nota": nota,
+                "fecha_completado": fecha_actual,
+                "total_correctas": total_correctas,
+                "total_falladas": total_falladas,
+            })
+        except ColaLlena:
+            raise HTTPException(status_code=503, detail="Cola de resultados llena", headers={"Retry-After": "1"})
+        return JSONResponse(status_code=202, content={"recibo": recibo, "estado": "pendiente"})
     
     # Se elimina la verificación de registro_existente para permitir duplicados
     nuevo_resultado = ResultadoCuestionario(
@@ -810,19 +3571,103 @@ def create_resultado_cuestionario(
         total_falladas=total_falladas
     )
     db.add(nuevo_resultado)
+    _sumar_al_resumen(db, [_valores_resultado(nuevo_resultado)])
     db.commit()
     db.refresh(nuevo_resultado)
     return nuevo_resultado
 
+@app.get("/resultados_cuestionarios/recibos/{recibo}", tags=["Resultados cuestionarios"])
+def get_recibo_resultado(recibo: str, db: Session = Depends(get_db)):
+    if cola_resultados is not None:
+        estado = cola_resultados.estado(recibo)
+        if estado is not None:
+            return estado
+    registro = db.get(ReciboResultado, recibo)
+    if registro is None:
+        raise HTTPException(status_code=404, detail="Recibo no encontrado")
+    if registro.error is not None:
+        return {"recibo": recibo, "estado": "rechazado", "detalle": registro.error}
+    return {"recibo": recibo, "estado": "escrito", "id_resultado_cuestionario": registro.id_resultado_cuestionario}
+
+@app.get("/debug/resultados_cola", tags=["Debug"])
+def resultados_cola_stats():
+    if cola_resultados is None:
+        return {"activa": False}
+    return {"activa": True, **cola_resultados.estadisticas()}
+
+@app.post("/resultados_cuestionarios/lote", tags=["Resultados cuestionarios"])
+def create_resultados_cuestionarios_lote(resultados: List[dict], parcial: bool = False, db: Session = Depends(get_db)):
+    """Inserta una lista de resultados en una sola transacción.
+
+    Cada elemento se valida por separado. Con errores y parcial=false no se inserta nada
+    y se responde 422 con los errores; con parcial=true se insertan los válidos.
+    """
+    if len(resultados) > RESULTADOS_LOTE_MAX:
+        raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {RESULTADOS_LOTE_MAX} resultados")
+
+    fecha_actual = datetime.now().replace(microsecond=0)
+    errores = {}
+    validos = {}
+    for indice, datos in enumerate(resultados):
+        try:
+            resultado = ResultadoCuestionarioCreate.model_validate(datos)
+        except ValidationError as e:
+            errores[indice] = [
+                {"campo": ".".join(str(parte) for parte in error["loc"]), "detalle": error["msg"]}
+                for error in e.errors()
+            ]
+            continue
+        validos[indice] = resultado
+
+    # Claves foráneas comprobadas con una consulta por tabla en lugar de una por resultado
+    usuarios = {r.id_usuarios for r in validos.values()}
+    cuestionarios = {r.id_questionario for r in validos.values()}
+    usuarios_existentes = set(db.scalars(select(Usuario.id_usuarios).where(Usuario.id_usuarios.in_(usuarios)))) if usuarios else set()
+    cuestionarios_existentes = set(
+        db.scalars(select(Cuestionario.id_questionario).where(Cuestionario.id_questionario.in_(cuestionarios)))
+    ) if cuestionarios else set()
+    for indice, resultado in list(validos.items()):
+        fallos = []
+        if resultado.id_usuarios not in usuarios_existentes:
+            fallos.append({"campo": "id_usuarios", "detalle": f"Usuario {resultado.id_usuarios} no encontrado"})
+        if resultado.id_questionario not in cuestionarios_existentes:
+            fallos.append({"campo": "id_questionario", "detalle": f"Cuestionario {resultado.id_questionario} no encontrado"})
+        if fallos:
+            errores[indice] = fallos
+            del validos[indice]
+
+    lista_errores = [{"indice": indice, "errores": errores[indice]} for indice in sorted(errores)]
+    if lista_errores and not parcial:
+        raise HTTPException(status_code=422, detail={"errores": lista_errores})
+
+    filas = [
+        {
+            "id_questionario": resultado.id_questionario,
+            "id_usuarios": resultado.id_usuarios,
+            "nota": resultado.nota,
+            "fecha_completado": resultado.fecha_completado or fecha_actual,
+            "total_correctas": resultado.total_correctas,
+            "total_falladas": resultado.total_falladas,
+        }
+        for resultado in validos.values()
+    ]
+    ids_insertados = _insertar_en_bloque(db, ResultadoCuestionario.__table__, filas)
+    _sumar_al_resumen(db, filas)
+    db.commit()
+
+    ids = [None] * len(resultados)
+    for indice, id_resultado in zip(validos, ids_insertados):
+        ids[indice] = id_resultado
+    return {"insertados": len(ids_insertados), "ids": ids, "errores": lista_errores}
+
 @app.get("/resultados_cuestionarios/usuario/{id_usuario}/clase/{id_clases}", response_model=List[ResultadoAlumnoResponse], tags=["Resultados cuestionarios"])
 def get_resultados_por_usuario_y_clase(id_usuario: int, id_clases: int, db: Session = Depends(get_db)):
   
     resultados = (
         db.query(ResultadoCuestionario)
-        .join(TemarioCuestionario, TemarioCuestionario.id_questionario == ResultadoCuestionario.id_questionario)
         .filter(
             ResultadoCuestionario.id_usuarios == id_usuario,
-            TemarioCuestionario.id_clases == id_clases
+            _cuestionario_en_clase(ResultadoCuestionario.id_questionario, id_clases)
         )
         .all()
     )
@@ -840,10 +3685,9 @@ def get_resultados_por_clase(id_clases: int, db: Session = Depends(get_db)):
   
     resultados = (
         db.query(ResultadoCuestionario, Cuestionario.nombre_cuestionario, Usuario.usuario)
-        .join(TemarioCuestionario, TemarioCuestionario.id_questionario == ResultadoCuestionario.id_questionario)
         .join(Cuestionario, Cuestionario.id_questionario == ResultadoCuestionario.id_questionario)
         .join(Usuario, Usuario.id_usuarios == ResultadoCuestionario.id_usuarios)
-        .filter(TemarioCuestionario.id_clases == id_clases)
+        .filter(_cuestionario_en_clase(ResultadoCuestionario.id_questionario, id_clases))
         .all()
     )
     
@@ -868,15 +3712,87 @@ def get_resultados_por_clase(id_clases: int, db: Session = Depends(get_db)):
         })
     return response
 
+# Exportación de notas en NDJSON o CSV. Las filas se leen con un cursor sin buffer de
+# MySQL (stream_results) y se envían por bloques, así la memoria no depende del número de filas
+def _consulta_exportacion(filtro):
+    return (
+        select(
+            ResultadoCuestionario.id_resultado_cuestionario,
+            ResultadoCuestionario.id_questionario,
+            ResultadoCuestionario.id_usuarios,
+            ResultadoCuestionario.nota,
+            ResultadoCuestionario.fecha_completado,
+            ResultadoCuestionario.total_correctas,
+            ResultadoCuestionario.total_falladas,
+            Cuestionario.nombre_cuestionario,
+            Usuario.usuario.label("nombre_usuario"),
+        )
+        .join(Cuestionario, Cuestionario.id_questionario == ResultadoCuestionario.id_questionario)
+        .join(Usuario, Usuario.id_usuarios == ResultadoCuestionario.id_usuarios)
+        .where(filtro)
+        .order_by(ResultadoCuestionario.id_resultado_cuestionario)
+    )
+
+
+def _valor_exportable(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+
+def _exportar_filas(consulta, formato):
+    # Usa su propia conexión: la sesión de get_db ya está cerrada cuando se envía la respuesta
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=EXPORT_BATCH_SIZE).execute(consulta)
+        columnas = list(result.keys())
+        if formato == "csv":
+            salida = io.StringIO()
+            writer = csv.writer(salida)
+            writer.writerow(columnas)
+            for filas in result.partitions(EXPORT_BATCH_SIZE):
+                writer.writerows([[_valor_exportable(valor) for valor in fila] for fila in filas])
+                yield salida.getvalue()
+                salida.seek(0)
+                salida.truncate()
+            yield salida.getvalue()
+        else:
+            for filas in result.partitions(EXPORT_BATCH_SIZE):
+                yield "".join(
+                    json.dumps(dict(zip(columnas, map(_valor_exportable, fila))), ensure_ascii=False) + "\n" for fila in filas
+                )
+
+
+def _respuesta_exportacion(consulta, formato, nombre):
+    media_type = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _exportar_filas(consulta, formato),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}.{formato}"'},
+    )
+
+
+@app.get("/resultados_cuestionarios/clase/{id_clases}/export", tags=["Resultados cuestionarios"])
+def export_resultados_por_clase(id_clases: int, formato: str = Query("ndjson", pattern="^(ndjson|csv)$"), db: Session = Depends(get_db)):
+    if not db.query(Clase.id_clases).filter(Clase.id_clases == id_clases).first():
+        raise HTTPException(status_code=404, detail="Clase no encontrada")
+    consulta = _consulta_exportacion(_cuestionario_en_clase(ResultadoCuestionario.id_questionario, id_clases))
+    return _respuesta_exportacion(consulta, formato, f"resultados_clase_{id_clases}")
+
+
+@app.get("/resultados_cuestionarios/cuestionario/{id_questionario}/export", tags=["Resultados cuestionarios"])
+def export_resultados_por_cuestionario(id_questionario: int, formato: str = Query("ndjson", pattern="^(ndjson|csv)$"), db: Session = Depends(get_db)):
+    if not db.query(Cuestionario.id_questionario).filter(Cuestionario.id_questionario == id_questionario).first():
+        raise HTTPException(status_code=404, detail="Cuestionario no encontrado")
+    consulta = _consulta_exportacion(ResultadoCuestionario.id_questionario == id_questionario)
+    return _respuesta_exportacion(consulta, formato, f"resultados_cuestionario_{id_questionario}")
+
+
 @app.get("/notas/clase/{id_clases}/usuario/{id_usuario}", response_model=List[ResultadoAlumnoConCuestionarioResponse], tags=["Notas"])
 def get_notas_por_clase_usuario(id_clases: int, id_usuario: int, db: Session = Depends(get_db)):
     resultados = (
         db.query(ResultadoCuestionario, Cuestionario.nombre_cuestionario)
-        .join(TemarioCuestionario, ResultadoCuestionario.id_questionario == TemarioCuestionario.id_questionario)
         .join(Cuestionario, Cuestionario.id_questionario == ResultadoCuestionario.id_questionario)
         .filter(
             ResultadoCuestionario.id_usuarios == id_usuario,
-            TemarioCuestionario.id_clases == id_clases
+            _cuestionario_en_clase(ResultadoCuestionario.id_questionario, id_clases)
         )
         .all()
     )
@@ -901,9 +3817,76 @@ def get_notas_por_clase_usuario(id_clases: int, id_usuario: int, db: Session = D
     return response
 
 
+# Resumen de notas: se lee de RESUMEN_NOTAS, una fila por alumno y cuestionario,
+# sin recorrer todos los intentos
+@app.get("/notas/resumen/clase/{id_clases}", response_model=List[ResumenNotaResponse], tags=["Notas"])
+def get_resumen_notas_por_clase(id_clases: int, db: Session = Depends(get_db)):
+    resumen = _leer_cacheado("resumen_clase", id_clases, lambda: _resumen_notas_clase(db, id_clases))
+    if not resumen:
+        raise HTTPException(status_code=404, detail=f"No se encontraron notas para la clase {id_clases}")
+    return resumen
+
+
+def _resumen_notas_clase(db, id_clases):
+    filas = (
+        db.query(ResumenNota, Usuario.usuario, Cuestionario.nombre_cuestionario)
+        .join(Usuario, Usuario.id_usuarios == ResumenNota.id_usuarios)
+        .join(Cuestionario, Cuestionario.id_questionario == ResumenNota.id_questionario)
+        .filter(ResumenNota.id_clases == id_clases)
+        .order_by(ResumenNota.id_usuarios, ResumenNota.id_questionario)
+        .all()
+    )
+    return [
+        {
+            "id_clases": resumen.id_clases,
+            "id_usuarios": resumen.id_usuarios,
+            "id_questionario": resumen.id_questionario,
+            "nombre_usuario": nombre_usuario,
+            "nombre_cuestionario": nombre_cuestionario,
+            "intentos": resumen.intentos,
+            "nota_max": resumen.nota_max,
+            "nota_media": resumen.suma_notas / resumen.intentos,
+            "nota_ultima": resumen.nota_ultima,
+            "fecha_ultima": resumen.fecha_ultima,
+            "total_correctas": resumen.total_correctas,
+            "total_falladas": resumen.total_falladas,
+        }
+        for resumen, nombre_usuario, nombre_cuestionario in filas
+    ]
+
+
+@app.get("/notas/resumen/clase/{id_clases}/usuarios", response_model=List[ResumenUsuarioResponse], tags=["Notas"])
+def get_resumen_notas_por_usuario(id_clases: int, db: Session = Depends(get_db)):
+    resumen = _leer_cacheado("resumen_usuarios", id_clases, lambda: _resumen_notas_usuarios(db, id_clases))
+    if not resumen:
+        raise HTTPException(status_code=404, detail=f"No se encontraron notas para la clase {id_clases}")
+    return resumen
+
+
+def _resumen_notas_usuarios(db, id_clases):
+    filas = (
+        db.query(
+            ResumenNota.id_usuarios,
+            Usuario.usuario.label("nombre_usuario"),
+            func.count().label("cuestionarios"),
+            func.sum(ResumenNota.intentos).label("intentos"),
+            (func.sum(ResumenNota.suma_notas) / func.sum(ResumenNota.intentos)).label("nota_media"),
+            func.avg(ResumenNota.nota_max).label("media_mejores_notas"),
+            func.sum(ResumenNota.total_correctas).label("total_correctas"),
+            func.sum(ResumenNota.total_falladas).label("total_falladas"),
+        )
+        .join(Usuario, Usuario.id_usuarios == ResumenNota.id_usuarios)
+        .filter(ResumenNota.id_clases == id_clases)
+        .group_by(ResumenNota.id_usuarios, Usuario.usuario)
+        .order_by(ResumenNota.id_usuarios)
+        .all()
+    )
+    return [dict(fila._mapping) for fila in filas]
+
+
 @app.get("/resultados_cuestionarios/", tags=["Resultados cuestionarios"])
-def read_resultados_cuestionarios(db: Session = Depends(get_db)):
-    resultados = db.query(ResultadoCuestionario).all()
+def read_resultados_cuestionarios(response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    resultados = _paginar(db.query(ResultadoCuestionario), response, [ResultadoCuestionario.id_resultado_cuestionario], cursor, limit, total)
     if not resultados:
         raise HTTPException(
             status_code=404, 
@@ -917,12 +3900,16 @@ def update_resultado_cuestionario(resultado_id: int, id_questionario: int, id_us
     existing_resultado = db.query(ResultadoCuestionario).filter(ResultadoCuestionario.id_resultado_cuestionario == resultado_id).first()
     if not existing_resultado:
         raise HTTPException(status_code=404, detail="Resultado no encontrado")
+    anterior = (existing_resultado.id_usuarios, existing_resultado.id_questionario)
     existing_resultado.id_questionario = id_questionario
     existing_resultado.id_usuarios = id_usuarios
     existing_resultado.nota = nota
     existing_resultado.fecha_completado = fecha_completado
     existing_resultado.total_correctas = total_correctas
     existing_resultado.total_falladas = total_falladas
+    db.flush()
+    for grupo in {anterior, (id_usuarios, id_questionario)}:
+        _recalcular_resumen(db, *grupo)
     db.commit()
     db.refresh(existing_resultado)
     return existing_resultado
@@ -934,10 +3921,19 @@ def delete_resultado_cuestionario(resultado_id: int, db: Session = Depends(get_d
     if not resultado:
         raise HTTPException(status_code=404, detail="Resultado no encontrado")
     db.delete(resultado)
+    db.flush()
+    _recalcular_resumen(db, resultado.id_usuarios, resultado.id_questionario)
     db.commit()
     return resultado
 
 # Rutas para Temarios
+def _invalidar_temario(temario_id, *ids_clases):
+    if temario_id is not None:
+        cache_catalogo.invalidar("temario", temario_id)
+    cache_catalogo.invalidar("temarios_clase", *ids_clases)
+    cache_catalogo.invalidar("contenido_clase", *ids_clases)
+
+
 @app.post("/temarios/", tags=["Temarios"])
 def create_temario(id_clases: int, nombre_temario: str, descrip_temario: str, contenido: str = None, titulo_video: str = None, foto_temario: str = None, videos_temario: str = None, db: Session = Depends(get_db)):
     nuevo_temario = Temario(
@@ -951,13 +3947,14 @@ def create_temario(id_clases: int, nombre_temario: str, descrip_temario: str, co
     )
     db.add(nuevo_temario)
     db.commit()
+    _invalidar_temario(None, id_clases)
     db.refresh(nuevo_temario)
     return nuevo_temario
 
 
 @app.get("/temarios/", tags=["Temarios"])
-def read_temarios(db: Session = Depends(get_db)):
-    temarios = db.query(Temario).all()
+def read_temarios(response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    temarios = _paginar(db.query(Temario), response, [Temario.id_temario], cursor, limit, total)
     if not temarios:
         raise HTTPException(
             status_code=404, 
@@ -971,6 +3968,7 @@ def update_temario(temario_id: int, id_clases: int, nombre_temario: str, descrip
     existing_temario = db.query(Temario).filter(Temario.id_temario == temario_id).first()
     if not existing_temario:
         raise HTTPException(status_code=404, detail="Temario no encontrado")
+    clase_anterior = existing_temario.id_clases
     existing_temario.id_clases = id_clases
     existing_temario.nombre_temario = nombre_temario
     existing_temario.descrip_temario = descrip_temario
@@ -979,6 +3977,7 @@ def update_temario(temario_id: int, id_clases: int, nombre_temario: str, descrip
     existing_temario.foto_temario = foto_temario
     existing_temario.videos_temario = videos_temario
     db.commit()
+    _invalidar_temario(temario_id, clase_anterior, id_clases)
     db.refresh(existing_temario)
     return existing_temario
 
@@ -990,12 +3989,16 @@ def delete_temario(temario_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Temario no encontrado")
     db.delete(temario)
     db.commit()
+    _invalidar_temario(temario_id, temario.id_clases)
     return temario
 
 
 @app.get("/temarios/{temario_id}", response_model=TemarioDetail, tags=["Temarios"])
 def get_temario(temario_id: int, db: Session = Depends(get_db)):
-    temario = db.query(Temario).filter(Temario.id_temario == temario_id).first()
+    def cargar():
+        temario = db.query(Temario).filter(Temario.id_temario == temario_id).first()
+        return temario and _como_dict(temario)
+    temario = _leer_cacheado("temario", temario_id, cargar)
     if not temario:
         raise HTTPException(status_code=404, detail="Temario no encontrado")
     return temario
@@ -1016,8 +4019,8 @@ def create_experimento(nombre_experimento: str, descrip_experimento: str, foto_e
 
 
 @app.get("/experimentos/", tags=["Experimentos"])
-def read_experimentos(db: Session = Depends(get_db)):
-    experimentos = db.query(Experimento).all()
+def read_experimentos(response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    experimentos = _paginar(db.query(Experimento), response, [Experimento.id_experimento], cursor, limit, total)
     if not experimentos:
         raise HTTPException(
             status_code=404, 
@@ -1035,6 +4038,7 @@ def update_experimento(experimento_id: int, nombre_experimento: str, descrip_exp
     existing_experimento.foto_experimento = foto_experimento
     existing_experimento.video_experimento = video_experimento
     db.commit()
+    cache_catalogo.invalidar("experimento", experimento_id)
     db.refresh(existing_experimento)
     return existing_experimento
 
@@ -1046,6 +4050,8 @@ def delete_experimento(experimento_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Experimento no encontrado")
     db.delete(experimento)
     db.commit()
+    cache_catalogo.invalidar("experimento", experimento_id)
+    _invalidar_analitica(experimento_id)
     return experimento
 
 # Rutas para Preguntas
@@ -1062,13 +4068,14 @@ def create_pregunta(id_questionario: int, enunciado: str, respuesta: str, correc
     )
     db.add(nueva_pregunta)
     db.commit()
+    cache_catalogo.invalidar("preguntas_cuestionario", id_questionario)
     db.refresh(nueva_pregunta)
     return nueva_pregunta
 
 
 @app.get("/preguntas/", tags=["Preguntas"])
-def read_preguntas(db: Session = Depends(get_db)):
-    preguntas = db.query(Pregunta).all()
+def read_preguntas(response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    preguntas = _paginar(db.query(Pregunta), response, [Pregunta.id_pregunta], cursor, limit, total)
     if not preguntas:
         raise HTTPException(
             status_code=404, 
@@ -1105,6 +4112,7 @@ def update_pregunta(
     existing_pregunta.respuesta2 = respuesta2
     existing_pregunta.respuesta3 = respuesta3
     db.commit()
+    cache_catalogo.invalidar("preguntas_cuestionario", id_questionario)
     db.refresh(existing_pregunta)
     return existing_pregunta
 
@@ -1114,8 +4122,10 @@ def delete_pregunta(pregunta_id: int, db: Session = Depends(get_db)):
     pregunta = db.query(Pregunta).filter(Pregunta.id_pregunta == pregunta_id).first()
     if not pregunta:
         raise HTTPException(status_code=404, detail="Pregunta no encontrada")
+    id_questionario = pregunta.id_questionario
     db.delete(pregunta)
     db.commit()
+    cache_catalogo.invalidar("preguntas_cuestionario", id_questionario)
     return pregunta
 
 # Rutas para Clases Usuarios
@@ -1131,8 +4141,8 @@ def create_clase_usuario(id_usuarios: int, id_clases: int, db: Session = Depends
 
 
 @app.get("/clases_usuarios/", tags=["Clases Usuarios"])
-def read_clases_usuarios(db: Session = Depends(get_db)):
-    clases_usuarios = db.query(ClaseUsuario).all()
+def read_clases_usuarios(response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    clases_usuarios = _paginar(db.query(ClaseUsuario), response, [ClaseUsuario.id_usuarios, ClaseUsuario.id_clases], cursor, limit, total)
     if not clases_usuarios:
         raise HTTPException(
             status_code=404, 
@@ -1161,6 +4171,139 @@ def delete_clase_usuario(id_usuarios: int, id_clases: int, db: Session = Depends
     db.commit()
     return {"message": "Clase Usuario eliminada con éxito"}
 
+def _leer_identificadores(valores):
+    """Separa una lista de valores de importación en IDs de usuario y emails."""
+    ids, emails, no_validos = set(), set(), []
+    for valor in valores:
+        if isinstance(valor, dict):
+            objeto = valor
+            valor = objeto.get("id_usuarios")
+            if valor is None:
+                valor = objeto.get("email")
+            if valor is None:
+                # Un objeto sin id_usuarios ni email se informa en lugar de descartarse
+                no_validos.append(json.dumps(objeto, ensure_ascii=False, default=str))
+                continue
+        if isinstance(valor, int) and not isinstance(valor, bool):
+            ids.add(valor)
+            continue
+        texto = str(valor).strip() if valor is not None else ""
+        if texto.isdigit():
+            ids.add(int(texto))
+        elif "@" in texto:
+            emails.add(texto.lower())
+        elif texto:
+            no_validos.append(texto)
+    return ids, emails, no_validos
+
+
+def _valores_csv(contenido):
+    # Una columna por fila; si hay varias se toma la llamada email o id_usuarios, o la primera
+    filas = [fila for fila in csv.reader(io.StringIO(contenido)) if any(celda.strip() for celda in fila)]
+    if not filas:
+        return []
+    cabecera = [celda.strip().lower() for celda in filas[0]]
+    columna = next((cabecera.index(nombre) for nombre in ("email", "id_usuarios") if nombre in cabecera), None)
+    if columna is not None:
+        filas = filas[1:]
+    return [fila[columna or 0] for fila in filas if len(fila) > (columna or 0)]
+
+
+def _matricular(id_clases, ids, emails, sincronizar):
+    db = SessionLocal()
+    try:
+        if db.get(Clase, id_clases) is None:
+            raise HTTPException(status_code=404, detail="Clase no encontrada")
+
+        encontrados = set()
+        no_encontrados = []
+        lote = IMPORTACION_FILAS_POR_INSERT
+        emails = sorted(emails)
+        for inicio in range(0, len(emails), lote):
+            bloque = emails[inicio:inicio + lote]
+            por_email = {email.lower(): id_usuarios for id_usuarios, email in db.execute(
+                select(Usuario.id_usuarios, Usuario.email).where(Usuario.email.in_(bloque))
+            )}
+            encontrados.update(por_email.values())
+            no_encontrados.extend(email for email in bloque if email not in por_email)
+        ids = sorted(ids)
+        for inicio in range(0, len(ids), lote):
+            bloque = ids[inicio:inicio + lote]
+            existentes = set(db.scalars(select(Usuario.id_usuarios).where(Usuario.id_usuarios.in_(bloque))))
+            encontrados.update(existentes)
+            no_encontrados.extend(str(id_usuarios) for id_usuarios in bloque if id_usuarios not in existentes)
+
+        if sincronizar and not encontrados:
+            # Evita vaciar la clase por un fichero vacío o con todos los usuarios mal escritos
+            raise HTTPException(status_code=400, detail="Ningún usuario de la importación existe: no se sincroniza")
+
+        matriculados = 0
+        filas = [{"id_usuarios": id_usuarios, "id_clases": id_clases} for id_usuarios in sorted(encontrados)]
+        for inicio in range(0, len(filas), lote):
+            # INSERT IGNORE: las matrículas que ya existen se saltan en lugar de fallar
+            matriculados += db.execute(
+                insert(ClaseUsuario.__table__)
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite")
+                .values(filas[inicio:inicio + lote])
+            ).rowcount
+
+        eliminados = 0
+        if sincronizar:
+            actuales = set(db.scalars(select(ClaseUsuario.id_usuarios).where(ClaseUsuario.id_clases == id_clases)))
+            sobrantes = sorted(actuales - encontrados)
+            for inicio in range(0, len(sobrantes), lote):
+                eliminados += db.execute(
+                    delete(ClaseUsuario).where(
+                        ClaseUsuario.id_clases == id_clases, ClaseUsuario.id_usuarios.in_(sobrantes[inicio:inicio + lote])
+                    )
+                ).rowcount
+        db.commit()
+        return {
+            "matriculados": matriculados,
+            "ya_matriculados": len(encontrados) - matriculados,
+            "eliminados": eliminados,
+            "no_encontrados": no_encontrados,
+        }
+    finally:
+        db.close()
+
+
+@app.post("/clases/{id_clases}/participantes/importar", tags=["Clases Usuarios"])
+async def importar_participantes(id_clases: int, request: Request, sincronizar: bool = False):
+    """Matricula en una clase una lista de usuarios por email o ID.
+
+    El cuerpo puede ser CSV (text/csv) o un array JSON de valores u objetos con email o
+    id_usuarios. Con sincronizar=true se eliminan además las matrículas que no aparecen.
+    """
+    # El tamaño se comprueba antes de leer el cuerpo y mientras se lee, por si no hay Content-Length
+    excedido = HTTPException(status_code=413, detail=f"La importación supera el máximo de {MATRICULAS_MAX_BYTES} bytes")
+    longitud = request.headers.get("content-length")
+    if longitud and longitud.isdigit() and int(longitud) > MATRICULAS_MAX_BYTES:
+        raise excedido
+    cuerpo = bytearray()
+    async for piece in request.stream():
+        cuerpo += piece
+        if len(cuerpo) > MATRICULAS_MAX_BYTES:
+            raise excedido
+    contenido = cuerpo.decode("utf-8-sig")
+    if "json" in request.headers.get("content-type", ""):
+        try:
+            valores = json.loads(contenido)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="JSON no válido")
+        if not isinstance(valores, list):
+            raise HTTPException(status_code=400, detail="Se esperaba un array JSON")
+    else:
+        valores = _valores_csv(contenido)
+    if len(valores) > MATRICULAS_MAX:
+        raise HTTPException(status_code=413, detail=f"La importación supera el máximo de {MATRICULAS_MAX} usuarios")
+
+    ids, emails, no_validos = _leer_identificadores(valores)
+    loop = asyncio.get_running_loop()
+    resultado = await loop.run_in_executor(None, _matricular, id_clases, ids, emails, sincronizar)
+    return {"recibidos": len(valores), **resultado, "no_validos": no_validos}
+
 # Rutas para Temarios Cuestionarios
 @app.post("/temarios_cuestionarios/", tags=["Temarios Cuestionarios"])
 def create_temario_cuestionario(id_clases: int, id_questionario: int, id_temario: int, db: Session = Depends(get_db)):
@@ -1170,13 +4313,16 @@ def create_temario_cuestionario(id_clases: int, id_questionario: int, id_temario
         id_temario=id_temario
     )
     db.add(nuevo_temario_cuestionario)
+    db.flush()
+    _recalcular_resumen_cuestionario(db, id_questionario)
     db.commit()
+    cache_catalogo.invalidar("cuestionarios_clase", id_clases)
     return {"message": "Cuestionario asignado al temario con éxito"}
 
 
 @app.get("/temarios_cuestionarios/", tags=["Temarios Cuestionarios"])
-def read_temarios_cuestionarios(db: Session = Depends(get_db)):
-    temarios_cuestionarios = db.query(TemarioCuestionario).all()
+def read_temarios_cuestionarios(response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    temarios_cuestionarios = _paginar(db.query(TemarioCuestionario), response, [TemarioCuestionario.id], cursor, limit, total)
     if not temarios_cuestionarios:
         raise HTTPException(
             status_code=404, 
@@ -1190,18 +4336,29 @@ def update_temario_cuestionario(id: int, id_clases: int, id_questionario: int, i
     existing_temario_cuestionario = db.query(TemarioCuestionario).filter(TemarioCuestionario.id == id).first()
     if not existing_temario_cuestionario:
         raise HTTPException(status_code=404, detail="Temario Cuestionario no encontrado")
+    cuestionario_anterior = existing_temario_cuestionario.id_questionario
+    clase_anterior = existing_temario_cuestionario.id_clases
     existing_temario_cuestionario.id_clases = id_clases
     existing_temario_cuestionario.id_questionario = id_questionario
     existing_temario_cuestionario.id_temario = id_temario
+    db.flush()
+    for cuestionario in {cuestionario_anterior, id_questionario}:
+        _recalcular_resumen_cuestionario(db, cuestionario)
     db.commit()
+    cache_catalogo.invalidar("cuestionarios_clase", clase_anterior, id_clases)
     db.refresh(existing_temario_cuestionario)
     return {"message": "Temario Cuestionario actualizado con éxito"}
 
 @app.get("/preguntas/questionario/{id_questionario}", tags=["Preguntas"])
-def get_preguntas_by_questionario(id_questionario: int, db: Session = Depends(get_db)):
-    preguntas = db.query(Pregunta).filter(Pregunta.id_questionario == id_questionario).all()
+def get_preguntas_by_questionario(id_questionario: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    preguntas, etag = _leer_cacheado_con_etag("preguntas_cuestionario", id_questionario, lambda: [
+        _como_dict(pregunta) for pregunta in db.query(Pregunta).filter(Pregunta.id_questionario == id_questionario)
+    ])
     if not preguntas:
         raise HTTPException(status_code=404, detail="No se encontraron preguntas para el cuestionario especificado")
+    no_modificado = _condicional(request, response, "preguntas_cuestionario", etag)
+    if no_modificado:
+        return no_modificado
     return preguntas
 
 
@@ -1211,7 +4368,10 @@ def delete_temario_cuestionario(id: int, db: Session = Depends(get_db)):
     if not temario_cuestionario:
         raise HTTPException(status_code=404, detail="Temario Cuestionario no encontrado")
     db.delete(temario_cuestionario)
+    db.flush()
+    _recalcular_resumen_cuestionario(db, temario_cuestionario.id_questionario)
     db.commit()
+    cache_catalogo.invalidar("cuestionarios_clase", temario_cuestionario.id_clases)
     return {"message": "Temario Cuestionario eliminado con éxito"}
 
 # Rutas para Videos Experimentos
@@ -1230,8 +4390,8 @@ def create_video_experimento(id_experimento: int, nombre_experimento: str, descr
 
 
 @app.get("/videos_experimentos/", tags=["Videos Experimentos"])
-def read_videos_experimentos(db: Session = Depends(get_db)):
-    videos_experimentos = db.query(VideoExperimento).all()
+def read_videos_experimentos(response: Response, limit: Optional[int] = Query(None, ge=1, le=PAGINACION_LIMITE_MAX), cursor: Optional[str] = None, total: bool = False, db: Session = Depends(get_db)):
+    videos_experimentos = _paginar(db.query(VideoExperimento), response, [VideoExperimento.id_video_experimento], cursor, limit, total)
     if not videos_experimentos:
         raise HTTPException(
             status_code=404, 
@@ -1263,6 +4423,464 @@ def delete_video_experimento(video_id: int, db: Session = Depends(get_db)):
     db.commit()
     return {"message": "Video Experimento eliminado con éxito"}
 
+# Columnas de medidas de DATOS_EXPERIMENTOS, en el orden en que se devuelven por columnas
+COLUMNAS_MEDIDAS = [
+    "masa1", "masa2", "masa3", "masa4",
+    "velocidad1", "velocidad2", "velocidad3", "velocidad4", "velocidad5",
+    "altura1", "altura2", "altura3", "altura4",
+    "tiempo1", "tiempo2", "tiempo3", "tiempo4",
+]
+
+FORMATOS_COLUMNAS = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _medidas_experimento(db, id_experimento):
+    """Devuelve los id_datos y una matriz float64 (filas x COLUMNAS_MEDIDAS) con NaN en los nulos."""
+    columnas = [getattr(DatoExperimento, nombre) for nombre in COLUMNAS_MEDIDAS]
+    filas = db.execute(
+        select(DatoExperimento.id_datos, *columnas)
+        .where(DatoExperimento.id_experimento == id_experimento)
+        .order_by(DatoExperimento.id_datos)
+    ).all()
+    # Todas las celdas pasan a una matriz de objetos en una sola llamada, sin código Python por
+    # fila; los nulos se cambian por NaN y las medidas se convierten a float64 de una vez
+    celdas = np.fromiter(
+        itertools.chain.from_iterable(filas), dtype=object, count=len(filas) * (len(columnas) + 1)
+    ).reshape(len(filas), len(columnas) + 1)
+    valores = celdas[:, 1:]
+    medidas = np.where(np.equal(valores, None), np.nan, valores).astype(np.float64)
+    return celdas[:, 0].tolist(), medidas
+
+
+def _tabla_arrow(ids, medidas):
+    nulos = np.isnan(medidas)
+    return pa.table({
+        "id_datos": pa.array(ids, type=pa.string()),
+        **{nombre: pa.array(medidas[:, i], mask=nulos[:, i]) for i, nombre in enumerate(COLUMNAS_MEDIDAS)},
+    })
+
+
+@app.get("/datos_experimentos/experimento/{id_experimento}/columnas", tags=["Datos Experimentos"])
+def get_datos_por_experimento_columnas(id_experimento: int, formato: str = "json", db: Session = Depends(get_db)):
+    """Datos de un experimento por columnas: un array por medida en lugar de un objeto por fila.
+
+    formato=json devuelve {"id_datos": [...], "columnas": {"masa1": [...], ...}}; arrow y
+    parquet devuelven la misma tabla en formato Arrow IPC (stream) o Parquet.
+    """
+    if formato not in FORMATOS_COLUMNAS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {formato}")
+    if np is None:
+        raise HTTPException(status_code=501, detail="NumPy no está instalado en el servidor")
+    if formato != "json" and pa is None:
+        raise HTTPException(status_code=501, detail="pyarrow no está instalado en el servidor")
+
+    ids, medidas = _medidas_experimento(db, id_experimento)
+    if not ids:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se encontraron datos para el experimento con id {id_experimento}"
+        )
+
+    contenido = _fuera_del_bucle(_codificar_columnas, id_experimento, ids, medidas, formato)
+    return Response(content=contenido, media_type=FORMATOS_COLUMNAS[formato])
+
+
+def _codificar_columnas(id_experimento, ids, medidas, formato):
+    if formato == "json":
+        # JSON no admite NaN: json.dumps los escribe como NaN y se sustituyen por null en el
+        # texto de las columnas, que solo contiene nombres de medida y números. Así no hay
+        # que pasar la matriz a objetos y poner None celda a celda
+        columnas = json.dumps(dict(zip(COLUMNAS_MEDIDAS, medidas.T.tolist()))).replace("NaN", "null")
+        cabecera = json.dumps({"id_experimento": id_experimento, "filas": len(ids), "id_datos": ids})
+        return f'{cabecera[:-1]}, "columnas": {columnas}}}'
+
+    tabla = _tabla_arrow(ids, medidas)
+    buffer = pa.BufferOutputStream()
+    if formato == "arrow":
+        with pa.ipc.new_stream(buffer, tabla.schema) as escritor:
+            escritor.write_table(tabla)
+    else:
+        pa.parquet.write_table(tabla, buffer)
+    return buffer.getvalue().to_pybytes()
+
+
+# Analítica de experimentos: magnitudes derivadas y estadísticas calculadas con NumPy sobre
+# todos los ensayos a la vez. El resultado se guarda en la caché hasta que cambian sus datos.
+GRAVEDAD = float(os.getenv("GRAVEDAD", "9.81"))
+
+def _invalidar_analitica(*ids_experimento):
+    cache_catalogo.invalidar("analitica", *ids_experimento)
+
+
+def _medida(medidas, prefijo, cantidad):
+    return medidas[:, [COLUMNAS_MEDIDAS.index(f"{prefijo}{i}") for i in range(1, cantidad + 1)]]
+
+
+def _lista_json(valores):
+    # JSON no admite NaN: se devuelven como null
+    objetos = np.asarray(valores, dtype=np.float64).astype(object)
+    objetos[np.isnan(np.asarray(valores, dtype=np.float64))] = None
+    return objetos.tolist()
+
+
+def _estadisticas(valores, eje=0):
+    """Media, desviación típica muestral, mínimo, máximo y número de valores ignorando NaN."""
+    validos = ~np.isnan(valores)
+    n = validos.sum(axis=eje)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        media = np.where(validos, valores, 0).sum(axis=eje) / n
+        desviaciones = np.where(validos, valores - np.expand_dims(media, eje), 0)
+        desviacion = np.sqrt((desviaciones ** 2).sum(axis=eje) / (n - 1))
+    desviacion = np.where(n > 1, desviacion, np.nan)
+    minimo = np.where(n > 0, np.where(validos, valores, np.inf).min(axis=eje), np.nan)
+    maximo = np.where(n > 0, np.where(validos, valores, -np.inf).max(axis=eje), np.nan)
+    return {
+        "media": _lista_json(media),
+        "desviacion": _lista_json(desviacion),
+        "minimo": _lista_json(minimo),
+        "maximo": _lista_json(maximo),
+        "n": n.tolist(),
+    }
+
+
+def _regresion(x, y):
+    """Recta de mínimos cuadrados y = pendiente * x + ordenada sobre los pares sin NaN."""
+    validos = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[validos], y[validos]
+    if len(x) < 2 or np.ptp(x) == 0:
+        return {"pendiente": None, "ordenada": None, "r2": None, "n": int(len(x))}
+    dx, dy = x - x.mean(), y - y.mean()
+    pendiente = (dx * dy).sum() / (dx ** 2).sum()
+    ordenada = y.mean() - pendiente * x.mean()
+    residuos = ((y - (pendiente * x + ordenada)) ** 2).sum()
+    total = (dy ** 2).sum()
+    return {
+        "pendiente": float(pendiente),
+        "ordenada": float(ordenada),
+        "r2": float(1 - residuos / total) if total > 0 else None,
+        "n": int(len(x)),
+    }
+
+
+def _analitica_experimento(ids, medidas):
+    masas = _medida(medidas, "masa", 4)
+    velocidades = _medida(medidas, "velocidad", 5)
+    alturas = _medida(medidas, "altura", 4)
+    tiempos = _medida(medidas, "tiempo", 4)
+
+    # Cada masa i se empareja con la velocidad i y la altura i del mismo ensayo
+    energia_cinetica = 0.5 * masas * velocidades[:, :4] ** 2
+    energia_potencial = masas * GRAVEDAD * alturas
+    energia_mecanica = energia_cinetica + energia_potencial
+    momento = masas * velocidades[:, :4]
+    derivadas = {
+        "energia_cinetica": energia_cinetica,
+        "energia_potencial": energia_potencial,
+        "energia_mecanica": energia_mecanica,
+        "momento": momento,
+    }
+    por_ensayo_velocidad = _estadisticas(velocidades, eje=1)
+    por_columna = _estadisticas(medidas)
+
+    return {
+        "ensayos": len(ids),
+        "gravedad": GRAVEDAD,
+        "por_ensayo": {
+            "id_datos": ids,
+            **{nombre: [_lista_json(fila) for fila in valores] for nombre, valores in derivadas.items()},
+            "velocidad_media": por_ensayo_velocidad["media"],
+            "velocidad_desviacion": por_ensayo_velocidad["desviacion"],
+        },
+        "columnas": {
+            nombre: {clave: valores[i] for clave, valores in por_columna.items()}
+            for i, nombre in enumerate(COLUMNAS_MEDIDAS)
+        },
+        "derivadas": {nombre: _estadisticas(valores) for nombre, valores in derivadas.items()},
+        "regresion_altura_tiempo": _regresion(tiempos.ravel(), alturas.ravel()),
+    }
+
+
+@app.get("/experimentos/{id_experimento}/analitica", tags=["Datos Experimentos"])
+def get_analitica_experimento(id_experimento: int, db: Session = Depends(get_db)):
+    """Energías cinética, potencial y mecánica, momento lineal, estadísticas por medida y
+    regresión lineal de altura frente a tiempo de todos los ensayos de un experimento."""
+    if np is None:
+        raise HTTPException(status_code=501, detail="NumPy no está instalado en el servidor")
+
+    def cargar():
+        ids, medidas = _medidas_experimento(db, id_experimento)
+        if not ids:
+            raise HTTPException(
+                status_code=404,
+                detail=f"No se encontraron datos para el experimento con id {id_experimento}"
+            )
+        return {"id_experimento": id_experimento, **_fuera_del_bucle(_analitica_experimento, ids, medidas)}
+
+    return _leer_cacheado("analitica", id_experimento, cargar)
+
+
+# Formato de las series: "MLS1", código de tipo, 3 bytes de relleno y número de muestras.
+# La cabecera ocupa 16 bytes para que las muestras queden alineadas a 8 bytes.
+CABECERA_SERIE = struct.Struct("<4sB3xQ")
+MAGIA_SERIE = b"MLS1"
+TIPOS_SERIE = {"float32": (1, "f"), "float64": (2, "d")}
+TIPOS_SERIE_POR_CODIGO = {codigo: (dtype, typecode) for dtype, (codigo, typecode) in TIPOS_SERIE.items()}
+TIPOS_SERIE_POR_TYPECODE = {typecode: (dtype, codigo) for dtype, (codigo, typecode) in TIPOS_SERIE.items()}
+RE_MAGNITUD = re.compile(r"[a-z][a-z0-9_]{0,49}")
+
+# Magnitudes que se proyectan sobre las columnas anchas de DATOS_EXPERIMENTOS y cuántas muestras caben
+PROYECCION_DATOS = {"masa": 4, "velocidad": 5, "altura": 4, "tiempo": 4}
+
+
+def _empaquetar_serie(valores):
+    """Empaqueta un array.array de floats con su cabecera."""
+    codigo = TIPOS_SERIE_POR_TYPECODE[valores.typecode][1]
+    if sys.byteorder != "little":
+        valores = array.array(valores.typecode, valores)
+        valores.byteswap()
+    return CABECERA_SERIE.pack(MAGIA_SERIE, codigo, len(valores)) + valores.tobytes()
+
+
+def _desempaquetar_serie(datos):
+    magia, codigo, longitud = CABECERA_SERIE.unpack_from(datos)
+    if magia != MAGIA_SERIE or codigo not in TIPOS_SERIE_POR_CODIGO:
+        raise ValueError("Serie con formato no válido")
+    valores = array.array(TIPOS_SERIE_POR_CODIGO[codigo][1])
+    valores.frombytes(datos[CABECERA_SERIE.size:CABECERA_SERIE.size + longitud * valores.itemsize])
+    if sys.byteorder != "little":
+        valores.byteswap()
+    return valores
+
+
+def _fila_serie(id_experimento, id_datos, magnitud, valores):
+    return {
+        "id_experimento": id_experimento,
+        "id_datos": id_datos,
+        "magnitud": magnitud,
+        "dtype": TIPOS_SERIE_POR_TYPECODE[valores.typecode][0],
+        "longitud": len(valores),
+        "datos": _empaquetar_serie(valores),
+    }
+
+
+def _recortar_nan(valores):
+    while valores and math.isnan(valores[-1]):
+        valores.pop()
+    return valores
+
+
+def _series_desde_fila(fila):
+    """Series de una fila ancha de DATOS_EXPERIMENTOS; los nulos intermedios quedan como NaN."""
+    series = []
+    for magnitud, cantidad in PROYECCION_DATOS.items():
+        valores = [getattr(fila, f"{magnitud}{i}") for i in range(1, cantidad + 1)]
+        valores = _recortar_nan(array.array("d", (math.nan if valor is None else valor for valor in valores)))
+        if valores:
+            series.append(_fila_serie(fila.id_experimento, fila.id_datos, magnitud, valores))
+    return series
+
+
+def _guardar_series(db, series):
+    if not series:
+        return
+    insercion = mysql_insert(SerieExperimento.__table__).values(series)
+    db.execute(insercion.on_duplicate_key_update(
+        id_experimento=insercion.inserted.id_experimento,
+        dtype=insercion.inserted.dtype,
+        longitud=insercion.inserted.longitud,
+        datos=insercion.inserted.datos,
+    ))
+
+
+def _proyectar_a_series(db, dato):
+    """Escribe en las series los valores de una fila ancha sin perder las muestras que no caben en ella."""
+    existentes = {
+        serie.magnitud: _desempaquetar_serie(serie.datos)
+        for serie in db.query(SerieExperimento).filter(
+            SerieExperimento.id_datos == dato.id_datos, SerieExperimento.magnitud.in_(PROYECCION_DATOS)
+        )
+    }
+    series = []
+    vacias = []
+    for magnitud, cantidad in PROYECCION_DATOS.items():
+        valores = existentes.get(magnitud, array.array(TIPOS_SERIE[SERIES_DTYPE][1]))
+        if len(valores) < cantidad:
+            valores.extend([math.nan] * (cantidad - len(valores)))
+        for i in range(cantidad):
+            valor = getattr(dato, f"{magnitud}{i + 1}")
+            valores[i] = math.nan if valor is None else valor
+        if _recortar_nan(valores):
+            series.append(_fila_serie(dato.id_experimento, dato.id_datos, magnitud, valores))
+        elif magnitud in existentes:
+            vacias.append(magnitud)
+    if vacias:
+        db.execute(delete(SerieExperimento).where(SerieExperimento.id_datos == dato.id_datos, SerieExperimento.magnitud.in_(vacias)))
+    # Un cambio de experimento en la fila ancha mueve también las demás series del ensayo
+    db.execute(update(SerieExperimento).where(SerieExperimento.id_datos == dato.id_datos).values(id_experimento=dato.id_experimento))
+    _guardar_series(db, series)
+
+
+def _proyeccion_desde_series(series):
+    """Columnas anchas de DATOS_EXPERIMENTOS a partir de las primeras muestras de cada serie."""
+    columnas = {}
+    for magnitud, cantidad in PROYECCION_DATOS.items():
+        if magnitud not in series:
+            continue
+        valores = series[magnitud]
+        for i in range(cantidad):
+            valor = valores[i] if i < len(valores) else math.nan
+            columnas[f"{magnitud}{i + 1}"] = None if math.isnan(valor) else valor
+    return columnas
+
+
+def _leer_series_csv(fichero, dtype):
+    """Lee un CSV de sensor (cabecera con una magnitud por columna y una fila por muestra)."""
+    typecode = TIPOS_SERIE[dtype][1]
+    lector = csv.reader(io.TextIOWrapper(fichero, encoding="utf-8-sig", newline=""))
+    cabecera = next((fila for fila in lector if any(celda.strip() for celda in fila)), None)
+    if cabecera is None:
+        raise HTTPException(status_code=400, detail="El CSV está vacío")
+    magnitudes = [celda.strip().lower() for celda in cabecera]
+    no_validas = [magnitud for magnitud in magnitudes if not RE_MAGNITUD.fullmatch(magnitud)]
+    if no_validas or len(set(magnitudes)) != len(magnitudes):
+        raise HTTPException(status_code=400, detail=f"Cabecera no válida: {', '.join(no_validas) or 'columnas repetidas'}")
+    columnas = [array.array(typecode) for _ in magnitudes]
+    for fila in lector:
+        if not any(celda.strip() for celda in fila):
+            continue
+        if len(fila) != len(magnitudes):
+            raise HTTPException(status_code=400, detail=f"La línea {lector.line_num} tiene {len(fila)} columnas y se esperaban {len(magnitudes)}")
+        if len(columnas[0]) >= SERIES_MAX_MUESTRAS:
+            raise HTTPException(status_code=413, detail=f"Las series superan el máximo de {SERIES_MAX_MUESTRAS} muestras")
+        try:
+            for columna, celda in zip(columnas, fila):
+                columna.append(float(celda) if celda.strip() else math.nan)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Valor no numérico en la línea {lector.line_num}")
+    return dict(zip(magnitudes, columnas))
+
+
+def _ingerir_series(id_experimento, id_datos, dtype, fichero):
+    series = _leer_series_csv(fichero, dtype)
+    db = SessionLocal()
+    try:
+        if db.get(Experimento, id_experimento) is None:
+            raise HTTPException(status_code=404, detail="Experimento no encontrado")
+        dato = db.get(DatoExperimento, id_datos)
+        if dato is not None and dato.id_experimento != id_experimento:
+            raise HTTPException(status_code=409, detail=f"El ensayo {id_datos} pertenece al experimento {dato.id_experimento}")
+
+        # La fila ancha se mantiene como proyección de las series para las rutas /datos_experimentos/
+        proyeccion = _proyeccion_desde_series(series)
+        insercion = mysql_insert(DatoExperimento.__table__).values(id_datos=id_datos, id_experimento=id_experimento, **proyeccion)
+        db.execute(insercion.on_duplicate_key_update(**proyeccion) if proyeccion else insercion.prefix_with("IGNORE"))
+        _guardar_series(db, [_fila_serie(id_experimento, id_datos, magnitud, valores) for magnitud, valores in series.items()])
+        db.commit()
+    finally:
+        db.close()
+    _invalidar_analitica(id_experimento)
+    return {
+        "id_experimento": id_experimento,
+        "id_datos": id_datos,
+        "dtype": dtype,
+        "series": {magnitud: len(valores) for magnitud, valores in series.items()},
+    }
+
+
+@app.post("/experimentos/{id_experimento}/series/importar", tags=["Series Experimentos"])
+async def importar_series_csv(id_experimento: int, request: Request, id_datos: Optional[str] = None, dtype: str = SERIES_DTYPE):
+    """Guarda un ensayo a partir del CSV de un sensor: una columna por magnitud y una fila por muestra.
+
+    El cuerpo se recibe por bloques en un fichero temporal y se procesa fuera del event loop.
+    Si no se indica id_datos se genera uno nuevo.
+    """
+    if dtype not in TIPOS_SERIE:
+        raise HTTPException(status_code=400, detail=f"dtype no soportado: {dtype}")
+    id_datos = id_datos or str(uuid.uuid4())
+    if len(id_datos) > 50:
+        raise HTTPException(status_code=400, detail="id_datos no puede superar los 50 caracteres")
+    # El tamaño se comprueba antes de leer el cuerpo y mientras se lee, por si no hay Content-Length
+    excedido = HTTPException(status_code=413, detail=f"El CSV supera el máximo de {SERIES_MAX_BYTES} bytes")
+    longitud = request.headers.get("content-length")
+    if longitud and longitud.isdigit() and int(longitud) > SERIES_MAX_BYTES:
+        raise excedido
+    loop = asyncio.get_running_loop()
+    recibido = 0
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE) as fichero:
+        async for piece in request.stream():
+            recibido += len(piece)
+            if recibido > SERIES_MAX_BYTES:
+                raise excedido
+            # Al pasar de UPLOAD_CHUNK_SIZE el fichero se escribe en disco: fuera del event loop
+            await loop.run_in_executor(None, fichero.write, piece)
+        fichero.seek(0)
+        return await loop.run_in_executor(None, _ingerir_series, id_experimento, id_datos, dtype, fichero)
+
+
+@app.get("/experimentos/{id_experimento}/series", tags=["Series Experimentos"])
+def get_series_experimento(id_experimento: int, db: Session = Depends(get_db)):
+    series = db.execute(
+        select(SerieExperimento.id_datos, SerieExperimento.magnitud, SerieExperimento.dtype, SerieExperimento.longitud)
+        .where(SerieExperimento.id_experimento == id_experimento)
+        .order_by(SerieExperimento.id_datos, SerieExperimento.magnitud)
+    ).mappings().all()
+    if not series:
+        raise HTTPException(status_code=404, detail=f"No se encontraron series para el experimento con id {id_experimento}")
+    return series
+
+
+@app.get("/experimentos/{id_experimento}/series/paquete", tags=["Series Experimentos"])
+def get_paquete_series(id_experimento: int, magnitud: Optional[str] = None, db: Session = Depends(get_db)):
+    """Todas las series de un experimento en un único cuerpo binario, sin convertir las muestras.
+
+    Cada serie va precedida de la longitud (uint16) y el texto UTF-8 de su id_datos y de su
+    magnitud; a continuación va la serie empaquetada tal cual está guardada.
+    """
+    condiciones = [SerieExperimento.id_experimento == id_experimento]
+    if magnitud is not None:
+        condiciones.append(SerieExperimento.magnitud == magnitud)
+    # Se comprueba antes de empezar a enviar el cuerpo, cuando aún se puede responder 404
+    if not db.scalar(select(exists().where(*condiciones))):
+        raise HTTPException(status_code=404, detail=f"No se encontraron series para el experimento con id {id_experimento}")
+    consulta = (
+        select(SerieExperimento.id_datos, SerieExperimento.magnitud, SerieExperimento.datos)
+        .where(*condiciones)
+        .order_by(SerieExperimento.id_datos, SerieExperimento.magnitud)
+    )
+
+    def generar():
+        db = SessionLocal()
+        try:
+            filas = db.execute(consulta.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE))
+            for id_datos, nombre, datos in filas:
+                id_bytes, nombre_bytes = id_datos.encode(), nombre.encode()
+                yield struct.pack("<H", len(id_bytes)) + id_bytes + struct.pack("<H", len(nombre_bytes)) + nombre_bytes + datos
+        finally:
+            db.close()
+
+    return StreamingResponse(generar(), media_type="application/octet-stream")
+
+
+@app.get("/experimentos/{id_experimento}/series/{id_datos}/{magnitud}", tags=["Series Experimentos"])
+def get_serie(id_experimento: int, id_datos: str, magnitud: str, db: Session = Depends(get_db)):
+    serie = db.query(SerieExperimento).filter(
+        SerieExperimento.id_experimento == id_experimento,
+        SerieExperimento.id_datos == id_datos,
+        SerieExperimento.magnitud == magnitud,
+    ).first()
+    if serie is None:
+        raise HTTPException(status_code=404, detail="Serie no encontrada")
+    return Response(
+        content=serie.datos,
+        media_type="application/octet-stream",
+        headers={"X-Serie-Dtype": serie.dtype, "X-Serie-Longitud": str(serie.longitud)},
+    )
+
+
 @app.get("/datos_experimentos/experimento/{id_experimento}", tags=["Datos Experimentos"])
 def get_datos_por_experimento(id_experimento: int, db: Session = Depends(get_db)):
     try:
@@ -1334,7 +4952,10 @@ def create_datos_experimento(id_datos: str, id_experimento: int, masa1: float =
         tiempo4=tiempo4
     )
     db.add(nuevo_dato_experimento)
+    db.flush()
+    _proyectar_a_series(db, nuevo_dato_experimento)
     db.commit()
+    _invalidar_analitica(id_experimento)
     db.refresh(nuevo_dato_experimento)
     return nuevo_dato_experimento
 
@@ -1376,6 +4997,7 @@ def update_datos_experimento(id_datos: str, id_experimento: int, masa1: float =
     existing_dato_experimento = db.query(DatoExperimento).filter(DatoExperimento.id_datos == id_datos).first()
     if not existing_dato_experimento:
         raise HTTPException(status_code=404, detail="Dato Experimento no encontrado")
+    experimento_anterior = existing_dato_experimento.id_experimento
     existing_dato_experimento.id_experimento = id_experimento
     existing_dato_experimento.masa1 = masa1
     existing_dato_experimento.masa2 = masa2
@@ -1394,7 +5016,10 @@ def update_datos_experimento(id_datos: str, id_experimento: int, masa1: float =
     existing_dato_experimento.tiempo2 = tiempo2
     existing_dato_experimento.tiempo3 = tiempo3
     existing_dato_experimento.tiempo4 = tiempo4
+    db.flush()
+    _proyectar_a_series(db, existing_dato_experimento)
     db.commit()
+    _invalidar_analitica(experimento_anterior, id_experimento)
     db.refresh(existing_dato_experimento)
     return existing_dato_experimento
 
@@ -1404,8 +5029,11 @@ def delete_datos_experimento(id_datos: str, db: Session = Depends(get_db)):
     dato_experimento = db.query(DatoExperimento).filter(DatoExperimento.id_datos == id_datos).first()
     if not dato_experimento:
         raise HTTPException(status_code=404, detail="Dato Experimento no encontrado")
+    id_experimento = dato_experimento.id_experimento
+    db.execute(delete(SerieExperimento).where(SerieExperimento.id_datos == id_datos))
     db.delete(dato_experimento)
     db.commit()
+    _invalidar_analitica(id_experimento)
     return {"message": "Dato Experimento eliminado con éxito"}
 
 
@@ -1413,6 +5041,7 @@ def delete_datos_experimento(id_datos: str, db: Session = Depends(get_db)):
 def get_participantes_de_clase(clase_id: int, db: Session = Depends(get_db)):
     participantes = (
         db.query(Usuario)
+        .options(joinedload(Usuario.rol))
         .join(ClaseUsuario, ClaseUsuario.id_usuarios == Usuario.id_usuarios)
         .filter(ClaseUsuario.id_clases == clase_id)
         .all()
@@ -1429,3 +5058,29 @@ def health_check(db: Session = Depends(get_db)):
         return {"status": "ok"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
+
+
+# Comandos de mantenimiento: python main.py migrar | verificar-indices | reconstruir-resumen
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento de la base de datos de MonLab")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    comandos.add_parser("migrar", help="Aplica las migraciones pendientes")
+    comandos.add_parser("verificar-indices", help="Falla si alguna consulta crítica recorre una tabla entera")
+    comandos.add_parser("reconstruir-resumen", help="Recalcula desde cero el resumen de notas")
+    args = parser.parse_args()
+
+    if args.comando == "migrar":
+        aplicadas = aplicar_migraciones()
+        print(f"Migraciones aplicadas: {aplicadas}" if aplicadas else "El esquema ya está al día")
+    elif args.comando == "verificar-indices":
+        fallos = verificar_planes()
+        for fallo in fallos:
+            print(f"Recorrido completo en {fallo['consulta']}: tabla {fallo['tabla']}, {fallo['filas']} filas estimadas, índices posibles: {fallo['possible_keys']}")
+        if fallos:
+            sys.exit(1)
+        print("Todas las consultas críticas usan índices")
+    elif args.comando == "reconstruir-resumen":
+        with engine.begin() as conn:
+            reconstruir_resumen(conn)
+        _invalidar_resumen()
+        print("Resumen de notas reconstruido")
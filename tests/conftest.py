@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# main lee la configuración al importarse; las pruebas no se conectan a MySQL
+os.environ.setdefault("DB_PORT", "3306")
+os.environ.setdefault("DB_AUTO_MIGRATE", "false")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def motor():
+    motor = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    main.Base.metadata.create_all(motor)
+    yield motor
+    motor.dispose()
+
+
+@pytest.fixture
+def sesiones(motor):
+    return sessionmaker(bind=motor, autoflush=False)
+
+
+@pytest.fixture
+def cliente(sesiones):
+    def get_db():
+        db = sesiones()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[main.get_db] = get_db
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
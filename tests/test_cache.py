@@ -0,0 +1,114 @@
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import main
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # Los scripts Lua de CacheRedis necesitan fakeredis[lua]
+
+
+@pytest.fixture
+def servidor_redis():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def nueva_cache(monkeypatch, servidor_redis):
+    # Cada llamada crea una caché como la de un worker distinto; las de Redis comparten servidor
+    def crear(backend):
+        if backend == "local":
+            return main.CacheLRU(100, 60)
+        monkeypatch.setattr(main.redis.Redis, "from_url", lambda url: fakeredis.FakeRedis(server=servidor_redis))
+        return main.CacheRedis("redis://prueba", "monlab-test", 60)
+    return crear
+
+
+@pytest.fixture(params=["local", "redis"])
+def cache(request, nueva_cache):
+    return nueva_cache(request.param)
+
+
+def test_guarda_y_lee_valores(cache):
+    valor = {"id_clases": 1, "fecha": datetime(2024, 5, 1, 12, 30), "media": Decimal("7.50"), "notas": [1.5, None]}
+    cache.guardar("clase", 1, valor, cache.generacion("clase"))
+    assert cache.obtener("clase", 1) == valor
+    assert cache.obtener("clase", 2) is main._SIN_VALOR
+
+
+def test_invalidar_otro_espacio_no_descarta_cargas_en_curso(cache):
+    generacion = cache.generacion("clase")
+    cache.invalidar("resumen_clase", 1)
+    cache.invalidar_espacio("roles")
+    cache.guardar("clase", 1, {"id_clases": 1}, generacion)
+    assert cache.obtener("clase", 1) == {"id_clases": 1}
+
+
+def test_invalidar_el_espacio_descarta_cargas_anteriores(cache):
+    generacion = cache.generacion("clase")
+    cache.invalidar("clase", 2)
+    cache.guardar("clase", 1, {"id_clases": 1}, generacion)
+    assert cache.obtener("clase", 1) is main._SIN_VALOR
+
+
+def test_invalidar_espacio_borra_sus_claves(cache):
+    cache.guardar("roles", (None, None, False), ([{"id_roles": 1}], {}), cache.generacion("roles"))
+    cache.invalidar_espacio("roles")
+    assert cache.obtener("roles", (None, None, False)) is main._SIN_VALOR
+
+
+def test_redis_comparte_invalidaciones_entre_workers(nueva_cache):
+    worker_a, worker_b = nueva_cache("redis"), nueva_cache("redis")
+    generacion = worker_b.generacion("clase")
+    worker_a.invalidar("clase", 1)
+    worker_b.guardar("clase", 1, {"id_clases": 1}, generacion)
+    assert worker_a.obtener("clase", 1) is main._SIN_VALOR
+    worker_b.guardar("clase", 1, {"id_clases": 1}, worker_b.generacion("clase"))
+    assert worker_a.obtener("clase", 1) == {"id_clases": 1}
+
+
+def test_redis_guarda_json_y_no_pickle(nueva_cache, servidor_redis):
+    cache = nueva_cache("redis")
+    cache.guardar("clase", 1, {"id_clases": 1}, cache.generacion("clase"))
+    cliente = fakeredis.FakeRedis(server=servidor_redis)
+    [clave] = [clave for clave in cliente.keys("monlab-test:clase:*")]
+    assert cliente.get(clave) == b'{"id_clases":1}'
+
+
+@pytest.fixture
+def notas(sesiones):
+    db = sesiones()
+    db.add(main.Rol(id_roles=1, rol="alumno"))
+    db.add(main.Usuario(id_usuarios=1, id_roles=1, usuario="ana", email="ana@monlab.test", contrasena="x", estado="activa"))
+    db.add(main.Clase(id_clases=1, nombre_clases="Clase", descripcion_clases=""))
+    db.add(main.Temario(id_temario=1, id_clases=1, nombre_temario="T1", descrip_temario=""))
+    db.add(main.Cuestionario(id_questionario=1, nombre_cuestionario="Cinemática", descrip_cuestionario=""))
+    db.add(main.TemarioCuestionario(id=1, id_clases=1, id_questionario=1, id_temario=1))
+    db.add(main.ResultadoCuestionario(id_questionario=1, id_usuarios=1, nota=8, fecha_completado=datetime(2024, 1, 1),
+                                      total_correctas=8, total_falladas=2))
+    db.commit()
+    main.reconstruir_resumen(db)
+    db.commit()
+    db.close()
+
+
+def test_renombrar_invalida_el_resumen_de_notas(cache, notas, cliente, monkeypatch):
+    monkeypatch.setattr(main, "cache_catalogo", cache)
+
+    def nombres():
+        [fila] = cliente.get("/notas/resumen/clase/1").json()
+        [por_usuario] = cliente.get("/notas/resumen/clase/1/usuarios").json()
+        return fila["nombre_usuario"], fila["nombre_cuestionario"], por_usuario["nombre_usuario"]
+
+    assert nombres() == ("ana", "Cinemática", "ana")
+
+    respuesta = cliente.put("/usuarios/1", params={
+        "id_roles": 1, "usuario": "ana.garcia", "email": "ana@monlab.test", "contrasena": "x", "estado": "activa",
+    })
+    assert respuesta.status_code == 200
+    assert nombres() == ("ana.garcia", "Cinemática", "ana.garcia")
+
+    respuesta = cliente.put("/cuestionarios/1", params={"nombre_cuestionario": "Dinámica", "descrip_cuestionario": ""})
+    assert respuesta.status_code == 200
+    assert nombres() == ("ana.garcia", "Dinámica", "ana.garcia")
@@ -0,0 +1,86 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+import main
+
+
+class ColaPrueba(main.ColaResultados):
+    """Cola que no escribe en MySQL: registra los lotes y falla con las notas negativas."""
+
+    def __init__(self, directorio, lote=10):
+        super().__init__(str(directorio), 1000, lote, 0.01, "nunca")
+        self.escritos = []
+
+    def _escribir(self, lote):
+        if any(entrada["resultado"]["nota"] < 0 for entrada in lote):
+            raise ValueError("nota fuera de rango")
+        self.escritos.extend(entrada["recibo"] for entrada in lote)
+
+
+def _resultado(nota=5):
+    return {
+        "id_questionario": 1,
+        "id_usuarios": 1,
+        "nota": nota,
+        "fecha_completado": datetime(2024, 1, 1),
+        "total_correctas": 1,
+        "total_falladas": 0,
+    }
+
+
+def _spool_huerfano(directorio, nombre, recibos):
+    with open(os.path.join(directorio, f"{nombre}.jsonl"), "w", encoding="utf-8") as f:
+        for recibo in recibos:
+            f.write(json.dumps({"recibo": recibo, "resultado": _resultado()}, default=datetime.isoformat) + "\n")
+
+
+@pytest.fixture
+def recibos_en_sqlite(monkeypatch, sesiones):
+    monkeypatch.setattr(main, "SessionLocal", sesiones)
+
+
+def test_cada_proceso_escribe_en_su_propio_fichero(tmp_path):
+    cola = ColaPrueba(tmp_path)
+    cola.iniciar()
+    try:
+        assert cola.ruta == os.path.join(str(tmp_path), f"{os.getpid()}.jsonl")
+        cola.encolar(_resultado())
+    finally:
+        cola.cerrar()
+    assert len(cola.escritos) == 1
+    assert not os.listdir(tmp_path)
+
+
+def test_adopta_los_ficheros_de_procesos_muertos_y_respeta_los_vivos(tmp_path):
+    _spool_huerfano(tmp_path, "999991", ["muerto-1", "muerto-2"])
+    _spool_huerfano(tmp_path, "999992", ["vivo-1"])
+    vivo = main._bloquear_spool(str(tmp_path), "999992")
+    cola = ColaPrueba(tmp_path)
+    try:
+        cola.iniciar()
+        cola.cerrar()
+        assert sorted(cola.escritos) == ["muerto-1", "muerto-2"]
+        assert cola.estadisticas()["adoptados"] == 2
+        assert not os.path.exists(tmp_path / "999991.jsonl")
+        assert os.path.exists(tmp_path / "999992.jsonl")
+    finally:
+        main._liberar_spool(vivo)
+
+
+def test_un_resultado_que_falla_va_a_fallidos_sin_bloquear_el_lote(tmp_path, recibos_en_sqlite, sesiones):
+    cola = ColaPrueba(tmp_path, lote=8)
+    cola.iniciar()
+    try:
+        recibos = [cola.encolar(_resultado(-1 if i == 5 else 5)) for i in range(8)]
+    finally:
+        cola.cerrar()
+    assert sorted(cola.escritos) == sorted(recibos[:5] + recibos[6:])
+    with open(tmp_path / "fallidos.jsonl", encoding="utf-8") as f:
+        fallidos = [json.loads(linea) for linea in f]
+    assert [fallido["recibo"] for fallido in fallidos] == [recibos[5]]
+    db = sesiones()
+    assert "nota fuera de rango" in db.get(main.ReciboResultado, recibos[5]).error
+    db.close()
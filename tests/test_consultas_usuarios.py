@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import event
+
+import main
+
+
+def _crear_usuarios(sesiones, cantidad):
+    # Cada usuario con su propio rol: una carga perezosa de Usuario.rol costaría una consulta por fila
+    db = sesiones()
+    clase = main.Clase(nombre_clases="Física", descripcion_clases="Mecánica")
+    db.add(clase)
+    for i in range(cantidad):
+        usuario = main.Usuario(
+            rol=main.Rol(rol=f"rol{i}"),
+            usuario=f"usuario{i}",
+            email=f"usuario{i}@monlab.test",
+            contrasena="x",
+            estado="activa",
+        )
+        db.add(usuario)
+        db.flush()
+        db.add(main.ClaseUsuario(id_usuarios=usuario.id_usuarios, id_clases=clase.id_clases))
+    db.commit()
+    id_clases = clase.id_clases
+    db.close()
+    return id_clases
+
+
+def _contar_consultas(motor, cliente, ruta, esperadas):
+    sentencias = []
+
+    def contar(conn, cursor, statement, parameters, context, executemany):
+        sentencias.append(statement)
+
+    event.listen(motor, "before_cursor_execute", contar)
+    try:
+        respuesta = cliente.get(ruta)
+    finally:
+        event.remove(motor, "before_cursor_execute", contar)
+    assert respuesta.status_code == 200
+    assert len(respuesta.json()) == esperadas
+    assert all(usuario["rol"]["rol"] for usuario in respuesta.json())
+    return len(sentencias)
+
+
+@pytest.mark.parametrize("ruta", ["/usuarios/", "/clases/{id_clases}/participantes"])
+def test_listar_usuarios_no_depende_del_numero_de_filas(motor, sesiones, cliente, ruta):
+    consultas = {}
+    for cantidad in (1, 50):
+        id_clases = _crear_usuarios(sesiones, cantidad)
+        consultas[cantidad] = _contar_consultas(motor, cliente, ruta.format(id_clases=id_clases), cantidad)
+        main.Base.metadata.drop_all(motor)
+        main.Base.metadata.create_all(motor)
+    assert consultas[1] == consultas[50]
@@ -0,0 +1,61 @@
+import math
+
+import pytest
+
+import main
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def datos(sesiones):
+    db = sesiones()
+    db.add_all([
+        main.DatoExperimento(id_datos="a", id_experimento=1, masa1=1.5, velocidad3=None, tiempo4=0.1),
+        main.DatoExperimento(id_datos="b", id_experimento=1, masa1=None, velocidad3=-2.0, tiempo4=None),
+        # Un id que se parece a un NaN no debe verse afectado al escribir los nulos
+        main.DatoExperimento(id_datos="NaN", id_experimento=1, masa1=3.0),
+    ])
+    db.commit()
+    db.close()
+    return sesiones
+
+
+def test_medidas_nulas_pasan_a_nan(datos):
+    db = datos()
+    try:
+        ids, medidas = main._medidas_experimento(db, 1)
+    finally:
+        db.close()
+    assert ids == ["NaN", "a", "b"]
+    assert medidas.dtype == main.np.float64
+    assert medidas.shape == (3, len(main.COLUMNAS_MEDIDAS))
+    masa1 = main.COLUMNAS_MEDIDAS.index("masa1")
+    assert medidas[1, masa1] == 1.5
+    assert math.isnan(medidas[2, masa1])
+
+
+def test_json_devuelve_null_en_las_medidas_nulas(datos, cliente):
+    respuesta = cliente.get("/datos_experimentos/experimento/1/columnas")
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.json()
+    assert cuerpo["id_experimento"] == 1
+    assert cuerpo["filas"] == 3
+    assert cuerpo["id_datos"] == ["NaN", "a", "b"]
+    assert cuerpo["columnas"]["masa1"] == [3.0, 1.5, None]
+    assert cuerpo["columnas"]["velocidad3"] == [None, None, -2.0]
+    assert cuerpo["columnas"]["tiempo4"] == [None, 0.1, None]
+    assert set(cuerpo["columnas"]) == set(main.COLUMNAS_MEDIDAS)
+
+
+def test_arrow_conserva_los_nulos(datos, cliente):
+    pa = pytest.importorskip("pyarrow")
+    respuesta = cliente.get("/datos_experimentos/experimento/1/columnas", params={"formato": "arrow"})
+    assert respuesta.status_code == 200
+    tabla = pa.ipc.open_stream(respuesta.content).read_all()
+    assert tabla.column("masa1").to_pylist() == [3.0, 1.5, None]
+    assert tabla.column("velocidad3").null_count == 2
+
+
+def test_experimento_sin_datos(datos, cliente):
+    assert cliente.get("/datos_experimentos/experimento/2/columnas").status_code == 404
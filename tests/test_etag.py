@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+import main
+
+
+@pytest.fixture
+def clase(sesiones):
+    db = sesiones()
+    clase = main.Clase(nombre_clases="Física", descripcion_clases="Mecánica")
+    db.add(clase)
+    db.flush()
+    db.add(main.Temario(id_clases=clase.id_clases, nombre_temario="Cinemática", descrip_temario="MRU", contenido="tema1.pdf"))
+    db.commit()
+    id_clases = clase.id_clases
+    db.close()
+    return id_clases
+
+
+@pytest.fixture
+def nueva_cache(monkeypatch):
+    # Cada llamada simula un worker distinto con su propia caché local
+    def crear(ttl=60):
+        monkeypatch.setattr(main, "cache_catalogo", main.CacheLRU(100, ttl))
+    crear()
+    return crear
+
+
+@pytest.mark.parametrize("ruta", ["/clases/", "/temarios/clase/{id}", "/temarios/contenido/{id}"])
+def test_etag_igual_en_todos_los_workers_y_304(cliente, clase, nueva_cache, ruta):
+    ruta = ruta.format(id=clase)
+    etag = cliente.get(ruta).headers["etag"]
+    nueva_cache()
+    assert cliente.get(ruta).headers["etag"] == etag
+    respuesta = cliente.get(ruta, headers={"If-None-Match": etag})
+    assert respuesta.status_code == 304
+    assert respuesta.headers["etag"] == etag
+
+
+def test_etag_cambia_con_los_datos(cliente, clase, nueva_cache):
+    etag = cliente.get("/clases/").headers["etag"]
+    cliente.put(f"/clases/{clase}", params={"nombre_clases": "Física II", "descripcion_clases": "Dinámica"})
+    respuesta = cliente.get("/clases/", headers={"If-None-Match": etag})
+    assert respuesta.status_code == 200
+    assert respuesta.headers["etag"] != etag
+    assert respuesta.json()[0]["nombre_clases"] == "Física II"
+
+
+def test_cache_ttl_cero(cliente, clase, nueva_cache):
+    nueva_cache(ttl=0)
+    primera = cliente.get(f"/temarios/clase/{clase}")
+    assert primera.status_code == 200
+    assert cliente.get(f"/temarios/clase/{clase}").headers["etag"] == primera.headers["etag"]
+
+
+def test_revalidacion_sin_consultas_ni_hash(cliente, clase, nueva_cache, motor, monkeypatch):
+    ruta = f"/temarios/clase/{clase}"
+    etag = cliente.get(ruta).headers["etag"]
+
+    consultas = []
+    event.listen(motor, "before_cursor_execute", lambda *args: consultas.append(args[2]))
+    monkeypatch.setattr(main, "_etag_contenido", lambda contenido: pytest.fail("el ETag se vuelve a calcular"))
+    respuesta = cliente.get(ruta, headers={"If-None-Match": etag})
+    assert respuesta.status_code == 304
+    assert respuesta.headers["etag"] == etag
+    assert consultas == []
+
+
+@pytest.mark.parametrize("valor", ['{"clases": ', '["public"]', '{"clases": 60}', '{"clase": "public, max-age=60"}'])
+def test_cache_control_rutas_no_valido(valor):
+    with pytest.raises(ValueError):
+        main._leer_cache_control_rutas(valor)
+
+
+def test_cache_control_por_defecto_para_rutas_sin_configurar():
+    respuesta = main.Response()
+    assert main._condicional(SimpleNamespace(headers={}), respuesta, "otra_ruta", '"abc"') is None
+    assert respuesta.headers["cache-control"] == main.CACHE_CONTROL_POR_DEFECTO
+    assert main._leer_cache_control_rutas('{"clases": "public, max-age=60"}') == {"clases": "public, max-age=60"}
@@ -0,0 +1,42 @@
+import json
+
+import main
+
+RUTA = "/cuestionarios/importar/ndjson"
+
+
+def _trozos(*bloques):
+    # Sin Content-Length: el límite tiene que aplicarse mientras se lee el cuerpo
+    yield from bloques
+
+
+def test_lineas_no_validas_cuentan_para_el_maximo(cliente, monkeypatch):
+    monkeypatch.setattr(main, "IMPORTACION_MAX_DOCUMENTOS", 3)
+    respuesta = cliente.post(RUTA, content=b"{}\n" * 10)
+    assert respuesta.status_code == 413
+
+
+def test_errores_por_linea(cliente):
+    respuesta = cliente.post(RUTA, content=b'{}\n\n{"nombre_cuestionario": 1}')
+    assert respuesta.status_code == 422
+    assert [error["linea"] for error in respuesta.json()["detail"]["errores"]] == [1, 3]
+
+
+def test_linea_sin_salto_demasiado_larga(cliente, monkeypatch):
+    monkeypatch.setattr(main, "IMPORTACION_MAX_BYTES_LINEA", 100)
+    respuesta = cliente.post(RUTA, content=_trozos(*[b"x" * 40] * 5))
+    assert respuesta.status_code == 413
+    assert "línea 1" in respuesta.json()["detail"]
+
+
+def test_cuerpo_demasiado_grande(cliente, monkeypatch):
+    monkeypatch.setattr(main, "IMPORTACION_MAX_BYTES", 1000)
+    assert cliente.post(RUTA, content=b"\n" * 1001).status_code == 413
+    assert cliente.post(RUTA, content=_trozos(*[b"\n" * 300] * 4)).status_code == 413
+
+
+def test_lineas_partidas_entre_bloques(cliente):
+    linea = json.dumps({"nombre_cuestionario": 1}).encode()
+    respuesta = cliente.post(RUTA, content=_trozos(linea[:5], linea[5:] + b"\n" + linea[:3], linea[3:]))
+    assert respuesta.status_code == 422
+    assert [error["linea"] for error in respuesta.json()["detail"]["errores"]] == [1, 2]
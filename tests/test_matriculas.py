@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import select
+
+import main
+
+
+@pytest.fixture
+def clase(sesiones, monkeypatch):
+    # _matricular abre su propia sesión en el threadpool
+    monkeypatch.setattr(main, "SessionLocal", sesiones)
+    db = sesiones()
+    db.add(main.Rol(id_roles=1, rol="alumno"))
+    db.add_all([
+        main.Usuario(id_usuarios=u, id_roles=1, usuario=f"alumno{u}", email=f"alumno{u}@monlab.test", contrasena="x", estado="activa")
+        for u in (1, 2, 3)
+    ])
+    db.add(main.Clase(id_clases=1, nombre_clases="Clase", descripcion_clases=""))
+    db.add_all([main.ClaseUsuario(id_clases=1, id_usuarios=u) for u in (1, 2)])
+    db.commit()
+    db.close()
+    return sesiones
+
+
+def _matriculados(sesiones):
+    db = sesiones()
+    try:
+        return set(db.scalars(select(main.ClaseUsuario.id_usuarios).where(main.ClaseUsuario.id_clases == 1)))
+    finally:
+        db.close()
+
+
+def _importar(cliente, valores, **params):
+    return cliente.post("/clases/1/participantes/importar", params=params, json=valores)
+
+
+def test_objetos_sin_id_ni_email_se_informan(clase, cliente):
+    respuesta = _importar(cliente, [{"id_usuarios": 3}, {"nombre": "sin identificar"}, {"email": None}])
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.json()
+    assert cuerpo["matriculados"] == 1
+    assert cuerpo["ya_matriculados"] == 0
+    assert cuerpo["no_validos"] == ['{"nombre": "sin identificar"}', '{"email": null}']
+
+
+def test_sin_sincronizar_solo_anade(clase, cliente):
+    respuesta = _importar(cliente, ["alumno2@monlab.test", "alumno3@MONLAB.test", "nadie@monlab.test"])
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.json()
+    assert (cuerpo["matriculados"], cuerpo["ya_matriculados"], cuerpo["eliminados"]) == (1, 1, 0)
+    assert cuerpo["no_encontrados"] == ["nadie@monlab.test"]
+    assert _matriculados(clase) == {1, 2, 3}
+
+
+def test_sincronizar_elimina_las_matriculas_que_no_aparecen(clase, cliente):
+    respuesta = _importar(cliente, [2, "alumno3@monlab.test"], sincronizar="true")
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.json()
+    assert (cuerpo["matriculados"], cuerpo["ya_matriculados"], cuerpo["eliminados"]) == (1, 1, 1)
+    assert _matriculados(clase) == {2, 3}
+
+
+@pytest.mark.parametrize("valores", [[], ["nadie@monlab.test", 99], [{"nombre": "x"}]])
+def test_sincronizar_no_vacia_la_clase(clase, cliente, valores):
+    respuesta = _importar(cliente, valores, sincronizar="true")
+    assert respuesta.status_code == 400
+    assert _matriculados(clase) == {1, 2}
+
+
+def test_cuerpo_demasiado_grande(clase, cliente, monkeypatch):
+    monkeypatch.setattr(main, "MATRICULAS_MAX_BYTES", 64)
+    valores = [f"alumno{u}@monlab.test" for u in range(10)]
+    assert _importar(cliente, valores).status_code == 413
+
+    # Sin Content-Length el límite se aplica mientras se lee el cuerpo
+    trozos = (b"alumno1@monlab.test\n" for _ in range(10))
+    respuesta = cliente.post("/clases/1/participantes/importar", content=trozos, headers={"content-type": "text/csv"})
+    assert respuesta.status_code == 413
+    assert _matriculados(clase) == {1, 2}
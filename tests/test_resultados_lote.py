@@ -0,0 +1,122 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import func, select
+
+import main
+
+
+@pytest.fixture
+def datos(sesiones):
+    db = sesiones()
+    db.add(main.Rol(id_roles=1, rol="alumno"))
+    db.add(main.Usuario(id_usuarios=1, id_roles=1, usuario="alumno", email="alumno@monlab.test", contrasena="x", estado="activa"))
+    db.add(main.Clase(id_clases=1, nombre_clases="Clase", descripcion_clases=""))
+    db.add(main.Temario(id_temario=1, id_clases=1, nombre_temario="T1", descrip_temario=""))
+    db.add(main.Cuestionario(id_questionario=1, nombre_cuestionario="C1", descrip_cuestionario=""))
+    db.add(main.TemarioCuestionario(id=1, id_clases=1, id_questionario=1, id_temario=1))
+    # Un resultado previo para que los IDs del lote no empiecen en 1
+    db.add(main.ResultadoCuestionario(id_resultado_cuestionario=41, id_questionario=1, id_usuarios=1, nota=5,
+                                      fecha_completado=datetime(2024, 1, 1), total_correctas=5, total_falladas=5))
+    db.commit()
+    db.close()
+    return sesiones
+
+
+def _resultado(**cambios):
+    return {"id_questionario": 1, "id_usuarios": 1, "nota": 7, "total_correctas": 7, "total_falladas": 3, **cambios}
+
+
+def _resultados_en_bd(sesiones):
+    db = sesiones()
+    try:
+        return db.scalar(select(func.count()).select_from(main.ResultadoCuestionario))
+    finally:
+        db.close()
+
+
+def test_lote_valido_devuelve_los_ids_insertados(datos, cliente):
+    respuesta = cliente.post("/resultados_cuestionarios/lote", json=[_resultado(), _resultado(nota=9), _resultado(nota=1)])
+    assert respuesta.status_code == 200
+    assert respuesta.json() == {"insertados": 3, "ids": [42, 43, 44], "errores": []}
+
+    db = datos()
+    try:
+        notas = dict(db.execute(select(main.ResultadoCuestionario.id_resultado_cuestionario, main.ResultadoCuestionario.nota)).all())
+        resumen = db.get(main.ResumenNota, (1, 1, 1))
+    finally:
+        db.close()
+    assert notas == {41: 5, 42: 7, 43: 9, 44: 1}
+    assert (resumen.intentos, resumen.suma_notas) == (3, 17)
+
+
+def test_con_errores_y_sin_parcial_no_inserta_nada(datos, cliente):
+    respuesta = cliente.post("/resultados_cuestionarios/lote", json=[
+        _resultado(),
+        _resultado(nota="diez"),
+        _resultado(id_usuarios=99, id_questionario=98),
+    ])
+    assert respuesta.status_code == 422
+    errores = respuesta.json()["detail"]["errores"]
+    assert [error["indice"] for error in errores] == [1, 2]
+    assert errores[0]["errores"][0]["campo"] == "nota"
+    assert {fallo["campo"] for fallo in errores[1]["errores"]} == {"id_usuarios", "id_questionario"}
+    assert _resultados_en_bd(datos) == 1
+
+
+def test_con_parcial_inserta_los_validos_y_conserva_los_indices(datos, cliente):
+    respuesta = cliente.post("/resultados_cuestionarios/lote", params={"parcial": "true"}, json=[
+        _resultado(id_usuarios=99),
+        _resultado(),
+        {"nota": 3},
+        _resultado(nota=2),
+    ])
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.json()
+    assert cuerpo["insertados"] == 2
+    assert cuerpo["ids"] == [None, 42, None, 43]
+    assert [error["indice"] for error in cuerpo["errores"]] == [0, 2]
+    assert _resultados_en_bd(datos) == 3
+
+
+def test_lote_demasiado_grande(datos, cliente, monkeypatch):
+    monkeypatch.setattr(main, "RESULTADOS_LOTE_MAX", 2)
+    respuesta = cliente.post("/resultados_cuestionarios/lote", json=[_resultado()] * 3)
+    assert respuesta.status_code == 413
+    assert _resultados_en_bd(datos) == 1
+
+
+class _BDMySQL:
+    """Sesión mínima con el comportamiento de MySQL que usa _insertar_en_bloque."""
+
+    class _Resultado:
+        def __init__(self, lastrowid=None, escalar=None):
+            self.lastrowid = lastrowid
+            self._escalar = escalar
+
+        def scalar(self):
+            return self._escalar
+
+    def __init__(self, last_insert_id, incremento):
+        self.last_insert_id = last_insert_id
+        self.incremento = incremento
+        self.sentencias = []
+
+    def get_bind(self):
+        return SimpleNamespace(dialect=SimpleNamespace(name="mysql"))
+
+    def execute(self, sentencia):
+        self.sentencias.append(str(sentencia))
+        if "@@auto_increment_increment" in str(sentencia):
+            return self._Resultado(escalar=self.incremento)
+        return self._Resultado(lastrowid=self.last_insert_id)
+
+
+@pytest.mark.parametrize("incremento, esperado", [(1, [100, 101, 102]), (2, [100, 102, 104])])
+def test_ids_a_partir_de_last_insert_id_y_auto_increment_increment(incremento, esperado):
+    db = _BDMySQL(last_insert_id=100, incremento=incremento)
+    ids = main._insertar_en_bloque(db, main.ResultadoCuestionario.__table__, [_resultado(fecha_completado=datetime(2024, 1, 1))] * 3)
+    assert ids == esperado
+    # Una sola sentencia INSERT multi-fila
+    assert sum(sentencia.startswith("INSERT") for sentencia in db.sentencias) == 1
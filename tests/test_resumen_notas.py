@@ -0,0 +1,124 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+import main
+
+
+@pytest.fixture
+def datos(sesiones, monkeypatch):
+    # Sin escritura diferida: los resultados se escriben dentro de la petición
+    monkeypatch.setattr(main, "cola_resultados", None)
+    db = sesiones()
+    db.add(main.Rol(id_roles=1, rol="alumno"))
+    db.add_all([
+        main.Usuario(id_usuarios=u, id_roles=1, usuario=f"alumno{u}", email=f"alumno{u}@monlab.test", contrasena="x", estado="activa")
+        for u in (1, 2)
+    ])
+    db.add_all([main.Clase(id_clases=c, nombre_clases=f"Clase {c}", descripcion_clases="") for c in (1, 2)])
+    db.add_all([
+        main.Temario(id_temario=1, id_clases=1, nombre_temario="T1", descrip_temario=""),
+        main.Temario(id_temario=2, id_clases=1, nombre_temario="T2", descrip_temario=""),
+        main.Temario(id_temario=3, id_clases=2, nombre_temario="T3", descrip_temario=""),
+    ])
+    db.add_all([main.Cuestionario(id_questionario=q, nombre_cuestionario=f"C{q}", descrip_cuestionario="") for q in (1, 2)])
+    # El cuestionario 1 está enlazado a dos temarios de la clase 1: no debe contar doble
+    db.add_all([
+        main.TemarioCuestionario(id=1, id_clases=1, id_questionario=1, id_temario=1),
+        main.TemarioCuestionario(id=2, id_clases=1, id_questionario=1, id_temario=2),
+        main.TemarioCuestionario(id=3, id_clases=2, id_questionario=2, id_temario=3),
+    ])
+    db.add_all([
+        main.ResultadoCuestionario(id_resultado_cuestionario=1, id_questionario=1, id_usuarios=1, nota=4,
+                                   fecha_completado=datetime(2024, 1, 1), total_correctas=4, total_falladas=6),
+        main.ResultadoCuestionario(id_resultado_cuestionario=2, id_questionario=1, id_usuarios=1, nota=9,
+                                   fecha_completado=datetime(2024, 1, 2), total_correctas=9, total_falladas=1),
+        main.ResultadoCuestionario(id_resultado_cuestionario=3, id_questionario=2, id_usuarios=2, nota=7,
+                                   fecha_completado=datetime(2024, 1, 3), total_correctas=7, total_falladas=3),
+    ])
+    db.commit()
+    main.reconstruir_resumen(db)
+    db.commit()
+    db.close()
+    return sesiones
+
+
+def _resumen(db):
+    filas = db.execute(select(main.ResumenNota).order_by(
+        main.ResumenNota.id_clases, main.ResumenNota.id_usuarios, main.ResumenNota.id_questionario
+    )).scalars()
+    return [
+        {columna.name: getattr(fila, columna.name) for columna in main.ResumenNota.__table__.columns}
+        for fila in filas
+    ]
+
+
+def _comprobar_igual_a_reconstruido(sesiones):
+    db = sesiones()
+    try:
+        incremental = _resumen(db)
+        main.reconstruir_resumen(db)
+        assert incremental == _resumen(db)
+        db.rollback()
+        return incremental
+    finally:
+        db.close()
+
+
+def test_reconstruir_cuenta_cada_resultado_una_vez(datos):
+    resumen = _comprobar_igual_a_reconstruido(datos)
+    assert resumen[0] == {
+        "id_clases": 1, "id_usuarios": 1, "id_questionario": 1, "intentos": 2, "nota_max": 9, "suma_notas": 13,
+        "nota_ultima": 9, "fecha_ultima": datetime(2024, 1, 2), "total_correctas": 13, "total_falladas": 7,
+    }
+
+
+def test_crear_resultado_suma_al_resumen(datos, cliente):
+    respuesta = cliente.post("/resultados_cuestionarios/", params={
+        "id_questionario": 1, "id_usuarios": 1, "nota": 2, "total_correctas": 2, "total_falladas": 8,
+    })
+    assert respuesta.status_code == 200
+    respuesta = cliente.post("/resultados_cuestionarios/", params={
+        "id_questionario": 1, "id_usuarios": 2, "nota": 10, "total_correctas": 10, "total_falladas": 0,
+    })
+    assert respuesta.status_code == 200
+
+    resumen = _comprobar_igual_a_reconstruido(datos)
+    fila = next(f for f in resumen if (f["id_usuarios"], f["id_questionario"]) == (1, 1))
+    assert (fila["intentos"], fila["nota_max"], fila["nota_ultima"]) == (3, 9, 2)
+
+
+def test_modificar_resultado_recalcula_el_resumen(datos, cliente):
+    # Se mueve el resultado 2 al cuestionario 2: cambian dos grupos y dos clases
+    respuesta = cliente.put("/resultados_cuestionarios/2", params={
+        "id_questionario": 2, "id_usuarios": 1, "nota": 6, "fecha_completado": "2024-01-05T00:00:00",
+        "total_correctas": 6, "total_falladas": 4,
+    })
+    assert respuesta.status_code == 200
+
+    resumen = _comprobar_igual_a_reconstruido(datos)
+    assert {(f["id_clases"], f["id_usuarios"], f["id_questionario"], f["intentos"]) for f in resumen} == {
+        (1, 1, 1, 1), (2, 1, 2, 1), (2, 2, 2, 1),
+    }
+
+
+def test_borrar_resultado_recalcula_el_resumen(datos, cliente):
+    assert cliente.delete("/resultados_cuestionarios/3").status_code == 200
+
+    resumen = _comprobar_igual_a_reconstruido(datos)
+    assert [(f["id_usuarios"], f["id_questionario"]) for f in resumen] == [(1, 1)]
+
+
+def test_cambiar_enlaces_de_temarios_recalcula_el_resumen(datos, cliente):
+    # El cuestionario 2 pasa también a la clase 1 y luego deja la clase 2
+    respuesta = cliente.post("/temarios_cuestionarios/", params={"id_clases": 1, "id_questionario": 2, "id_temario": 1})
+    assert respuesta.status_code == 200
+    assert {(f["id_clases"], f["id_questionario"]) for f in _comprobar_igual_a_reconstruido(datos)} == {(1, 1), (1, 2), (2, 2)}
+
+    assert cliente.delete("/temarios_cuestionarios/3").status_code == 200
+    assert {(f["id_clases"], f["id_questionario"]) for f in _comprobar_igual_a_reconstruido(datos)} == {(1, 1), (1, 2)}
+
+    respuesta = cliente.put("/temarios_cuestionarios/1", params={"id_clases": 2, "id_questionario": 1, "id_temario": 3})
+    assert respuesta.status_code == 200
+    assert {(f["id_clases"], f["id_questionario"]) for f in _comprobar_igual_a_reconstruido(datos)} == {(1, 1), (1, 2), (2, 1)}
@@ -0,0 +1,12 @@
+import main
+
+RUTA = "/experimentos/1/series/importar"
+
+
+def test_csv_demasiado_grande(cliente, monkeypatch):
+    monkeypatch.setattr(main, "SERIES_MAX_BYTES", 100)
+    assert cliente.post(RUTA, content=b"masa\n" + b"1.0\n" * 30).status_code == 413
+
+    # Sin Content-Length el límite se aplica mientras se lee el cuerpo
+    trozos = (b"1.0\n" * 10 for _ in range(5))
+    assert cliente.post(RUTA, content=trozos).status_code == 413